@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os  # <-- ADD THIS
+import tempfile
 from dotenv import load_dotenv  
 import dj_database_url
 
@@ -60,6 +61,7 @@ INSTALLED_APPS = [
 SITE_ID = 1
 
 MIDDLEWARE = [
+    'chatapp.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -69,6 +71,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware', 
+    'chatapp.middleware.ReadYourWritesMiddleware',
 ]
 
 ROOT_URLCONF = 'Collab_X.urls'
@@ -94,19 +97,71 @@ CHANNEL_LAYERS = {
         "BACKEND": "channels.layers.InMemoryChannelLayer"
     }
 }
+
+# Shared cache: identity versions, room access, signed URLs, conversation
+# pages and template fragments. Set REDIS_URL when running several
+# workers; the in-process fallback only suits a single one.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'collabx',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'collabx',
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('LOCAL_CACHE_MAX_ENTRIES', 10000))},
+        }
+    }
 WSGI_APPLICATION = 'Collab_X.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# DATABASE_URL picks the database; without it (local runs, the test suite)
+# a SQLite file next to manage.py is used
 DATABASES = {
     'default': dj_database_url.config(
-        default=os.environ.get('DATABASE_URL'),
+        default=os.environ.get('DATABASE_URL') or f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
         conn_max_age=600
     )
 }
 
+# Optional read replica for history, search and sidebar reads (see chatapp/db_routers.py).
+# Two local SQLite files work for trying it out:
+#   DATABASE_REPLICA_URL=sqlite:///replica.sqlite3 python manage.py migrate --database replica
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+if DATABASE_REPLICA_URL:
+    DATABASES['replica'] = dj_database_url.parse(DATABASE_REPLICA_URL, conn_max_age=600)
+    # Tests run against the primary only
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+    DATABASE_ROUTERS = ['chatapp.db_routers.ReplicaRouter']
+
+# After a user writes, their reads stay on the primary for this many seconds
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get('DATABASE_REPLICA_PIN_SECONDS', 5))
+
+# psycopg 3 connection pool (Postgres only). Pooled connections replace
+# persistent ones, so CONN_MAX_AGE must be 0.
+DB_POOL_ENABLED = os.environ.get('DB_POOL_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 2))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+if DB_POOL_ENABLED:
+    for _db in DATABASES.values():
+        if _db.get('ENGINE') == 'django.db.backends.postgresql':
+            _db['CONN_MAX_AGE'] = 0
+            _db.setdefault('OPTIONS', {})['pool'] = {
+                'min_size': DB_POOL_MIN_SIZE,
+                'max_size': DB_POOL_MAX_SIZE,
+                'timeout': DB_POOL_TIMEOUT,
+            }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -144,6 +199,8 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
+# collectstatic minifies our CSS/JS bundles (rcssmin/rjsmin) before hashing
+STATIC_MINIFY = os.environ.get('STATIC_MINIFY', 'True').lower() in ('1', 'true', 'yes')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -170,13 +227,24 @@ MEDIA_URL = '/media/'
 
 # --- Backblaze B2 (Private Bucket) Media Storage ---
 
-DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
-
 # Get credentials from Render environment variables
 AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
 AWS_STORAGE_BUCKET_NAME = os.environ.get('AWS_STORAGE_BUCKET_NAME')
 
+# Media goes to the bucket when one is configured, local MEDIA_ROOT otherwise
+# (DEFAULT_FILE_STORAGE is no longer read by Django 5.1+).
+STORAGES = {
+    'default': {
+        'BACKEND': 'chatapp.storage.CachedSignedS3Storage' if AWS_STORAGE_BUCKET_NAME
+        else 'django.core.files.storage.FileSystemStorage',
+    },
+    # Minified, fingerprinted and gzip/brotli-compressed by collectstatic
+    'staticfiles': {
+        'BACKEND': 'chatapp.storage.MinifiedStaticFilesStorage',
+    },
+}
+
 # This is the critical part for Backblaze
 AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL')
 
@@ -190,6 +258,10 @@ AWS_DEFAULT_ACL = None  # Use None for private
 
 # 2. We MUST use query string auth to generate temporary links
 AWS_QUERYSTRING_AUTH = True
+AWS_QUERYSTRING_EXPIRE = int(os.environ.get('AWS_QUERYSTRING_EXPIRE', 3600))
+# Presigned URLs are reused across workers (via the cache) until this many
+# seconds before they expire.
+SIGNED_URL_REFRESH_MARGIN = int(os.environ.get('SIGNED_URL_REFRESH_MARGIN', 300))
 
 # --- End of B2 Config ---
 MEDIA_ROOT = BASE_DIR / 'media'
@@ -197,4 +269,135 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # --- ADD THIS ---
 # Gemini API Key (loaded from .env)
 GOOGLE_GEMINI_API_KEY = os.getenv('GOOGLE_GEMINI_API_KEY')
-# --- END ADD ---
\ No newline at end of file
+# --- END ADD ---
+
+# Scratch directory where workspace trees are materialized for execution.
+# Defaults to the system temp dir when unset.
+WORKSPACE_SCRATCH_ROOT = os.environ.get('WORKSPACE_SCRATCH_ROOT')
+
+# Opt-in cache for deterministic code executions (memory + disk, TTL + LRU)
+CODE_EXECUTION_CACHE_ENABLED = os.environ.get('CODE_EXECUTION_CACHE_ENABLED', 'False').lower() in ('1', 'true', 'yes')
+CODE_EXECUTION_CACHE_TTL = int(os.environ.get('CODE_EXECUTION_CACHE_TTL', 600))
+CODE_EXECUTION_CACHE_MAX_ENTRIES = int(os.environ.get('CODE_EXECUTION_CACHE_MAX_ENTRIES', 256))
+CODE_EXECUTION_CACHE_DIR = os.environ.get('CODE_EXECUTION_CACHE_DIR')
+
+# Collab-X bot model provider: 'gemini', 'stub' (offline, deterministic) or a dotted class path
+COLLAB_LLM_BACKEND = os.environ.get('COLLAB_LLM_BACKEND', 'gemini')
+COLLAB_LLM_MODEL = os.environ.get('COLLAB_LLM_MODEL', 'gemini-2.5-flash')
+COLLAB_LLM_TIMEOUT = float(os.environ.get('COLLAB_LLM_TIMEOUT', 30))
+COLLAB_LLM_MAX_RETRIES = int(os.environ.get('COLLAB_LLM_MAX_RETRIES', 2))
+COLLAB_LLM_STUB_LATENCY = float(os.environ.get('COLLAB_LLM_STUB_LATENCY', 0.5))
+COLLAB_LLM_STUB_TOKEN_DELAY = float(os.environ.get('COLLAB_LLM_STUB_TOKEN_DELAY', 0.02))
+
+# /Collab context: rolling summary + the most recent messages verbatim
+COLLAB_CONTEXT_TAIL = int(os.environ.get('COLLAB_CONTEXT_TAIL', 20))
+COLLAB_SUMMARY_BATCH = int(os.environ.get('COLLAB_SUMMARY_BATCH', 20))
+COLLAB_SUMMARY_MAX_BATCH = int(os.environ.get('COLLAB_SUMMARY_MAX_BATCH', 200))
+# After a delete the summary is re-folded from a checkpoint (one per recent
+# fold) at most this many max batches back; a failed rebuild is retried
+# from the read path after COLLAB_SUMMARY_RETRY_SECONDS
+COLLAB_SUMMARY_CHECKPOINTS = int(os.environ.get('COLLAB_SUMMARY_CHECKPOINTS', 10))
+COLLAB_SUMMARY_REBUILD_BATCHES = int(os.environ.get('COLLAB_SUMMARY_REBUILD_BATCHES', 5))
+COLLAB_SUMMARY_RETRY_SECONDS = int(os.environ.get('COLLAB_SUMMARY_RETRY_SECONDS', 60))
+COLLAB_RETRIEVAL_TOP_K = int(os.environ.get('COLLAB_RETRIEVAL_TOP_K', 12))
+COLLAB_RETRIEVAL_MAX_ROOMS = int(os.environ.get('COLLAB_RETRIEVAL_MAX_ROOMS', 64))
+# Until a room's index is built, queries search only its newest messages
+COLLAB_RETRIEVAL_COLD_SEED = int(os.environ.get('COLLAB_RETRIEVAL_COLD_SEED', 2000))
+COLLAB_CONTEXT_TOKEN_BUDGET = int(os.environ.get('COLLAB_CONTEXT_TOKEN_BUDGET', 6000))
+
+# /Collab request queue: concurrent model calls per process, per room, and max waiting requests
+COLLAB_BOT_MAX_CONCURRENCY = int(os.environ.get('COLLAB_BOT_MAX_CONCURRENCY', 4))
+COLLAB_BOT_PER_ROOM_CONCURRENCY = int(os.environ.get('COLLAB_BOT_PER_ROOM_CONCURRENCY', 1))
+COLLAB_BOT_MAX_QUEUE = int(os.environ.get('COLLAB_BOT_MAX_QUEUE', 100))
+
+# Query budgets per HTTP view (http:<url name>) and WebSocket frame
+# (ws:<Consumer>:<frame type>); overruns are logged. Set
+# QUERY_BUDGET_REPORT_PATH to append one JSON line per request/frame for
+# `manage.py query_budget_report`. Chat messages and deletes also move the
+# conversation's last-message pointer (chatapp/activity.py): one more query.
+# A delete is the soft-delete UPDATE, that pointer's preview and marking the
+# bot summary stale (chatapp/bot_context.py).
+QUERY_BUDGET_ENABLED = os.environ.get('QUERY_BUDGET_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+QUERY_BUDGET_REPORT_PATH = os.environ.get('QUERY_BUDGET_REPORT_PATH')
+QUERY_BUDGET_DEFAULT_HTTP = int(os.environ.get('QUERY_BUDGET_DEFAULT_HTTP', 30))
+QUERY_BUDGET_DEFAULT_FRAME = int(os.environ.get('QUERY_BUDGET_DEFAULT_FRAME', 5))
+QUERY_BUDGETS = {
+    'http:chatapp:dashboard': 10,
+    'http:chatapp:dashboard_chat': 12,
+    'http:chatapp:dashboard_group_chat': 12,
+    'http:chatapp:search_users': 6,
+    'http:chatapp:conversation': 5,
+    'http:chatapp:attachment': 4,
+    'ws:ChatConsumer:connect': 1,
+    'ws:ChatConsumer:chat_message': 2,
+    'ws:ChatConsumer:delete_message': 3,
+    'ws:GroupChatConsumer:connect': 2,
+    'ws:GroupChatConsumer:chat_message': 2,
+    'ws:GroupChatConsumer:delete_message': 3,
+    'ws:WorkspaceConsumer:connect': 1,
+    'ws:WorkspaceConsumer:write_file': 2,
+    'ws:WorkspaceConsumer:cursor_update': 0,
+    'ws:WorkspaceConsumer:file_focus': 0,
+    'ws:WorkspaceConsumer:read_file': 1,
+    'ws:WorkspaceConsumer:list_files': 1,
+}
+
+# Process-local identity cache (username, display name, avatar, color).
+# Entries re-check their shared-cache version at most this often.
+IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 2048))
+IDENTITY_CACHE_CHECK_SECONDS = float(os.environ.get('IDENTITY_CACHE_CHECK_SECONDS', 5))
+
+# Cached "may this user use this chat/workspace" answers. Contact and
+# membership changes invalidate them immediately (and close revoked
+# sockets), so the TTL only bounds memory.
+ROOM_ACCESS_CACHE_SECONDS = int(os.environ.get('ROOM_ACCESS_CACHE_SECONDS', 300))
+# Sockets of one process reuse a grant this long (0 disables); a revoke
+# made in another process can take this long to be seen here
+ROOM_ACCESS_LOCAL_SECONDS = float(os.environ.get('ROOM_ACCESS_LOCAL_SECONDS', 2))
+
+# User search (chatapp/user_directory.py): candidate rows per query, how
+# long a query's candidates are shared between viewers, and page size.
+USER_SEARCH_CANDIDATES = int(os.environ.get('USER_SEARCH_CANDIDATES', 200))
+USER_SEARCH_CACHE_SECONDS = int(os.environ.get('USER_SEARCH_CACHE_SECONDS', 30))
+USER_SEARCH_PAGE_SIZE = int(os.environ.get('USER_SEARCH_PAGE_SIZE', 20))
+
+# Large attachments: direct multipart uploads to the bucket when media is
+# on S3, resumable chunked uploads (staged in CHUNKED_UPLOAD_DIR) otherwise.
+# The bucket needs a CORS rule allowing PUT from the site and exposing ETag.
+ATTACHMENT_MAX_UPLOAD_SIZE = int(os.environ.get('ATTACHMENT_MAX_UPLOAD_SIZE', 500 * 1024 * 1024))
+ATTACHMENT_CHUNK_SIZE = int(os.environ.get('ATTACHMENT_CHUNK_SIZE', 8 * 1024 * 1024))
+CHUNKED_UPLOAD_DIR = os.environ.get('CHUNKED_UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'collabx-uploads'))
+
+# In-process background worker pool (chatapp/background.py). EAGER runs
+# tasks inline, for scripts and tests.
+BACKGROUND_WORKERS = int(os.environ.get('BACKGROUND_WORKERS', 2))
+BACKGROUND_TASKS_EAGER = os.environ.get('BACKGROUND_TASKS_EAGER', 'False').lower() in ('1', 'true', 'yes')
+
+# Resized WEBP variants (longest edge in px) of image attachments and avatars
+THUMBNAIL_SIZES = {
+    'attachment': {'md': 320, 'lg': 1280},
+    'avatar': {'sm': 64, 'md': 160},
+}
+THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', 80))
+
+# Uploads are hashed as they stream in; identical attachments are stored
+# once and shared by reference (chatapp/blobs.py).
+FILE_UPLOAD_HANDLERS = [
+    'chatapp.attachments.HashingMemoryFileUploadHandler',
+    'chatapp.attachments.HashingTemporaryFileUploadHandler',
+]
+# `manage.py purge_attachments` frees the files of deleted messages this
+# many days old, and of every message older than ATTACHMENT_RETENTION_DAYS
+# when that is set.
+ATTACHMENT_PURGE_DELETED_DAYS = int(os.environ.get('ATTACHMENT_PURGE_DELETED_DAYS', 7))
+ATTACHMENT_RETENTION_DAYS = int(os.environ['ATTACHMENT_RETENTION_DAYS']) if os.environ.get('ATTACHMENT_RETENTION_DAYS') else None
+
+# Chat switches (chatapp/conversations.py): messages per page (JSON and the
+# dashboard), and how long the newest page of an unchanged room stays cached.
+CONVERSATION_PAGE_SIZE = int(os.environ.get('CONVERSATION_PAGE_SIZE', 100))
+CONVERSATION_CACHE_SECONDS = int(os.environ.get('CONVERSATION_CACHE_SECONDS', 300))
+
+# Dashboard sidebar and message-list {% cache %} fragments
+# (chatapp/fragments.py); capped below SIGNED_URL_REFRESH_MARGIN when media
+# URLs are presigned.
+FRAGMENT_CACHE_SECONDS = int(os.environ.get('FRAGMENT_CACHE_SECONDS', 600))
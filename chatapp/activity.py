@@ -0,0 +1,165 @@
+# chatapp/activity.py
+
+import hashlib
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.text import Truncator
+
+from . import metrics
+from .conversations import conversation_versions, message_room_key
+from .models import ConversationActivity, Message, GroupMessage
+from .rooms import parse_room_key
+
+PREVIEW_LENGTH = 80
+# What the consumers put in a soft-deleted message
+DELETED_PREVIEW = "This message was deleted."
+
+
+def preview_text(message):
+    """One line of a message for the sidebar (the 0017 backfill mirrors it)."""
+    text = re.sub(r'\s+', ' ', message.content or '').strip()
+    if message.file and not message.is_deleted:
+        text = f"\U0001F4CE {text or message.file_name or 'Attachment'}"
+    return Truncator(text).chars(PREVIEW_LENGTH)
+
+
+def _activity_fields(message):
+    return {
+        'last_message_id': message.id,
+        'last_sender_id': message.sender_id,
+        'preview': preview_text(message),
+        'last_message_at': message.timestamp,
+    }
+
+
+def _upsert_sql(connection):
+    table = connection.ops.quote_name(ConversationActivity._meta.db_table)
+    columns = ('last_message_id', 'last_sender_id', 'preview', 'last_message_at')
+    return (
+        f"INSERT INTO {table} (room_key, {', '.join(columns)}) VALUES (%s, %s, %s, %s, %s) "
+        f"ON CONFLICT (room_key) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in columns)} "
+        f"WHERE {table}.last_message_id < excluded.last_message_id"
+    )
+
+
+def record_message(message):
+    """
+    Point the room's activity at `message` unless a newer one got there
+    first. One statement on SQLite and Postgres (an upsert that only moves
+    the pointer forward), so a chat message costs a single extra query.
+    """
+    room_key = message_room_key(message)
+    fields = _activity_fields(message)
+    connection = connections[router.db_for_write(ConversationActivity)]
+    if connection.vendor in ('sqlite', 'postgresql'):
+        with connection.cursor() as cursor:
+            cursor.execute(_upsert_sql(connection), [
+                room_key, fields['last_message_id'], fields['last_sender_id'], fields['preview'],
+                connection.ops.adapt_datetimefield_value(fields['last_message_at']),
+            ])
+        return
+    newer = ConversationActivity.objects.filter(room_key=room_key, last_message_id__lt=message.id)
+    if not newer.update(**fields):
+        _, created = ConversationActivity.objects.get_or_create(room_key=room_key, defaults=fields)
+        if not created:
+            # Lost a race with the row's first insert
+            newer.update(**fields)
+
+
+def refresh_room(room_key):
+    """Recompute a room's pointer from its newest remaining message."""
+    kind, ids = parse_room_key(room_key)
+    if kind == 'direct':
+        a, b = ids
+        messages = Message.objects.filter(Q(sender_id=a, receiver_id=b) | Q(sender_id=b, receiver_id=a))
+    elif kind == 'group':
+        messages = GroupMessage.objects.filter(group_id=ids[0])
+    else:
+        return
+    latest = messages.defer('rendered_html', 'thumbnails').order_by('-id').first()
+    if latest is None:
+        ConversationActivity.objects.filter(room_key=room_key).delete()
+    else:
+        ConversationActivity.objects.update_or_create(room_key=room_key, defaults=_activity_fields(latest))
+    metrics.incr('activity.refreshes')
+
+
+def message_deleted(room_key, message_id):
+    """A message was soft-deleted: update the preview if it was the room's newest."""
+    ConversationActivity.objects.filter(room_key=room_key, last_message_id=message_id).update(
+        preview=DELETED_PREVIEW
+    )
+
+
+def _when(moment):
+    moment = timezone.localtime(moment)
+    today = timezone.localdate()
+    if moment.date() == today:
+        return moment.strftime('%I:%M %p')
+    if (today - moment.date()).days < 7:
+        return moment.strftime('%a')
+    return moment.strftime('%b %d')
+
+
+def activity_version(room_keys):
+    """
+    Key of the sidebar's activity fragment: the conversation versions of
+    every room in it, which each message write, soft delete and hard delete
+    already bumps (see conversations.py). No per-member fan-out on write.
+    """
+    versions = conversation_versions(room_keys)
+    parts = [f'{room_key}:{versions[room_key]}' for room_key in sorted(room_keys)]
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _sidebar_chat(viewer_id, room_key):
+    # How the sidebar items name their chat: data-chat="<chat_type>:<chat_id>"
+    kind, ids = parse_room_key(room_key)
+    if kind == 'direct':
+        return f'1on1:{ids[1] if ids[0] == viewer_id else ids[0]}'
+    return f'group:{ids[0]}'
+
+
+def sidebar_activity(viewer_id, room_keys):
+    """
+    {"<chat_type>:<chat_id>": {preview, time, at}} for the sidebar chats
+    that have messages, in one query. The page script fills the previews in
+    and orders each section by `at`, most recent first.
+    """
+    if not room_keys:
+        return {}
+    activity = {}
+    rows = ConversationActivity.objects.filter(room_key__in=list(room_keys)).select_related('last_sender__profile')
+    for row in rows:
+        preview = row.preview
+        if row.last_sender_id == viewer_id:
+            preview = f'You: {preview}'
+        elif row.last_sender and row.room_key.startswith('group_'):
+            preview = f'{row.last_sender.profile.display_name or row.last_sender.username}: {preview}'
+        activity[_sidebar_chat(viewer_id, row.room_key)] = {
+            'preview': preview,
+            'time': _when(row.last_message_at),
+            'at': row.last_message_at.timestamp(),
+        }
+    return activity
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=GroupMessage)
+def message_saved(sender, instance, created, **kwargs):
+    if created:
+        record_message(instance)
+
+
+# Hard deletes (user or group deletion, purges) only matter for the newest message
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=GroupMessage)
+def message_removed(sender, instance, **kwargs):
+    room_key = message_room_key(instance)
+    if ConversationActivity.objects.filter(room_key=room_key, last_message_id=instance.id).exists():
+        refresh_room(room_key)
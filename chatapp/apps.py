@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class ChatappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chatapp'
+
+    def ready(self):
+        # Installs the per-connection query counter plus the identity-cache,
+        # room-access, user-directory, avatar-thumbnail, blob-release,
+        # conversation-version, sidebar-fragment, message-body and
+        # conversation-activity signals
+        from . import (  # noqa: F401
+            query_budget, identity, room_access, user_directory, thumbnails, blobs, conversations, fragments, rendering,
+            activity,
+        )
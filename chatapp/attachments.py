@@ -0,0 +1,83 @@
+# chatapp/attachments.py
+
+import hashlib
+import mimetypes
+
+from django.core.files.images import get_image_dimensions
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+METADATA_FIELDS = ('file_size', 'content_type', 'checksum', 'image_width', 'image_height')
+
+
+class _HashingUploadHandlerMixin:
+    """
+    sha256 of an uploaded file computed as the request body streams in, so
+    attachment_metadata does not have to read the upload a second time.
+    The digest ends up on the UploadedFile as `sha256`.
+    """
+
+    def new_file(self, *args, **kwargs):
+        self._digest = hashlib.sha256()
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        passed_on = super().receive_data_chunk(raw_data, start)
+        if passed_on is None:
+            # This handler kept the chunk (the memory handler passes chunks
+            # through to the temporary-file one for large uploads)
+            self._digest.update(raw_data)
+        return passed_on
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is not None:
+            uploaded.sha256 = self._digest.hexdigest()
+        return uploaded
+
+
+class HashingMemoryFileUploadHandler(_HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(_HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def attachment_metadata(file, name=None, content_type=None):
+    """
+    Size, content type, sha256 and (for images) dimensions of `file`,
+    read once so templates never have to ask the storage backend again.
+    `file` may be an UploadedFile or an open storage File.
+    """
+    name = name or getattr(file, 'name', '') or ''
+    content_type = (content_type or getattr(file, 'content_type', None)
+                    or mimetypes.guess_type(name)[0] or 'application/octet-stream')
+
+    checksum = getattr(file, 'sha256', None)
+    if checksum:
+        # Hashed while it was uploaded (see the upload handlers above)
+        size = file.size
+    else:
+        digest = hashlib.sha256()
+        size = 0
+        file.seek(0)
+        for chunk in file.chunks():
+            digest.update(chunk)
+            size += len(chunk)
+        checksum = digest.hexdigest()
+
+    width = height = None
+    if content_type.startswith('image/'):
+        try:
+            width, height = get_image_dimensions(file, close=False)
+        except Exception as e:
+            print(f"Could not read image dimensions of {name}: {e}")
+    file.seek(0)
+
+    return {
+        'file_size': size,
+        'content_type': content_type[:100],
+        'checksum': checksum,
+        'image_width': width,
+        'image_height': height,
+    }
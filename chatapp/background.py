@@ -0,0 +1,73 @@
+# chatapp/background.py
+
+import atexit
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import SyncToAsync
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from . import metrics
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'BACKGROUND_WORKERS', 2),
+            thread_name_prefix='collabx-bg',
+        )
+        atexit.register(_executor.shutdown, wait=False, cancel_futures=True)
+        metrics.register_gauge('background.pending', lambda: _executor._work_queue.qsize() if _executor else 0)
+    return _executor
+
+
+def _run(fn, args, kwargs):
+    try:
+        fn(*args, **kwargs)
+        metrics.incr('background.done')
+    except Exception as e:
+        metrics.incr('background.failed')
+        print(f"Background task {fn.__name__} failed: {e}")
+
+
+def _run_in_worker(main_event_loop, fn, args, kwargs):
+    # Let async_to_sync (e.g. channel layer group_send) run on the server's
+    # event loop, as it does from request threads; the in-memory channel
+    # layer only delivers within one loop.
+    SyncToAsync.threadlocal.main_event_loop = main_event_loop
+    SyncToAsync.threadlocal.main_event_loop_pid = os.getpid() if main_event_loop else None
+    # Worker threads keep their own DB connections; drop stale ones around each task
+    close_old_connections()
+    try:
+        _run(fn, args, kwargs)
+    finally:
+        close_old_connections()
+
+
+def submit(fn, *args, **kwargs):
+    """
+    Run `fn` on the in-process worker pool, off the request path. With
+    BACKGROUND_TASKS_EAGER the task runs inline instead (tests, scripts).
+    """
+    if getattr(settings, 'BACKGROUND_TASKS_EAGER', False):
+        _run(fn, args, kwargs)
+        return
+    main_event_loop = getattr(SyncToAsync.threadlocal, 'main_event_loop', None)
+    _get_executor().submit(_run_in_worker, main_event_loop, fn, args, kwargs)
+
+
+def submit_on_commit(fn, *args, **kwargs):
+    """submit() once the current transaction commits, so the task sees its rows."""
+    transaction.on_commit(lambda: submit(fn, *args, **kwargs))
+
+
+def drain():
+    """Wait for every queued task to finish; management commands exit right after their work."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
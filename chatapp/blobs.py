@@ -0,0 +1,186 @@
+# chatapp/blobs.py
+
+import copy
+import uuid
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, ProtectedError, Sum
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from . import metrics
+from .background import submit_on_commit
+from .conversations import touch_conversation, message_room_key
+from .models import Message, GroupMessage, StoredBlob
+from .rendering import store_body
+
+ATTACHMENT_MODELS = (Message, GroupMessage)
+
+
+def blob_name(file_name):
+    # A fresh directory per blob: two blobs never share a name, so freeing
+    # one can never delete a newer upload that happens to have its file name
+    return f'chat_attachments/{uuid.uuid4().hex}/{default_storage.get_valid_name(file_name)}'
+
+
+def _reference_existing(metadata):
+    """The blob already holding this content with one more reference, or None."""
+    checksum = metadata.get('checksum')
+    if not checksum:
+        return None
+    with transaction.atomic():
+        blob = StoredBlob.objects.select_for_update().filter(
+            checksum=checksum, size=metadata['file_size']
+        ).first()
+        if blob is None:
+            return None
+        StoredBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        blob.ref_count += 1
+    metrics.incr('blobs.dedup_hits')
+    metrics.incr('blobs.bytes_saved', blob.size)
+    return blob
+
+
+def _register(name, metadata):
+    try:
+        with transaction.atomic():
+            return StoredBlob.objects.create(
+                checksum=metadata.get('checksum') or None,
+                size=metadata['file_size'],
+                name=name,
+                content_type=metadata.get('content_type', ''),
+                ref_count=1,
+            )
+    except IntegrityError:
+        # The same content was stored concurrently; keep that copy instead
+        blob = _reference_existing(metadata)
+        if blob is None:
+            raise
+        submit_on_commit(delete_stored_files, [name])
+        return blob
+
+
+def store_blob(file, file_name, metadata):
+    """
+    Reference for an uploaded attachment. `metadata` comes from
+    attachment_metadata. Content that is already stored is not written
+    again; otherwise `file` is saved under a new name.
+    """
+    blob = _reference_existing(metadata)
+    if blob is not None:
+        return blob
+    name = default_storage.save(blob_name(file_name), file)
+    return _register(name, metadata)
+
+
+def adopt_blob(name, metadata):
+    """
+    Reference for a file that is already in storage under `name`, e.g. a
+    finished multipart upload or an attachment from before deduplication.
+    If the same content is already stored, the copy at `name` is deleted.
+    """
+    existing = StoredBlob.objects.filter(name=name).first()
+    if existing is not None:
+        StoredBlob.objects.filter(pk=existing.pk).update(ref_count=F('ref_count') + 1)
+        existing.ref_count += 1
+        return existing
+    blob = _reference_existing(metadata)
+    if blob is not None:
+        submit_on_commit(delete_stored_files, [name])
+        return blob
+    return _register(name, metadata)
+
+
+def delete_stored_files(names):
+    """Background task: remove freed files (and their variants) from storage."""
+    for name in names:
+        try:
+            default_storage.delete(name)
+        except Exception as e:
+            print(f"Could not delete {name} from storage: {e}")
+
+
+def variant_names(thumbnails):
+    return [v['name'] for v in (thumbnails or {}).values() if isinstance(v, dict) and v.get('name')]
+
+
+def count_references(blob_ids=None):
+    """{blob_id: number of messages pointing at it}, from the messages themselves."""
+    counts = Counter()
+    for model in ATTACHMENT_MODELS:
+        referencing = model.objects.filter(blob__isnull=False)
+        if blob_ids is not None:
+            referencing = referencing.filter(blob_id__in=blob_ids)
+        for blob_id, n in referencing.order_by().values('blob_id').annotate(n=Count('id')).values_list('blob_id', 'n'):
+            counts[blob_id] += n
+    return counts
+
+
+def release_blob(blob_id, extra_names=()):
+    """
+    Drop one reference. The last one deletes the blob and, once the
+    transaction commits, its file plus `extra_names` (thumbnail variants).
+    Returns the number of bytes freed.
+    """
+    with transaction.atomic():
+        blob = StoredBlob.objects.select_for_update().filter(pk=blob_id).first()
+        if blob is None:
+            return 0
+        if blob.ref_count > 1:
+            StoredBlob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+            return 0
+        try:
+            with transaction.atomic():
+                blob.delete()
+        except ProtectedError:
+            # The counter fell behind; trust the messages that still point here
+            live = count_references([blob_id])[blob_id]
+            print(f"Blob {blob_id} still has {live} references; fixing its count")
+            StoredBlob.objects.filter(pk=blob_id).update(ref_count=live)
+            return 0
+    metrics.incr('blobs.freed')
+    metrics.incr('blobs.bytes_freed', blob.size)
+    submit_on_commit(delete_stored_files, [blob.name, *extra_names])
+    return blob.size
+
+
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=GroupMessage)
+def release_message_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        release_blob(instance.blob_id, variant_names(instance.thumbnails))
+
+
+def detach_attachment(message):
+    """
+    Remove a message's attachment (retention purge) and release its blob.
+    Returns the number of bytes freed.
+    """
+    type(message).objects.filter(pk=message.pk).update(
+        file='', blob=None, thumbnails={}, file_size=None, checksum='', image_width=None, image_height=None,
+    )
+    # Re-render from a copy: the file name and thumbnails are still needed below
+    detached = copy.copy(message)
+    detached.file, detached.thumbnails, detached.file_size = '', {}, None
+    store_body(detached)
+    touch_conversation(message_room_key(message))
+    if message.blob_id:
+        return release_blob(message.blob_id, variant_names(message.thumbnails))
+    # Stored before deduplication: the file belongs to this message alone
+    submit_on_commit(delete_stored_files, [message.file.name, *variant_names(message.thumbnails)])
+    return message.file_size or 0
+
+
+def dedup_report():
+    """Stored vs referenced attachment bytes across all blobs."""
+    totals = StoredBlob.objects.filter(ref_count__gt=0).aggregate(
+        blobs=Count('id'),
+        references=Sum('ref_count'),
+        stored_bytes=Sum('size'),
+        referenced_bytes=Sum(F('size') * F('ref_count')),
+    )
+    totals = {key: value or 0 for key, value in totals.items()}
+    totals['bytes_saved'] = totals['referenced_bytes'] - totals['stored_bytes']
+    return totals
@@ -0,0 +1,300 @@
+# chatapp/bot_context.py
+
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce, Least
+from django.utils import timezone
+
+from .background import submit
+from .models import ConversationSummary, Message, GroupMessage
+from .gemini_utils import format_chat_history, summarize_history
+from .bot_retrieval import retrieve_relevant, estimate_tokens
+from .rooms import parse_room_key
+
+# A rebuild that keeps losing to concurrent folds gives up after this many tries
+REBUILD_ATTEMPTS = 3
+
+# Summary rebuilds of this process, by room: running, running and asked
+# again, or the monotonic time of the last failed one
+_REBUILD_RUNNING = 'running'
+_REBUILD_AGAIN = 'again'
+_rebuilds = {}
+_rebuilds_lock = threading.Lock()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _load_context(room_key, messages_queryset, query=None):
+    """
+    Load the stored summary, the recent tail, the messages most relevant to
+    `query` from the whole history, and the messages that fell out of the
+    tail but are not summarized yet (only once a full batch is due).
+
+    A summary that still covers a deleted message is not returned at all:
+    the bot answers from the tail and retrieval until it is rebuilt, and
+    nothing is folded onto it meanwhile.
+    """
+    tail_size = _setting('COLLAB_CONTEXT_TAIL', 20)
+    batch_size = _setting('COLLAB_SUMMARY_BATCH', 20)
+    max_batch = _setting('COLLAB_SUMMARY_MAX_BATCH', 200)
+
+    # Read only: the row is created by the first fold (_store_summary)
+    summary = ConversationSummary.objects.filter(room_key=room_key).first() or ConversationSummary(room_key=room_key)
+    tail = list(
+        messages_queryset.select_related('sender', 'sender__profile').order_by('-id')[:tail_size]
+    )
+    tail.reverse()
+
+    pending = []
+    if tail and summary.stale_from is None:
+        pending_qs = messages_queryset.filter(id__gt=summary.last_message_id, id__lt=tail[0].id)
+        # Only fetch rows when a whole batch is due, so most calls are one cheap query
+        if pending_qs.order_by('id')[batch_size - 1:batch_size].exists():
+            pending = list(
+                pending_qs.select_related('sender', 'sender__profile').order_by('id')[:max_batch]
+            )
+
+    relevant = retrieve_relevant(
+        room_key,
+        messages_queryset,
+        query,
+        _setting('COLLAB_RETRIEVAL_TOP_K', 12),
+        exclude_ids={msg.id for msg in tail},
+    )
+    return summary, pending, tail, relevant
+
+
+def _with_checkpoint(checkpoints, last_message_id, summary_text):
+    """Append a fold's result to the checkpoints a rebuild can restart from, keeping the newest few."""
+    keep = _setting('COLLAB_SUMMARY_CHECKPOINTS', 10)
+    return (list(checkpoints) + [[last_message_id, summary_text]])[-keep:]
+
+
+def _store_summary(summary, summary_text, last_message_id):
+    # Conditional update: a concurrent fold that got there first, or a
+    # delete that made the summary stale, wins
+    checkpoints = _with_checkpoint(summary.checkpoints, last_message_id, summary_text)
+    stored = ConversationSummary.objects.filter(
+        room_key=summary.room_key, last_message_id=summary.last_message_id, stale_from__isnull=True
+    ).update(summary=summary_text, last_message_id=last_message_id, checkpoints=checkpoints)
+    if stored or summary.pk:
+        return
+    # The room's first fold
+    try:
+        with transaction.atomic():
+            ConversationSummary.objects.create(
+                room_key=summary.room_key, summary=summary_text,
+                last_message_id=last_message_id, checkpoints=checkpoints,
+            )
+    except IntegrityError:
+        pass  # Another first fold got there first
+
+
+def pack_context(summary_text, relevant, tail, token_budget):
+    """
+    Pack summary, retrieved messages and recent tail into a token budget.
+    The newest messages win first, then the summary, then retrieved
+    messages in relevance order; each section is printed chronologically.
+    """
+    min_tail = min(len(tail), 5)
+    used = 0
+    kept_tail = []
+    for position, msg in enumerate(reversed(tail)):
+        cost = estimate_tokens(format_chat_history([msg]))
+        if position >= min_tail and used + cost > token_budget:
+            break
+        kept_tail.append(msg)
+        used += cost
+    kept_tail.reverse()
+
+    if summary_text:
+        summary_cost = estimate_tokens(summary_text)
+        if used + summary_cost > token_budget:
+            summary_text = ''
+        else:
+            used += summary_cost
+
+    kept_relevant = []
+    for msg in relevant:
+        cost = estimate_tokens(format_chat_history([msg]))
+        if used + cost > token_budget:
+            continue
+        kept_relevant.append(msg)
+        used += cost
+    kept_relevant.sort(key=lambda msg: msg.id)
+
+    sections = []
+    if summary_text:
+        sections.append(f"--- SUMMARY OF EARLIER CONVERSATION ---\n{summary_text}")
+    if kept_relevant:
+        sections.append(f"--- RELEVANT EARLIER MESSAGES ---\n{format_chat_history(kept_relevant)}")
+    tail_history = format_chat_history(kept_tail)
+    if not sections:
+        return tail_history
+    sections.append(f"--- MOST RECENT MESSAGES ---\n{tail_history}")
+    return "\n".join(sections)
+
+
+async def build_history_context(room_key, messages_queryset, query=None):
+    """
+    Build the bot's chat-history context: rolling summary, the messages most
+    relevant to `query` from the whole history, and the recent tail, packed
+    into COLLAB_CONTEXT_TOKEN_BUDGET.
+
+    `messages_queryset` is every non-deleted message of the conversation.
+    Messages that scroll out of the tail are folded into the stored summary
+    in batches, sending only the new messages to the model.
+    """
+    summary, pending, tail, relevant = await database_sync_to_async(_load_context)(
+        room_key, messages_queryset, query
+    )
+
+    summary_text = summary.summary
+    if summary.stale_from is not None:
+        summary_text = ''
+        # The rebuild failed or was lost (e.g. a restart): try again, rate-limited
+        await database_sync_to_async(schedule_rebuild)(room_key, retry=True)
+    elif pending:
+        updated = await summarize_history(summary_text, format_chat_history(pending))
+        if updated:
+            await database_sync_to_async(_store_summary)(summary, updated, pending[-1].id)
+            summary_text = updated
+
+    return pack_context(summary_text, relevant, tail, _setting('COLLAB_CONTEXT_TOKEN_BUDGET', 6000))
+
+
+def _room_messages(room_key):
+    """Every non-deleted message of a room, as the consumers' history_queryset()."""
+    kind, ids = parse_room_key(room_key)
+    if kind == 'direct':
+        a, b = ids
+        return Message.objects.filter(
+            Q(sender_id=a, receiver_id=b) | Q(sender_id=b, receiver_id=a), is_deleted=False
+        )
+    if kind == 'group':
+        return GroupMessage.objects.filter(group_id=ids[0], is_deleted=False)
+    return None
+
+
+def _rebuild_start(summary, messages):
+    """
+    Where a rebuild re-folds from, as (summary text, last folded id,
+    checkpoints to keep): the newest checkpoint before the first deleted
+    message, as long as it is within COLLAB_SUMMARY_REBUILD_BATCHES batches
+    of the summary's end. Otherwise the rebuild starts empty at that
+    window, and older history is only reachable through retrieval.
+    """
+    window = _setting('COLLAB_SUMMARY_MAX_BATCH', 200) * _setting('COLLAB_SUMMARY_REBUILD_BATCHES', 5)
+    floor = (
+        messages.filter(id__lte=summary.last_message_id).order_by('-id')
+        .values_list('id', flat=True)[window - 1:window].first()
+    )
+    kept = [checkpoint for checkpoint in summary.checkpoints if checkpoint[0] < summary.stale_from]
+    if kept and (floor is None or kept[-1][0] >= floor - 1):
+        return kept[-1][1], kept[-1][0], kept
+    if floor is None:
+        return '', 0, []
+    return '', floor - 1, []
+
+
+def rebuild_summary(room_key):
+    """
+    Fold a stale summary again, from the last checkpoint before the deleted
+    message rather than from the start of the history. A fold or another
+    delete that lands meanwhile makes the store miss, and the rebuild
+    starts over from the current row.
+
+    Returns False when the model backend failed or the rebuild kept
+    losing, so the caller can retry later.
+    """
+    messages = _room_messages(room_key)
+    if messages is None:
+        return True
+    max_batch = _setting('COLLAB_SUMMARY_MAX_BATCH', 200)
+    for _ in range(REBUILD_ATTEMPTS):
+        summary = ConversationSummary.objects.filter(room_key=room_key, stale_from__isnull=False).first()
+        if summary is None:
+            return True
+        text, after, checkpoints = _rebuild_start(summary, messages)
+        while after < summary.last_message_id:
+            batch = list(
+                messages.filter(id__gt=after, id__lte=summary.last_message_id)
+                .select_related('sender', 'sender__profile').order_by('id')[:max_batch]
+            )
+            if not batch:
+                break
+            text = async_to_sync(summarize_history)(text, format_chat_history(batch))
+            if text is None:
+                print(f"Could not rebuild summary of {room_key}")
+                return False
+            after = batch[-1].id
+            checkpoints = _with_checkpoint(checkpoints, after, text)
+        stored = ConversationSummary.objects.filter(
+            pk=summary.pk, stale_from=summary.stale_from,
+            last_message_id=summary.last_message_id, updated_at=summary.updated_at,
+        ).update(summary=text, checkpoints=checkpoints, stale_from=None)
+        if stored:
+            return True
+    return False
+
+
+def schedule_rebuild(room_key, retry=False):
+    """
+    Rebuild the room's stale summary in the background, one rebuild per
+    room at a time. A delete always asks (a running rebuild then goes once
+    more); the read path passes retry=True and only starts one when none
+    failed in the last COLLAB_SUMMARY_RETRY_SECONDS.
+    """
+    with _rebuilds_lock:
+        state = _rebuilds.get(room_key)
+        if state in (_REBUILD_RUNNING, _REBUILD_AGAIN):
+            if not retry:
+                _rebuilds[room_key] = _REBUILD_AGAIN
+            return
+        if retry and state is not None and time.monotonic() - state < _setting('COLLAB_SUMMARY_RETRY_SECONDS', 60):
+            return
+        _rebuilds[room_key] = _REBUILD_RUNNING
+    submit(_run_rebuild, room_key)
+
+
+def _run_rebuild(room_key):
+    while True:
+        try:
+            done = rebuild_summary(room_key)
+        except Exception as e:
+            print(f"Summary rebuild of {room_key} failed: {e}")
+            done = False
+        with _rebuilds_lock:
+            if _rebuilds.get(room_key) == _REBUILD_AGAIN:
+                _rebuilds[room_key] = _REBUILD_RUNNING
+                continue
+            if done:
+                del _rebuilds[room_key]
+            else:
+                # Remember when it failed; the read path retries after a while
+                _rebuilds[room_key] = time.monotonic()
+        return
+
+
+@database_sync_to_async
+def discard_summary(room_key, message_id):
+    """
+    Mark the summary stale if it already covers `message_id` (e.g. it was
+    deleted) and rebuild it in the background, so deleted content does not
+    live on in the summary and no bot reply waits for the rebuild.
+    stale_from keeps the oldest deleted id, which the rebuild re-folds from.
+    """
+    marked = ConversationSummary.objects.filter(room_key=room_key, last_message_id__gte=message_id).update(
+        stale_from=Least(Coalesce(F('stale_from'), Value(message_id)), Value(message_id)),
+        updated_at=timezone.now(),
+    )
+    if marked:
+        schedule_rebuild(room_key)
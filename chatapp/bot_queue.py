@@ -0,0 +1,226 @@
+# chatapp/bot_queue.py
+
+import asyncio
+import itertools
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+from . import metrics
+
+# Lower value runs first
+PRIORITY_SHARED = 0
+PRIORITY_HIDDEN = 1
+PRIORITIES = (PRIORITY_SHARED, PRIORITY_HIDDEN)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Requeue(Exception):
+    """Raised by a running job to go back to the front of its room's line."""
+
+
+class BotJob:
+    def __init__(self, room_key, priority, factory, on_position=None, key=None):
+        self.room_key = room_key
+        self.priority = priority
+        self.factory = factory
+        self.on_position = on_position
+        self.key = key
+        self.follower = False
+        self.position = None
+        self.task = None
+        self.done = asyncio.get_running_loop().create_future()
+
+    @property
+    def is_running(self):
+        return self.task is not None
+
+
+class BotScheduler:
+    """
+    Bounded job queue for bot requests.
+
+    - At most `max_concurrency` jobs run at once in this process and at
+      most `per_room` per room, so one busy room cannot starve the rest.
+    - Rooms take turns (round-robin); within that, shared requests are
+      served before hidden ones.
+    - Waiting jobs get `on_position(n)` callbacks whenever their place in
+      line changes; cancel() removes or stops a job.
+    - A job submitted with the same `key` as a running one (the
+      SingleFlight key, see bot_singleflight.py) starts at once without a
+      slot: it only waits for the running job's answer. If that job is
+      cancelled, the follower raises Requeue and goes back in line for a
+      slot of its own.
+    """
+
+    def __init__(self, max_concurrency=4, per_room=1, max_waiting=100):
+        self.max_concurrency = max_concurrency
+        self.per_room = per_room
+        self.max_waiting = max_waiting
+        # priority -> room_key -> deque of jobs; room order is the round-robin order
+        self._waiting = {priority: OrderedDict() for priority in PRIORITIES}
+        self._running = {}
+        self._running_total = 0
+        self._running_keys = {}  # key -> running jobs that hold a slot for it
+
+    @property
+    def waiting_count(self):
+        return sum(len(jobs) for rooms in self._waiting.values() for jobs in rooms.values())
+
+    def submit(self, room_key, priority, factory, on_position=None, key=None):
+        """Queue `factory()` (a coroutine function); returns the BotJob."""
+        job = BotJob(room_key, priority, factory, on_position, key)
+        if key is not None and key in self._running_keys:
+            metrics.incr('bot_queue.submitted')
+            self._start_follower(job)
+            return job
+        if self.waiting_count >= self.max_waiting:
+            metrics.incr('bot_queue.rejected')
+            raise QueueFull()
+        self._waiting[priority].setdefault(room_key, deque()).append(job)
+        metrics.incr('bot_queue.submitted')
+        self._pump()
+        return job
+
+    def cancel(self, job):
+        if job.done.done():
+            return
+        if job.is_running:
+            job.task.cancel()
+            return
+        rooms = self._waiting[job.priority]
+        jobs = rooms.get(job.room_key)
+        if jobs and job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del rooms[job.room_key]
+        job.done.cancel()
+        metrics.incr('bot_queue.cancelled')
+        self._pump()
+
+    def _next_job(self):
+        for priority in PRIORITIES:
+            rooms = self._waiting[priority]
+            for room_key in list(rooms):
+                if self._running.get(room_key, 0) >= self.per_room:
+                    continue
+                jobs = rooms[room_key]
+                job = jobs.popleft()
+                if jobs:
+                    rooms.move_to_end(room_key)  # Next turn goes to another room
+                else:
+                    del rooms[room_key]
+                return job
+        return None
+
+    def _pump(self):
+        while self._running_total < self.max_concurrency:
+            job = self._next_job()
+            if job is None:
+                break
+            self._start(job)
+        self._publish_positions()
+
+    def _start(self, job):
+        self._running[job.room_key] = self._running.get(job.room_key, 0) + 1
+        self._running_total += 1
+        if job.key is not None:
+            self._running_keys[job.key] = self._running_keys.get(job.key, 0) + 1
+        self._run(job)
+        if job.key is not None:
+            # Identical requests already in line join this one
+            for rooms in self._waiting.values():
+                jobs = rooms.get(job.room_key)
+                for twin in [other for other in jobs or () if other.key == job.key]:
+                    jobs.remove(twin)
+                    self._start_follower(twin)
+                if jobs is not None and not jobs:
+                    del rooms[job.room_key]
+
+    def _start_follower(self, job):
+        job.follower = True
+        metrics.incr('bot_queue.followers')
+        self._run(job)
+
+    def _run(self, job):
+        job.position = 0
+        job.task = asyncio.ensure_future(job.factory())
+        job.task.add_done_callback(lambda task, job=job: self._finished(job, task))
+
+    def _finished(self, job, task):
+        if not job.follower:
+            self._running[job.room_key] -= 1
+            if not self._running[job.room_key]:
+                del self._running[job.room_key]
+            self._running_total -= 1
+            if job.key is not None:
+                self._running_keys[job.key] -= 1
+                if not self._running_keys[job.key]:
+                    del self._running_keys[job.key]
+        if not task.cancelled() and isinstance(task.exception(), Requeue):
+            self._requeue(job)
+            return
+        if task.cancelled():
+            metrics.incr('bot_queue.cancelled')
+            job.done.cancel()
+        elif task.exception() is not None:
+            job.done.set_exception(task.exception())
+        else:
+            metrics.incr('bot_queue.completed')
+            job.done.set_result(task.result())
+        self._pump()
+
+    def _requeue(self, job):
+        metrics.incr('bot_queue.requeued')
+        job.follower = False
+        job.task = None
+        job.position = None
+        if job.key is not None and job.key in self._running_keys:
+            # A twin already got a slot for it
+            self._start_follower(job)
+        else:
+            self._waiting[job.priority].setdefault(job.room_key, deque()).appendleft(job)
+        self._pump()
+
+    def _publish_positions(self):
+        """
+        Estimate each waiting job's place in line: all jobs of a higher
+        priority first, then rooms interleaved in round-robin order.
+        """
+        order = []
+        for priority in PRIORITIES:
+            rooms = list(self._waiting[priority].values())
+            for turn in itertools.count():
+                batch = [jobs[turn] for jobs in rooms if turn < len(jobs)]
+                if not batch:
+                    break
+                order.extend(batch)
+        for position, job in enumerate(order, start=1):
+            if job.position != position and job.on_position:
+                job.position = position
+                asyncio.ensure_future(job.on_position(position))
+
+
+_scheduler = None
+_scheduler_loop = None
+
+
+def get_bot_scheduler():
+    """One scheduler per event loop (i.e. per ASGI worker process)."""
+    global _scheduler, _scheduler_loop
+    loop = asyncio.get_running_loop()
+    if _scheduler is None or _scheduler_loop is not loop:
+        _scheduler = BotScheduler(
+            max_concurrency=getattr(settings, 'COLLAB_BOT_MAX_CONCURRENCY', 4),
+            per_room=getattr(settings, 'COLLAB_BOT_PER_ROOM_CONCURRENCY', 1),
+            max_waiting=getattr(settings, 'COLLAB_BOT_MAX_QUEUE', 100),
+        )
+        _scheduler_loop = loop
+    return _scheduler
+
+
+metrics.register_gauge('bot_queue.waiting', lambda: _scheduler.waiting_count if _scheduler else 0)
+metrics.register_gauge('bot_queue.running', lambda: _scheduler._running_total if _scheduler else 0)
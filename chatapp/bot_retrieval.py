@@ -0,0 +1,254 @@
+# chatapp/bot_retrieval.py
+
+import heapq
+from bisect import bisect_left
+import math
+import re
+import threading
+from array import array
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import metrics
+from .background import submit
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his i if in into is it its
+me my no not of on or our she so than that the their them then there these they
+this to too us was we were what when where which who why will with you your
+""".split())
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text):
+    return [
+        token for token in TOKEN_RE.findall((text or '').lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+# Query terms in more than this share of a room's messages barely move
+# BM25 (idf < log 2) but cost the most to score; the rarest term is kept
+COMMON_TERM_RATIO = 0.5
+
+
+class RoomIndex:
+    """
+    Append-only inverted index over one conversation's messages.
+
+    Postings are stored as compact parallel arrays (message ids, term
+    frequencies and document lengths) so a 100k-message room stays a few
+    MB. Messages are added in id order, so each id array is sorted;
+    deletions are filtered when the top hits are fetched. Built and
+    refreshed in the background (see refresh_index); `ready` once the
+    first complete build is published. Until then `seed` may hold a small
+    index of the newest messages for cold queries.
+    """
+
+    def __init__(self):
+        self.postings = {}  # term -> (array of ids, array of term frequencies, array of doc lengths)
+        self.doc_len = {}
+        self.total_len = 0
+        self.last_indexed_id = 0
+        self.ready = False
+        self.seed = None
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    def add(self, message_id, text):
+        tokens = tokenize(text)
+        self.last_indexed_id = max(self.last_indexed_id, message_id)
+        if not tokens:
+            return
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        length = min(len(tokens), 65535)
+        for term, tf in counts.items():
+            ids, tfs, lens = self.postings.setdefault(term, (array('q'), array('H'), array('H')))
+            ids.append(message_id)
+            tfs.append(min(tf, 65535))
+            lens.append(length)
+        self.doc_len[message_id] = len(tokens)
+        self.total_len += len(tokens)
+
+    def _snapshot(self, query):
+        """Copy the query's postings (minus very common terms) so scoring can run without the lock."""
+        with self.lock:
+            doc_count = len(self.doc_len)
+            entries = sorted(
+                (entry for entry in map(self.postings.get, set(tokenize(query))) if entry),
+                key=lambda entry: len(entry[0]),
+            )
+            entries = entries[:1] + [entry for entry in entries[1:] if len(entry[0]) <= doc_count * COMMON_TERM_RATIO]
+            return doc_count, self.total_len, [tuple(column[:] for column in entry) for entry in entries]
+
+    def search(self, query, limit, exclude_ids=()):
+        """
+        Return [(score, message_id)] best first using BM25.
+
+        Scores a snapshot outside the lock, term at a time from the highest
+        upper bound down (max-score). Once the remaining terms together
+        cannot lift an unseen message past the current top `limit`, they
+        only update the candidates that can still make it, found by binary
+        search in the sorted id arrays.
+        """
+        doc_count, total_len, entries = self._snapshot(query)
+        if not doc_count or not entries:
+            return []
+        avg_len = total_len / doc_count
+        exclude_ids = set(exclude_ids)
+
+        terms = []
+        for ids, tfs, lens in entries:
+            df = len(ids)
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            # A term adds at most idf * (k1 + 1) to any message (tf saturates)
+            terms.append((idf * (BM25_K1 + 1), idf, ids, tfs, lens))
+        terms.sort(key=lambda term: term[0], reverse=True)
+        remaining = sum(term[0] for term in terms)
+        k_norm = BM25_K1 * (1 - BM25_B)
+        k_len = BM25_K1 * BM25_B / avg_len
+
+        scores = {}
+        candidates = None
+        for bound, idf, ids, tfs, lens in terms:
+            if candidates is None and len(scores) >= limit:
+                threshold = heapq.nlargest(limit, scores.values())[-1]
+                if threshold >= remaining:
+                    candidates = [
+                        message_id for message_id, score in scores.items() if score + remaining > threshold
+                    ]
+            remaining -= bound
+            if candidates is None:
+                for message_id, tf, length in zip(ids, tfs, lens):
+                    scores[message_id] = scores.get(message_id, 0.0) + idf * tf * (BM25_K1 + 1) / (
+                        tf + k_norm + k_len * length
+                    )
+                for message_id in exclude_ids:
+                    scores.pop(message_id, None)
+                continue
+            for message_id in candidates:
+                position = bisect_left(ids, message_id)
+                if position < len(ids) and ids[position] == message_id:
+                    tf = tfs[position]
+                    scores[message_id] += idf * tf * (BM25_K1 + 1) / (tf + k_norm + k_len * lens[position])
+        pool = scores.items() if candidates is None else ((message_id, scores[message_id]) for message_id in candidates)
+        ranked = heapq.nlargest(limit, pool, key=lambda item: item[1])
+        return [(score, message_id) for message_id, score in ranked]
+
+
+_indexes = OrderedDict()
+_indexes_guard = threading.Lock()
+
+
+def get_room_index(room_key):
+    """Process-local LRU of room indexes."""
+    max_rooms = getattr(settings, 'COLLAB_RETRIEVAL_MAX_ROOMS', 64)
+    with _indexes_guard:
+        index = _indexes.get(room_key)
+        if index is None:
+            index = _indexes[room_key] = RoomIndex()
+        _indexes.move_to_end(room_key)
+        while len(_indexes) > max_rooms:
+            _indexes.popitem(last=False)
+        return index
+
+
+def refresh_index(index, messages_queryset):
+    """
+    Background task: bring `index` up to date. The first build fills a
+    separate index and publishes it whole; later refreshes read the new
+    rows first and hold the lock only for the in-memory adds. Either way
+    searches keep running on the last complete index meanwhile.
+    """
+    try:
+        if index.ready:
+            new_rows = list(
+                messages_queryset.filter(id__gt=index.last_indexed_id).order_by('id').values_list('id', 'content')
+            )
+            with index.lock:
+                for message_id, content in new_rows:
+                    if message_id > index.last_indexed_id:
+                        index.add(message_id, content)
+            return
+        fresh = RoomIndex()
+        rows = messages_queryset.order_by('id').values_list('id', 'content')
+        for message_id, content in rows.iterator(chunk_size=2000):
+            fresh.add(message_id, content)
+        with index.lock:
+            index.postings, index.doc_len = fresh.postings, fresh.doc_len
+            index.total_len, index.last_indexed_id = fresh.total_len, fresh.last_indexed_id
+            index.ready = True
+            index.seed = None
+        metrics.incr('bot_retrieval.builds')
+    finally:
+        with index.lock:
+            index.refreshing = False
+
+
+def schedule_refresh(index, messages_queryset):
+    """Queue refresh_index() unless one is already queued or running for `index`."""
+    with index.lock:
+        if index.refreshing:
+            return
+        index.refreshing = True
+    submit(refresh_index, index, messages_queryset)
+
+
+def seed_index(index, messages_queryset):
+    """
+    A small index of the room's newest COLLAB_RETRIEVAL_COLD_SEED messages,
+    for queries that arrive before the room's first full build is
+    published. Built once per cold room; the full build drops it.
+    """
+    seed = index.seed
+    if seed is None:
+        size = getattr(settings, 'COLLAB_RETRIEVAL_COLD_SEED', 2000)
+        rows = list(messages_queryset.order_by('-id').values_list('id', 'content')[:size])
+        seed = RoomIndex()
+        for message_id, content in reversed(rows):
+            seed.add(message_id, content)
+        with index.lock:
+            if not index.ready:
+                index.seed = seed
+    return seed
+
+
+def retrieve_relevant(room_key, messages_queryset, query, limit, exclude_ids=()):
+    """
+    Rank the conversation's whole history against `query` and return the
+    top `limit` messages, best first, with sender/profile loaded.
+
+    Searches the room's last complete index and queues a refresh for the
+    next request; until a room's first build is done only its newest
+    messages are searched (see seed_index). Messages the refresh has not
+    reached yet are usually still in the recent tail.
+    """
+    if not query or limit <= 0:
+        return []
+    index = get_room_index(room_key)
+    schedule_refresh(index, messages_queryset)
+    if not index.ready:
+        metrics.incr('bot_retrieval.cold')
+        index = seed_index(index, messages_queryset)
+    # Over-fetch: some hits may have been deleted since they were indexed
+    hits = index.search(query, limit * 2, exclude_ids=exclude_ids)
+    if not hits:
+        return []
+    rank = {message_id: position for position, (_, message_id) in enumerate(hits)}
+    messages = list(
+        messages_queryset.filter(id__in=rank.keys()).select_related('sender', 'sender__profile')
+    )
+    messages.sort(key=lambda msg: rank[msg.id])
+    return messages[:limit]
+
+
+def estimate_tokens(text):
+    # Rough, model-agnostic estimate (~4 characters per token)
+    return len(text) // 4 + 1
@@ -0,0 +1,120 @@
+# chatapp/bot_singleflight.py
+
+import asyncio
+import re
+from collections import OrderedDict
+
+from . import metrics
+from .bot_queue import Requeue
+
+LEADER = 'leader'
+COALESCED = 'coalesced'
+CACHED = 'cached'
+
+
+class LeaderCancelled(Requeue):
+    """The in-flight call this request was waiting for was cancelled."""
+
+
+def _dedup_ratio():
+    requests = metrics.get('bot.requests')
+    saved = metrics.get('bot.response_cache_hits') + metrics.get('bot.coalesced')
+    return round(saved / requests, 4) if requests else 0.0
+
+
+metrics.register_gauge('bot.dedup_ratio', _dedup_ratio)
+
+
+def normalize_query(query):
+    """Case, whitespace and trailing punctuation don't change the answer."""
+    return re.sub(r'\s+', ' ', (query or '').strip().lower()).rstrip(' ?!.')
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical bot requests into one model call and
+    caches the answer until the conversation advances.
+
+    Keys are (room_key, normalized_query, last_message_id). Because the
+    last message id is part of the key, a new message naturally misses;
+    older answers for that room are dropped when a newer id shows up.
+    """
+
+    def __init__(self, max_rooms=256):
+        self.max_rooms = max_rooms
+        self._inflight = {}
+        self._results = OrderedDict()  # room_key -> (last_message_id, {query: text})
+
+    def _cached(self, key):
+        room_key, query, last_id = key
+        entry = self._results.get(room_key)
+        if entry and entry[0] == last_id and query in entry[1]:
+            self._results.move_to_end(room_key)
+            return entry[1][query]
+        return None
+
+    def _store(self, key, text):
+        room_key, query, last_id = key
+        entry = self._results.get(room_key)
+        if entry is None or entry[0] != last_id:
+            if entry is not None and last_id is not None and entry[0] is not None and entry[0] > last_id:
+                return  # A newer conversation state is already cached
+            entry = (last_id, {})
+            self._results[room_key] = entry
+        entry[1][query] = text
+        self._results.move_to_end(room_key)
+        while len(self._results) > self.max_rooms:
+            self._results.popitem(last=False)
+
+    async def run(self, key, produce, cacheable=None):
+        """
+        Return (text, how) where `how` is LEADER when this call ran
+        `produce()`, COALESCED when it shared an in-flight call, or CACHED.
+        `cacheable(text)` can veto caching (e.g. error replies).
+
+        A follower never takes over from a cancelled leader: it raises
+        LeaderCancelled, so the scheduler puts it back in line and the
+        model call it makes next runs in a slot like any other.
+        """
+        metrics.incr('bot.requests')
+        while True:
+            cached = self._cached(key)
+            if cached is not None:
+                metrics.incr('bot.response_cache_hits')
+                return cached, CACHED
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            try:
+                # shield: a follower going away must not cancel the leader
+                text = await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                raise LeaderCancelled() from None
+            metrics.incr('bot.coalesced')
+            return text, COALESCED
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        metrics.incr('bot.model_calls')
+        try:
+            text = await produce()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Don't warn about an exception nobody awaited
+                future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        future.set_result(text)
+        if cacheable is None or cacheable(text):
+            self._store(key, text)
+        return text, LEADER
+
+
+bot_flights = SingleFlight()
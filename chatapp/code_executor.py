@@ -1,37 +1,243 @@
 import sys
+import json
+import hashlib
 import subprocess
-import io
-import contextlib
+import threading
+import tempfile
+from pathlib import Path
 
-def execute_python_code(code):
+from django.conf import settings
+
+from .models import WorkspaceNode
+from .execution_cache import get_execution_cache, make_key
+
+EXECUTION_TIMEOUT = 5
+MANIFEST_NAME = '.collabx-manifest.json'
+
+_workspace_locks = {}
+_workspace_locks_guard = threading.Lock()
+
+
+def _run_python(args, cwd=None):
     """
-    Executes the given Python code and returns the output.
-    WARNING: This is a basic implementation and should be sandboxed in production.
+    Runs the Python interpreter with the given arguments and returns the
+    formatted output string shared by every execution path.
     """
-    # Create a string buffer to capture stdout
-    stdout_capture = io.StringIO()
-    stderr_capture = io.StringIO()
-
     try:
         # We will use subprocess to run the code in a separate process
         # This is slightly safer than exec() in the main process, but still not fully sandboxed.
-        # We pass the code as a string to the python executable.
-        
         process = subprocess.run(
-            [sys.executable, "-c", code],
+            [sys.executable, *args],
             capture_output=True,
             text=True,
-            timeout=5  # 5 second timeout to prevent infinite loops
+            cwd=cwd,
+            timeout=EXECUTION_TIMEOUT  # 5 second timeout to prevent infinite loops
         )
-        
+
         output = process.stdout
         error = process.stderr
-        
+
         if error:
             return f"Error:\n{error}\nOutput:\n{output}"
         return output if output else "Code executed successfully (no output)."
 
     except subprocess.TimeoutExpired:
-        return "Error: Execution timed out (limit: 5 seconds)."
+        return f"Error: Execution timed out (limit: {EXECUTION_TIMEOUT} seconds)."
     except Exception as e:
         return f"Execution Error: {str(e)}"
+
+
+def _run_cached(code, args, cwd=None, input_files=None, use_cache=True):
+    """
+    Run through the execution cache when it is enabled.
+    Returns (output, cached).
+    """
+    cache = get_execution_cache() if use_cache else None
+    if cache is None:
+        return _run_python(args, cwd=cwd), False
+
+    key = make_key(code, input_files)
+    output = cache.get(key)
+    if output is not None:
+        return output, True
+
+    output = _run_python(args, cwd=cwd)
+    # Timeouts and launcher failures are not deterministic results
+    if not output.startswith(("Error: Execution timed out", "Execution Error:")):
+        cache.set(key, output)
+    return output, False
+
+
+def execute_python_code(code, use_cache=True):
+    """
+    Executes the given Python code and returns (output, cached).
+    WARNING: This is a basic implementation and should be sandboxed in production.
+    """
+    # We pass the code as a string to the python executable.
+    return _run_cached(code, ["-c", code], use_cache=use_cache)
+
+
+def _hash_content(content):
+    return hashlib.sha256((content or '').encode('utf-8')).hexdigest()
+
+
+def _workspace_lock(workspace_key):
+    with _workspace_locks_guard:
+        return _workspace_locks.setdefault(workspace_key, threading.Lock())
+
+
+def get_scratch_dir(workspace_key):
+    root = getattr(settings, 'WORKSPACE_SCRATCH_ROOT', None) or Path(tempfile.gettempdir()) / 'collabx-workspaces'
+    return Path(root) / workspace_key
+
+
+def _resolve_paths(nodes):
+    """
+    Map node id -> relative path for every node in the tree.
+    Nodes whose name could escape the scratch directory are dropped
+    along with their descendants.
+    """
+    by_id = {node['id']: node for node in nodes}
+    paths = {}
+
+    def resolve(node_id, seen=()):
+        if node_id in paths:
+            return paths[node_id]
+        node = by_id.get(node_id)
+        name = node['name'] if node else ''
+        if not node or node_id in seen or name in ('', '.', '..') or '/' in name or '\\' in name:
+            paths[node_id] = None
+            return None
+        if node['parent_id'] is None:
+            path = name
+        else:
+            parent_path = resolve(node['parent_id'], seen + (node_id,))
+            path = f"{parent_path}/{name}" if parent_path else None
+        paths[node_id] = path
+        return path
+
+    for node_id in by_id:
+        resolve(node_id)
+    return paths
+
+
+def _load_manifest(scratch_dir):
+    try:
+        return json.loads((scratch_dir / MANIFEST_NAME).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def sync_workspace(workspace_key):
+    """
+    Materialize the workspace's WorkspaceNode tree into its scratch directory.
+
+    The sync is incremental: a manifest of {path: {id, stamp, sha}} from the
+    previous run is kept next to the files. Only files whose updated_at stamp
+    moved have their content loaded from the database, and only files whose
+    content hash actually changed are rewritten. Files that disappeared from
+    the tree are removed.
+
+    Returns (scratch_dir, {node_id: relative_path}).
+    """
+    scratch_dir = get_scratch_dir(workspace_key)
+    scratch_dir.mkdir(parents=True, exist_ok=True)
+
+    nodes = list(
+        WorkspaceNode.objects.filter(workspace_key=workspace_key)
+        .values('id', 'parent_id', 'name', 'node_type', 'updated_at')
+    )
+    paths = _resolve_paths(nodes)
+    manifest = _load_manifest(scratch_dir)
+
+    wanted = {}
+    stale_ids = []
+    for node in nodes:
+        path = paths.get(node['id'])
+        if not path:
+            continue
+        if node['node_type'] == WorkspaceNode.NodeType.FOLDER:
+            (scratch_dir / path).mkdir(parents=True, exist_ok=True)
+            continue
+        stamp = node['updated_at'].isoformat()
+        entry = manifest.get(path)
+        wanted[path] = {'id': node['id'], 'stamp': stamp, 'sha': entry.get('sha') if entry else None}
+        if not entry or entry.get('stamp') != stamp or entry.get('id') != node['id'] or not (scratch_dir / path).is_file():
+            stale_ids.append(node['id'])
+
+    if stale_ids:
+        id_to_path = {wanted[path]['id']: path for path in wanted}
+        for node_id, content in WorkspaceNode.objects.filter(id__in=stale_ids).values_list('id', 'content'):
+            path = id_to_path[node_id]
+            digest = _hash_content(content)
+            target = scratch_dir / path
+            if wanted[path]['sha'] != digest or not target.is_file():
+                target.parent.mkdir(parents=True, exist_ok=True)
+                target.write_text(content or '', encoding='utf-8')
+            wanted[path]['sha'] = digest
+
+    for path in set(manifest) - set(wanted):
+        try:
+            (scratch_dir / path).unlink()
+        except OSError:
+            pass
+
+    # Prune folders that no longer exist in the tree (deepest first)
+    folder_paths = {
+        paths[node['id']] for node in nodes
+        if node['node_type'] == WorkspaceNode.NodeType.FOLDER and paths.get(node['id'])
+    }
+    for directory in sorted(scratch_dir.rglob('*'), key=lambda p: len(p.parts), reverse=True):
+        if directory.is_dir() and directory.relative_to(scratch_dir).as_posix() not in folder_paths:
+            try:
+                directory.rmdir()
+            except OSError:
+                pass
+
+    (scratch_dir / MANIFEST_NAME).write_text(json.dumps(wanted))
+    return scratch_dir, {node_id: path for node_id, path in paths.items() if path}
+
+
+def execute_workspace(workspace_key, entry_node_id, code=None, use_cache=True):
+    """
+    Run a workspace file as the entry point inside the synced scratch
+    directory, so it can import sibling modules.
+
+    If `code` is given it is the editor's latest content for the entry file
+    and takes precedence over what is stored in the database.
+    Returns (output, cached).
+    """
+    try:
+        entry_node_id = int(entry_node_id)
+    except (TypeError, ValueError):
+        # Not a workspace node (the client sends whatever id it has): run the editor content as is
+        if code:
+            return execute_python_code(code, use_cache=use_cache)
+        return "Execution Error: File not found in workspace.", False
+
+    with _workspace_lock(workspace_key):
+        scratch_dir, paths = sync_workspace(workspace_key)
+        entry_path = paths.get(entry_node_id)
+        if not entry_path:
+            if code:
+                return execute_python_code(code, use_cache=use_cache)
+            return "Execution Error: File not found in workspace.", False
+
+        manifest = _load_manifest(scratch_dir)
+        if code is not None:
+            digest = _hash_content(code)
+            entry = manifest.get(entry_path, {})
+            if entry.get('sha') != digest:
+                (scratch_dir / entry_path).write_text(code, encoding='utf-8')
+                # Clear the stamp so the next sync re-checks this file against the database
+                manifest[entry_path] = {'id': entry.get('id', entry_node_id), 'stamp': None, 'sha': digest}
+                (scratch_dir / MANIFEST_NAME).write_text(json.dumps(manifest))
+
+        input_files = {path: entry.get('sha') for path, entry in manifest.items()}
+        return _run_cached(
+            entry_path,
+            [entry_path],
+            cwd=scratch_dir,
+            input_files=input_files,
+            use_cache=use_cache,
+        )
@@ -2,15 +2,30 @@
 
 import json
 import re
-import time
+import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.contrib.auth.models import User
 from django.db.models import Q
-
-from .models import Message, Profile, Group, GroupMessage
-from .gemini_utils import format_chat_history, get_collab_response
-from .code_executor import execute_python_code
+from django.utils import timezone
+
+from .models import Message, GroupMessage, WorkspaceNode
+from .gemini_utils import stream_collab_response, generate_workspace_code, NOT_CONFIGURED_REPLY, ERROR_REPLY
+from .bot_context import build_history_context, discard_summary
+from .rooms import direct_room_key, group_room_key
+from .db_routers import areplica_reads, amark_write
+from .query_budget import QueryBudgetMixin
+from .identity import aget_identity, color_for
+from .room_access import acan_access, REVOKED_CLOSE_CODE
+from .conversations import touch_conversation
+from .activity import message_deleted
+from .rendering import RENDER_VERSION, deleted_body
+from .bot_singleflight import bot_flights, normalize_query
+from .bot_queue import get_bot_scheduler, QueueFull, PRIORITY_SHARED, PRIORITY_HIDDEN
+from .code_executor import execute_python_code, execute_workspace
+from .workspace_utils import (
+    parse_collab_command, extract_code_blocks, build_changeset, apply_changeset,
+    workspace_file_list, normalize_path,
+)
 
 def parse_bot_response(response_text):
     """
@@ -29,99 +44,238 @@ def parse_bot_response(response_text):
     return content, jump_id
 
 
-async def handle_collab_command_shared(consumer, command_text, is_hidden, default_query):
+JUMP_TAG_PREFIX = '[jump_to:'
+
+
+def split_streamable(text):
     """
-    Shared handler for /Collab command in both ChatConsumer and GroupChatConsumer.
-    Reduces code duplication.
+    Splits accumulated bot output into (safe_to_send, held_back).
+    A trailing fragment that could still become a [jump_to: ID] tag is held
+    back so clients never flash the raw tag while streaming.
+    """
+    idx = text.rfind('[')
+    if idx != -1 and JUMP_TAG_PREFIX.startswith(text[idx:idx + len(JUMP_TAG_PREFIX)]):
+        return text[:idx], text[idx:]
+    return text, ''
+
+
+BUSY_REPLY = "Collab-X is busy right now. Please try again in a moment."
+
+
+async def send_bot_frame(consumer, is_hidden, status, content, request_id, jump_id=None, queue_position=None):
+    """
+    Sends a bot_message frame either to the requesting socket only (hidden)
+    or to the whole room.
     """
-    request_id = f"bot-{consumer.user.id}-{int(time.time())}"
-    
-    thinking_payload_js = {
-        'type': 'bot_message',
-        'status': 'thinking',
-        'content': "Thinking...",
-        'sender_username': 'Collab-X',
-        'jump_id': None,
-        'request_id': request_id
-    }
-    
     if is_hidden:
-        await consumer.send(text_data=json.dumps(thinking_payload_js))
+        await consumer.send(text_data=json.dumps({
+            'type': 'bot_message',
+            'status': status,
+            'content': content,
+            'sender_username': 'Collab-X',
+            'jump_id': jump_id,
+            'request_id': request_id,
+            'queue_position': queue_position
+        }))
     else:
         await consumer.channel_layer.group_send(consumer.room_group_name, {
             'type': 'bot_message',
-            'status': 'thinking',
-            'message': "Thinking...",
+            'status': status,
+            'message': content,
             'sender_username': 'Collab-X',
-            'jump_id': None,
-            'request_id': request_id
+            'jump_id': jump_id,
+            'request_id': request_id,
+            'queue_position': queue_position
         })
-    
+
+
+async def handle_collab_command_shared(consumer, command_text, is_hidden, default_query):
+    """
+    Shared handler for /Collab command in both ChatConsumer and GroupChatConsumer.
+    Reduces code duplication.
+
+    The request is queued on the bot scheduler and this returns right away,
+    so the socket keeps serving other frames. While waiting, 'queued' frames
+    carry the queue_position; the answer itself is streamed by answer_collab_query.
+    """
+    request_id = f"bot-{consumer.user.id}-{uuid.uuid4().hex[:12]}"
+
     if is_hidden:
         user_query = command_text.replace('/Collab hidden', '').strip()
     else:
         user_query = command_text.replace('/Collab', '').strip()
     if not user_query:
         user_query = default_query
-        
-    chat_history_string = await consumer.get_chat_history()
-    
-    bot_response_text = await database_sync_to_async(get_collab_response)(
-        chat_history_string, 
-        user_query
-    )
-    clean_content, jump_id = parse_bot_response(bot_response_text)
-    
-    final_payload_js = {
-        'type': 'bot_message',
-        'status': 'complete',
-        'content': clean_content,
-        'sender_username': 'Collab-X',
-        'jump_id': jump_id,
-        'request_id': request_id
-    }
 
-    if is_hidden:
-        await consumer.send(text_data=json.dumps(final_payload_js))
+    # /Collab file <path>: ... and /Collab folder <path>: ... write into the room's workspace
+    target_type, target_path, instructions, language = parse_collab_command('/Collab ' + user_query)
+    flight_key = None
+    if target_type:
+        run = lambda: answer_workspace_command(
+            consumer, is_hidden, target_type, target_path, instructions, language, request_id
+        )
     else:
-        await consumer.channel_layer.group_send(consumer.room_group_name, {
-            'type': 'bot_message',
-            'status': 'complete',
-            'message': clean_content,
-            'sender_username': 'Collab-X',
-            'jump_id': jump_id,
-            'request_id': request_id
+        # Keyed before queueing, so a repeat of a running request skips the
+        # room's queue and joins it (see BotScheduler)
+        last_message_id = await consumer.get_last_message_id()
+        flight_key = (consumer.room_group_name, normalize_query(user_query), last_message_id)
+        run = lambda: answer_collab_query(consumer, is_hidden, user_query, request_id, flight_key)
+
+    async def on_position(position):
+        await send_bot_frame(
+            consumer, is_hidden, 'queued', f"Queued (position {position})...", request_id,
+            queue_position=position
+        )
+
+    try:
+        job = get_bot_scheduler().submit(
+            consumer.room_group_name,
+            PRIORITY_HIDDEN if is_hidden else PRIORITY_SHARED,
+            run,
+            on_position=on_position,
+            key=flight_key,
+        )
+    except QueueFull:
+        await send_bot_frame(consumer, True, 'complete', BUSY_REPLY, request_id)
+        return
+
+    consumer.bot_jobs[job] = (is_hidden, request_id)
+
+    def forget(done):
+        consumer.bot_jobs.pop(job, None)
+        if not done.cancelled() and done.exception() is not None:
+            print(f"[Collab-X] ERROR: {done.exception()}")
+
+    job.done.add_done_callback(forget)
+
+
+async def answer_collab_query(consumer, is_hidden, user_query, request_id, flight_key):
+    """
+    Runs one /Collab request once the scheduler grants it a slot.
+
+    The answer is streamed: 'thinking', then any number of 'streaming' frames
+    whose content is the next chunk of text, then a 'complete' frame with the
+    full, cleaned answer. All frames share the same request_id.
+    """
+    await send_bot_frame(consumer, is_hidden, 'thinking', "Thinking...", request_id)
+
+    async def produce():
+        chat_history_string = await consumer.get_chat_history(user_query)
+
+        # The model call itself runs on the event loop; no sync-pool thread is held
+        full_text = ''
+        sent_upto = 0
+        async for chunk in stream_collab_response(chat_history_string, user_query):
+            full_text += chunk
+            safe_text, _ = split_streamable(full_text)
+            if len(safe_text) > sent_upto:
+                await send_bot_frame(consumer, is_hidden, 'streaming', safe_text[sent_upto:], request_id)
+                sent_upto = len(safe_text)
+        return full_text
+
+    # Identical requests for the same conversation state share one model call
+    full_text, _ = await bot_flights.run(
+        flight_key,
+        produce,
+        cacheable=lambda text: text not in (NOT_CONFIGURED_REPLY, ERROR_REPLY),
+    )
+
+    clean_content, jump_id = parse_bot_response(full_text.strip())
+    await send_bot_frame(consumer, is_hidden, 'complete', clean_content, request_id, jump_id=jump_id)
+
+
+def _read_workspace_file(workspace_key, path):
+    """Current content of the file at `path`, or None (walks the path, one query per segment)."""
+    parent_id = None
+    node = None
+    for name in normalize_path(path).split('/'):
+        node = WorkspaceNode.objects.filter(
+            workspace_key=workspace_key, parent_id=parent_id, name=name
+        ).only('id', 'node_type', 'content').first()
+        if node is None:
+            return None
+        parent_id = node.id
+    return node.content if node is not None and node.is_file else None
+
+
+async def answer_workspace_command(consumer, is_hidden, target_type, target_path, instructions, language, request_id):
+    """
+    Runs /Collab file|folder: asks the model for code blocks, turns them into
+    a changeset, applies it in one transaction and sends connected workspace
+    clients a single tree update.
+    """
+    await send_bot_frame(consumer, is_hidden, 'thinking', f"Writing {target_type} {target_path}...", request_id)
+
+    workspace_key = consumer.room_group_name
+    existing_content = None
+    if target_type == 'file':
+        existing_content = await database_sync_to_async(_read_workspace_file)(workspace_key, target_path)
+
+    response = await generate_workspace_code(target_type, target_path, instructions, language, existing_content)
+    if response is None:
+        await send_bot_frame(consumer, is_hidden, 'complete', ERROR_REPLY, request_id)
+        return
+
+    changes = build_changeset(target_type, target_path, extract_code_blocks(response), language)
+    if not changes:
+        await send_bot_frame(consumer, is_hidden, 'complete', "I couldn't produce any files for that request.", request_id)
+        return
+
+    result = await database_sync_to_async(apply_changeset)(workspace_key, changes, user=consumer.user)
+    if result['changed_ids']:
+        files = await database_sync_to_async(workspace_file_list)(workspace_key)
+        await consumer.channel_layer.group_send(f'workspace_{workspace_key}', {
+            'type': 'send_file_list',
+            'files': files,
+            'changed_node_ids': result['changed_ids']
         })
 
+    summary = []
+    if result['created']:
+        summary.append("Created " + ", ".join(result['created']))
+    if result['updated']:
+        summary.append("Updated " + ", ".join(result['updated']))
+    if result['skipped']:
+        summary.append("Skipped (name taken by a file/folder) " + ", ".join(result['skipped']))
+    await send_bot_frame(
+        consumer, is_hidden, 'complete', ". ".join(summary) or "No changes; the files are already up to date.", request_id
+    )
+
+
+async def cancel_bot_jobs(consumer):
+    """
+    Cancels the consumer's queued and running /Collab requests (on disconnect).
+    The room is told about shared ones so its placeholder bubble goes away.
+    """
+    scheduler = get_bot_scheduler()
+    for job, (is_hidden, request_id) in list(consumer.bot_jobs.items()):
+        scheduler.cancel(job)
+        if not is_hidden:
+            await send_bot_frame(consumer, False, 'cancelled', "Request cancelled.", request_id)
+    consumer.bot_jobs.clear()
+
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(QueryBudgetMixin, AsyncWebsocketConsumer):
+    default_frame_type = 'chat_message'
     
     async def connect(self):
+        self.bot_jobs = {}
         try:
             self.user = self.scope['user']
-            self.contact_id = self.scope['url_route']['kwargs']['contact_id']
+            self.contact_id = int(self.scope['url_route']['kwargs']['contact_id'])
             if not self.user.is_authenticated:
                 await self.close()
                 return
-            self.contact_user = await self.get_user(self.contact_id)
-            self.contact_profile = await self.get_profile(self.contact_user)
-            self.user_profile = await self.get_profile(self.user)
-            are_contacts = await self.check_contacts(self.user_profile, self.contact_user)
-            if not are_contacts:
+            # Cached contact check; no query in steady state
+            room_key = direct_room_key(self.user.id, self.contact_id)
+            if not await acan_access(self.user.id, room_key):
                 await self.close()
                 return
-        except User.DoesNotExist:
-            await self.close()
-            return
-        except Profile.DoesNotExist:
-            await self.close()
-            return
         except Exception as e:
             print(f"[WebSocket] ERROR: {e}")
             await self.close()
             return
-        user_ids = sorted([self.user.id, self.contact_user.id])
-        self.room_group_name = f'chat_{user_ids[0]}_{user_ids[1]}'
+        self.room_group_name = room_key
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
@@ -130,6 +284,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         if hasattr(self, 'room_group_name'):
+            await cancel_bot_jobs(self)
             await self.channel_layer.group_discard(
                 self.room_group_name,
                 self.channel_name
@@ -151,7 +306,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
             new_message = await self.save_message(
                 sender=self.user,
-                receiver=self.contact_user,
+                receiver_id=self.contact_id,
                 content=message_content
             )
             await self.channel_layer.group_send(
@@ -160,6 +315,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     'type': 'chat_message', 
                     'message_id': new_message.id, 
                     'message': new_message.content,
+                    'html': new_message.rendered_html,
                     'sender_username': self.user.username,
                     'timestamp': new_message.timestamp.strftime("%I:%M %p") 
                 }
@@ -167,24 +323,28 @@ class ChatConsumer(AsyncWebsocketConsumer):
         
         elif message_type == 'delete_message':
             message_id = data['message_id']
-            deleted_message = await self.delete_message(message_id)
+            deleted_message_id = await self.delete_message(message_id)
             
-            if deleted_message:
+            if deleted_message_id:
+                await discard_summary(self.room_group_name, deleted_message_id)
                 await self.channel_layer.group_send(
                     self.room_group_name,
                     {
                         'type': 'message_deleted', 
-                        'message_id': deleted_message.id,
+                        'message_id': deleted_message_id,
                     }
                 )
 
         elif message_type == 'execute_code':
             code = data.get('code', '')
             if code:
-                result = await database_sync_to_async(execute_python_code)(code)
+                result, cached = await database_sync_to_async(execute_python_code)(
+                    code, use_cache=data.get('cache', True)
+                )
                 await self.send(text_data=json.dumps({
                     'type': 'execution_result',
-                    'output': result
+                    'output': result,
+                    'cached': cached
                 }))
 
     async def chat_message(self, event):
@@ -192,8 +352,19 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'type': 'chat_message', 
             'message_id': event['message_id'], 
             'content': event['message'],
+            'html': event.get('html'),
             'sender_username': event['sender_username'],
             'timestamp': event['timestamp'],
+            'attachment_url': event.get('attachment_url'),
+            'attachment_name': event.get('attachment_name'),
+            'attachment_content_type': event.get('attachment_content_type'),
+        }))
+
+    async def attachment_thumbnails(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'attachment_thumbnails',
+            'message_id': event['message_id'],
+            'thumbnails': event['thumbnails'],
         }))
 
     async def message_deleted(self, event):
@@ -210,68 +381,70 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'content': event['message'],
             'sender_username': event['sender_username'],
             'jump_id': event.get('jump_id', None),
-            'request_id': event.get('request_id')
+            'request_id': event.get('request_id'),
+            'queue_position': event.get('queue_position')
         }))
+
+    async def access_revoked(self, event):
+        # Contact removed / left the group: drop the socket right away
+        if event.get('user_ids') is None or self.user.id in event['user_ids']:
+            await self.close(code=REVOKED_CLOSE_CODE)
         
-    @database_sync_to_async
-    def get_chat_history(self):
-        # Optimize: Use select_related and limit to last 50 messages for AI context
-        messages_queryset = Message.objects.filter(
-            (Q(sender=self.user) & Q(receiver=self.contact_user)) |
-            (Q(sender=self.contact_user) & Q(receiver=self.user)),
+    def history_queryset(self):
+        return Message.objects.filter(
+            (Q(sender_id=self.user.id) & Q(receiver_id=self.contact_id)) |
+            (Q(sender_id=self.contact_id) & Q(receiver_id=self.user.id)),
             is_deleted=False
-        ).select_related('sender', 'sender__profile').order_by('-timestamp')[:50]
-        # Reverse to get chronological order
-        return format_chat_history(reversed(messages_queryset))
+        )
 
-    @database_sync_to_async
-    def get_user(self, user_id):
-        return User.objects.select_related('profile').get(id=user_id)
-    @database_sync_to_async
-    def get_profile(self, user):
-        return Profile.objects.select_related('user').get(user=user)
-    @database_sync_to_async
-    def check_contacts(self, user_profile, contact_user):
-        return user_profile.contacts.filter(user=contact_user).exists()
-    @database_sync_to_async
-    def save_message(self, sender, receiver, content):
-        return Message.objects.create(sender=sender, receiver=receiver, content=content)
-    @database_sync_to_async
-    def delete_message(self, message_id):
-        try:
-            msg = Message.objects.get(id=message_id, sender=self.user)
-            if not msg.is_deleted:
-                msg.is_deleted = True
-                msg.content = "This message was deleted."
-                msg.save()
-                return msg
-        except Message.DoesNotExist:
-            return None
-        return None
+    async def get_chat_history(self, query=None):
+        # Rolling summary + retrieved history + recent tail instead of the last 50 messages
+        async with areplica_reads(self.user.id):
+            return await build_history_context(self.room_group_name, self.history_queryset(), query)
+
+    async def get_last_message_id(self):
+        return await self.history_queryset().order_by('-id').values_list('id', flat=True).afirst()
+
+    # Hot-path DB access uses the async ORM: one executor hop per call, and
+    # each helper is a single query.
+    async def save_message(self, sender, receiver_id, content):
+        await amark_write(sender.id)
+        return await Message.objects.acreate(sender_id=sender.id, receiver_id=receiver_id, content=content)
+    async def delete_message(self, message_id):
+        """Soft-deletes the user's own message; returns its id, or None."""
+        await amark_write(self.user.id)
+        updated = await Message.objects.filter(id=message_id, sender_id=self.user.id, is_deleted=False).aupdate(
+            is_deleted=True, content="This message was deleted.",
+            rendered_html=deleted_body(), render_version=RENDER_VERSION,
+        )
+        if updated:
+            touch_conversation(self.room_group_name)
+            await database_sync_to_async(message_deleted)(self.room_group_name, int(message_id))
+        return int(message_id) if updated else None
 
 
-class GroupChatConsumer(AsyncWebsocketConsumer):
+class GroupChatConsumer(QueryBudgetMixin, AsyncWebsocketConsumer):
+    default_frame_type = 'chat_message'
     
     async def connect(self):
+        self.bot_jobs = {}
         try:
             self.user = self.scope['user']
-            self.group_id = self.scope['url_route']['kwargs']['group_id']
+            self.group_id = int(self.scope['url_route']['kwargs']['group_id'])
             if not self.user.is_authenticated:
                 await self.close()
                 return
-            self.group = await self.get_group(self.group_id)
-            is_member = await self.check_membership(self.group, self.user)
-            if not is_member:
+            # Cached membership check instead of loading the group with all its members
+            if not await acan_access(self.user.id, group_room_key(self.group_id)):
                 await self.close()
                 return
-        except Group.DoesNotExist:
-            await self.close()
-            return
+            # Warm the identity cache so chat frames never query for the sender's name
+            await aget_identity(self.user.id)
         except Exception as e:
             print(f"[WebSocket] ERROR: {e}")
             await self.close()
             return
-        self.room_group_name = f'group_{self.group_id}'
+        self.room_group_name = group_room_key(self.group_id)
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
@@ -280,6 +453,7 @@ class GroupChatConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         if hasattr(self, 'room_group_name'):
+            await cancel_bot_jobs(self)
             await self.channel_layer.group_discard(
                 self.room_group_name,
                 self.channel_name
@@ -300,11 +474,10 @@ class GroupChatConsumer(AsyncWebsocketConsumer):
                 return
 
             new_message = await self.save_group_message(
-                group=self.group,
+                group_id=self.group_id,
                 sender=self.user,
                 content=message_content
             )
-            # Get sender display name for group messages
             sender_display_name = await self.get_sender_display_name(self.user)
             await self.channel_layer.group_send(
                 self.room_group_name,
@@ -312,6 +485,7 @@ class GroupChatConsumer(AsyncWebsocketConsumer):
                     'type': 'group_chat_message',
                     'message_id': new_message.id, 
                     'message': new_message.content,
+                    'html': new_message.rendered_html,
                     'sender_username': self.user.username,
                     'sender_display_name': sender_display_name,
                     'timestamp': new_message.timestamp.strftime("%I:%M %p")
@@ -320,24 +494,28 @@ class GroupChatConsumer(AsyncWebsocketConsumer):
             
         elif message_type == 'delete_message':
             message_id = data['message_id']
-            deleted_message = await self.delete_group_message(message_id)
+            deleted_message_id = await self.delete_group_message(message_id)
             
-            if deleted_message:
+            if deleted_message_id:
+                await discard_summary(self.room_group_name, deleted_message_id)
                 await self.channel_layer.group_send(
                     self.room_group_name,
                     {
                         'type': 'message_deleted',
-                        'message_id': deleted_message.id,
+                        'message_id': deleted_message_id,
                     }
                 )
 
         elif message_type == 'execute_code':
             code = data.get('code', '')
             if code:
-                result = await database_sync_to_async(execute_python_code)(code)
+                result, cached = await database_sync_to_async(execute_python_code)(
+                    code, use_cache=data.get('cache', True)
+                )
                 await self.send(text_data=json.dumps({
                     'type': 'execution_result',
-                    'output': result
+                    'output': result,
+                    'cached': cached
                 }))
 
     async def group_chat_message(self, event):
@@ -345,11 +523,22 @@ class GroupChatConsumer(AsyncWebsocketConsumer):
             'type': 'chat_message', 
             'message_id': event['message_id'], 
             'content': event['message'],
+            'html': event.get('html'),
             'sender_username': event['sender_username'],
             'sender_display_name': event.get('sender_display_name'),
             'timestamp': event['timestamp'],
+            'attachment_url': event.get('attachment_url'),
+            'attachment_name': event.get('attachment_name'),
+            'attachment_content_type': event.get('attachment_content_type'),
         }))
-        
+
+    async def attachment_thumbnails(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'attachment_thumbnails',
+            'message_id': event['message_id'],
+            'thumbnails': event['thumbnails'],
+        }))
+
     async def message_deleted(self, event):
         await self.send(text_data=json.dumps({
             'type': 'message_deleted',
@@ -364,58 +553,61 @@ class GroupChatConsumer(AsyncWebsocketConsumer):
             'content': event['message'],
             'sender_username': event['sender_username'],
             'jump_id': event.get('jump_id', None),
-            'request_id': event.get('request_id')
+            'request_id': event.get('request_id'),
+            'queue_position': event.get('queue_position')
         }))
-        
-    @database_sync_to_async
-    def get_chat_history(self):
-        # Optimize: Use select_related and limit to last 50 messages for AI context
-        messages_queryset = self.group.messages.filter(
-            is_deleted=False
-        ).select_related('sender', 'sender__profile').order_by('-timestamp')[:50]
-        # Reverse to get chronological order
-        return format_chat_history(reversed(messages_queryset))
 
-    @database_sync_to_async
-    def get_group(self, group_id):
-        return Group.objects.prefetch_related('members').get(id=group_id)
-    @database_sync_to_async
-    def check_membership(self, group, user):
-        return group.members.filter(id=user.id).exists()
-    @database_sync_to_async
-    def save_group_message(self, group, sender, content):
-        return GroupMessage.objects.create(group=group, sender=sender, content=content)
-    @database_sync_to_async
-    def get_sender_display_name(self, user):
-        # Use select_related to avoid extra query if profile not already loaded
-        user_with_profile = User.objects.select_related('profile').get(id=user.id)
-        return user_with_profile.profile.display_name or user_with_profile.username
-    @database_sync_to_async
-    def delete_group_message(self, message_id):
-        try:
-            msg = GroupMessage.objects.get(id=message_id, sender=self.user)
-            if not msg.is_deleted:
-                msg.is_deleted = True
-                msg.content = "This message was deleted."
-                msg.save()
-                return msg
-        except GroupMessage.DoesNotExist:
-            return None
-        return None
+    async def access_revoked(self, event):
+        # Contact removed / left the group: drop the socket right away
+        if event.get('user_ids') is None or self.user.id in event['user_ids']:
+            await self.close(code=REVOKED_CLOSE_CODE)
+        
+    def history_queryset(self):
+        return GroupMessage.objects.filter(group_id=self.group_id, is_deleted=False)
+
+    async def get_chat_history(self, query=None):
+        # Rolling summary + retrieved history + recent tail instead of the last 50 messages
+        async with areplica_reads(self.user.id):
+            return await build_history_context(self.room_group_name, self.history_queryset(), query)
+
+    async def get_last_message_id(self):
+        return await self.history_queryset().order_by('-id').values_list('id', flat=True).afirst()
+
+    async def save_group_message(self, group_id, sender, content):
+        await amark_write(sender.id)
+        return await GroupMessage.objects.acreate(group_id=group_id, sender_id=sender.id, content=content)
+    async def get_sender_display_name(self, user):
+        # Served from the identity cache: no query in steady state
+        return (await aget_identity(user.id))['display_name']
+    async def delete_group_message(self, message_id):
+        """Soft-deletes the user's own message; returns its id, or None."""
+        await amark_write(self.user.id)
+        updated = await GroupMessage.objects.filter(id=message_id, sender_id=self.user.id, is_deleted=False).aupdate(
+            is_deleted=True, content="This message was deleted.",
+            rendered_html=deleted_body(), render_version=RENDER_VERSION,
+        )
+        if updated:
+            touch_conversation(self.room_group_name)
+            await database_sync_to_async(message_deleted)(self.room_group_name, int(message_id))
+        return int(message_id) if updated else None
 
-class WorkspaceConsumer(AsyncWebsocketConsumer):
+class WorkspaceConsumer(QueryBudgetMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.workspace_key = self.scope['url_route']['kwargs']['workspace_key']
-        self.room_group_name = f'workspace_{self.workspace_key}'
         self.user = self.scope['user']
         self.active_file_id = None
         self.cursor_position = 0
-        self.user_color = await self.get_user_color()
+        self.user_color = self.get_user_color()
 
         if not self.user.is_authenticated:
             await self.close()
             return
+        # Workspaces share their chat's room key, and its access rules
+        if not await acan_access(self.user.id, self.workspace_key):
+            await self.close()
+            return
 
+        self.room_group_name = f'workspace_{self.workspace_key}'
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
@@ -436,6 +628,8 @@ class WorkspaceConsumer(AsyncWebsocketConsumer):
         )
 
     async def disconnect(self, close_code):
+        if not hasattr(self, 'room_group_name'):
+            return
         # Notify others that this user left
         await self.channel_layer.group_send(
             self.room_group_name,
@@ -575,12 +769,16 @@ class WorkspaceConsumer(AsyncWebsocketConsumer):
             language = data.get('language', 'python')
             
             if code and node_id:
-                result = await database_sync_to_async(execute_python_code)(code)
+                # Run the file from the synced workspace tree so sibling imports resolve
+                result, cached = await database_sync_to_async(execute_workspace)(
+                    self.workspace_key, node_id, code, use_cache=data.get('cache', True)
+                )
                 await self.send(text_data=json.dumps({
                     'type': 'execution_result',
                     'node_id': node_id,
                     'output': result,
-                    'language': language
+                    'language': language,
+                    'cached': cached
                 }))
 
     async def file_updated(self, event):
@@ -650,6 +848,11 @@ class WorkspaceConsumer(AsyncWebsocketConsumer):
                 'user_id': event.get('user_id')
             }))
 
+    async def access_revoked(self, event):
+        # Contact removed / left the group: drop the socket right away
+        if event.get('user_ids') is None or self.user.id in event['user_ids']:
+            await self.close(code=REVOKED_CLOSE_CODE)
+
     async def broadcast_file_list(self):
         files = await self.get_files()
         # Send to all clients in the workspace
@@ -664,26 +867,13 @@ class WorkspaceConsumer(AsyncWebsocketConsumer):
     async def send_file_list(self, event):
         await self.send(text_data=json.dumps({
             'type': 'file_list',
-            'files': event['files']
+            'files': event['files'],
+            'changed_node_ids': event.get('changed_node_ids', [])
         }))
 
     @database_sync_to_async
     def get_files(self):
-        from .models import WorkspaceNode
-        # Optimize: Use select_related for parent to avoid N+1 queries
-        nodes = WorkspaceNode.objects.filter(
-            workspace_key=self.workspace_key
-        ).select_related('parent').order_by('node_type', 'name')
-        return [
-            {
-                'id': node.id,
-                'name': node.name,
-                'type': node.node_type,
-                'parent_id': node.parent.id if node.parent else None,
-                'language': node.language
-            }
-            for node in nodes
-        ]
+        return workspace_file_list(self.workspace_key)
 
     @database_sync_to_async
     def create_node(self, name, node_type, parent_id):
@@ -718,31 +908,24 @@ class WorkspaceConsumer(AsyncWebsocketConsumer):
             print(f"Error creating node: {e}")
             return None
 
-    @database_sync_to_async
-    def read_file_content(self, node_id):
-        from .models import WorkspaceNode
-        try:
-            node = WorkspaceNode.objects.get(id=node_id, workspace_key=self.workspace_key)
-            return node.content, node.language
-        except WorkspaceNode.DoesNotExist:
-            return "", "text"
+    async def read_file_content(self, node_id):
+        row = await WorkspaceNode.objects.filter(
+            id=node_id, workspace_key=self.workspace_key
+        ).values_list('content', 'language').afirst()
+        return row if row is not None else ("", "text")
 
-    @database_sync_to_async
-    def update_file_content(self, node_id, content):
-        from .models import WorkspaceNode
-        try:
-            node = WorkspaceNode.objects.get(id=node_id, workspace_key=self.workspace_key)
-            node.content = content
-            node.save()
-        except WorkspaceNode.DoesNotExist:
-            pass
+    async def update_file_content(self, node_id, content):
+        # updated_at is set explicitly: update() bypasses auto_now
+        await WorkspaceNode.objects.filter(id=node_id, workspace_key=self.workspace_key).aupdate(
+            content=content, updated_at=timezone.now()
+        )
     
     @database_sync_to_async
     def apply_delta(self, node_id, delta):
         """Apply an incremental delta (insert/delete/replace) to a file."""
         from .models import WorkspaceNode
         try:
-            node = WorkspaceNode.objects.get(id=node_id, workspace_key=self.workspace_key)
+            node = WorkspaceNode.objects.only('id', 'content').get(id=node_id, workspace_key=self.workspace_key)
             content = node.content or ''
             position = delta.get('position', 0)
             delta_type = delta.get('type')
@@ -761,29 +944,20 @@ class WorkspaceConsumer(AsyncWebsocketConsumer):
                 # Replace text at position
                 node.content = content[:position] + text + content[position + length:]
             
-            node.save()
+            node.save(update_fields=['content', 'updated_at'])
         except WorkspaceNode.DoesNotExist:
             pass
     
-    @database_sync_to_async
-    def get_display_name(self):
-        return self.user.profile.display_name or self.user.username
+    async def get_display_name(self):
+        # Sent with every edit/cursor frame; served from the identity cache
+        return (await aget_identity(self.user.id))['display_name']
     
-    @database_sync_to_async
     def get_user_color(self):
-        """Generate a consistent color for the user based on their ID."""
-        # Simple hash-based color generation
-        user_id = self.user.id
-        colors = [
-            '#FF6B6B', '#4ECDC4', '#45B7D1', '#FFA07A', '#98D8C8',
-            '#F7DC6F', '#BB8FCE', '#85C1E2', '#F8B739', '#52BE80'
-        ]
-        return colors[user_id % len(colors)]
+        """Consistent color for the user, based on their ID."""
+        return color_for(self.user.id)
 
-    @database_sync_to_async
-    def delete_node(self, node_id):
-        from .models import WorkspaceNode
+    async def delete_node(self, node_id):
         try:
-            WorkspaceNode.objects.filter(id=node_id, workspace_key=self.workspace_key).delete()
+            await WorkspaceNode.objects.filter(id=node_id, workspace_key=self.workspace_key).adelete()
         except Exception:
             pass
\ No newline at end of file
@@ -0,0 +1,244 @@
+# chatapp/conversations.py
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db.models import Count, Q
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import dateformat, timezone
+
+from . import metrics
+from .identity import identity_cache, identity_versions
+from .models import Message, GroupMessage, Group
+from .rendering import prepare_bodies
+from .rooms import direct_room_key, group_room_key, parse_room_key
+from .storage import file_urls
+
+PREVIEW_LABELS = ('md', 'lg')
+
+
+def _version_key(room_key):
+    return f'conversation:v:{room_key}'
+
+
+def fresh_version():
+    # Starting from the clock means a counter lost from the cache never
+    # comes back as a value an old ETag was built from
+    return time.time_ns() // 1000
+
+
+def conversation_version(room_key):
+    """Current version of a room's messages/header, from the shared cache."""
+    key = _version_key(room_key)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, fresh_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def conversation_versions(room_keys):
+    """conversation_version of many rooms in one cache round trip (plus one per unknown room)."""
+    keys = {room_key: _version_key(room_key) for room_key in room_keys}
+    found = cache.get_many(list(keys.values()))
+    return {
+        room_key: found[key] if found.get(key) is not None else conversation_version(room_key)
+        for room_key, key in keys.items()
+    }
+
+
+def touch_conversation(room_key):
+    """Something in the room changed: its cached page and ETags go stale."""
+    key = _version_key(room_key)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, fresh_version(), None)
+
+
+def message_room_key(message):
+    if isinstance(message, GroupMessage):
+        return group_room_key(message.group_id)
+    return direct_room_key(message.sender_id, message.receiver_id)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=GroupMessage)
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=GroupMessage)
+def message_changed(sender, instance, **kwargs):
+    touch_conversation(message_room_key(instance))
+
+
+@receiver(post_save, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    touch_conversation(group_room_key(instance.id))
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def group_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    group_ids = (pk_set or ()) if reverse else [instance.pk]
+    for group_id in group_ids:
+        touch_conversation(group_room_key(group_id))
+
+
+# Deleting a user drops their memberships without an m2m_changed signal
+@receiver(pre_delete, sender=User)
+def member_deleted(sender, instance, **kwargs):
+    for group_id in instance.chat_groups.values_list('id', flat=True):
+        touch_conversation(group_room_key(group_id))
+
+
+def _message_entry(message):
+    entry = {
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'time': dateformat.format(timezone.localtime(message.timestamp), 'h:i A'),
+        'deleted': message.is_deleted,
+        'content': '' if message.is_deleted else message.content,
+        'html': str(message.body_html),
+        'attachment': None,
+    }
+    if message.file and not message.is_deleted:
+        previews = {label: (message.thumbnails or {}).get(label) for label in PREVIEW_LABELS}
+        entry['attachment'] = {
+            'name': message.file_name or 'Attachment',
+            'file': message.file.name,
+            'size': message.file_size,
+            'content_type': message.content_type,
+            'thumbnails': {label: found for label, found in previews.items() if isinstance(found, dict)},
+        }
+    return entry
+
+
+def _load_page(room_key, before=None):
+    kind, ids = parse_room_key(room_key)
+    size = settings.CONVERSATION_PAGE_SIZE
+    page = {'group': None}
+    if kind == 'direct':
+        a, b = ids
+        messages = Message.objects.filter(Q(sender_id=a, receiver_id=b) | Q(sender_id=b, receiver_id=a))
+    else:
+        messages = GroupMessage.objects.filter(group_id=ids[0])
+        if before is None:
+            page['group'] = Group.objects.filter(id=ids[0]).annotate(
+                member_count=Count('members')
+            ).values('name', 'creator_id', 'member_count').first()
+    if before is not None:
+        messages = messages.filter(id__lt=before)
+    rows = list(messages.order_by('-id')[:size + 1])
+    page['has_more'] = len(rows) > size
+    page['messages'] = [_message_entry(message) for message in prepare_bodies(list(reversed(rows[:size])))]
+    return page
+
+
+def conversation_page(room_key, version, before=None):
+    """
+    Compact page of a room's messages (newest CONVERSATION_PAGE_SIZE, or
+    the ones before message id `before`) plus group header data. Storage
+    names are not signed yet. The newest page is cached per room version,
+    so repeat switches to an unchanged chat run no message queries.
+    """
+    if before is not None:
+        return _load_page(room_key, before)
+    key = f'conversation:page:{room_key}:{version}'
+    page = cache.get(key)
+    if page is None:
+        metrics.incr('conversation.page_misses')
+        page = _load_page(room_key)
+        cache.set(key, page, settings.CONVERSATION_CACHE_SECONDS)
+    else:
+        metrics.incr('conversation.page_hits')
+    return page
+
+
+def page_people(room_key, viewer_id, page):
+    """Ids of everyone whose identity appears in the response for `page`."""
+    kind, ids = parse_room_key(room_key)
+    people = {message['sender_id'] for message in page['messages']}
+    if kind == 'direct':
+        people.update(ids)
+    people.add(viewer_id)
+    return sorted(people)
+
+
+def _url_epoch():
+    # Presigned URLs inside a cached response must not outlive their
+    # signature: the ETag rolls over well within the refresh margin.
+    if not getattr(default_storage, 'querystring_auth', False):
+        return 0
+    return int(time.time() // max(1, settings.SIGNED_URL_REFRESH_MARGIN // 2))
+
+
+def conversation_etag(room_key, viewer_id, version, people, before=None):
+    versions = identity_versions(people)
+    parts = [room_key, viewer_id, version, before or '', _url_epoch()]
+    parts += [f'{user_id}:{versions[user_id]}' for user_id in people]
+    return '"%s"' % hashlib.sha1('|'.join(map(str, parts)).encode('utf-8')).hexdigest()
+
+
+def conversation_payload(room_key, viewer_id, page, people):
+    """The chat-switch response: header, people and messages with signed URLs."""
+    kind, ids = parse_room_key(room_key)
+    identities = identity_cache.get_many(people)
+
+    names = [identity['avatar_name'] for identity in identities.values()]
+    for message in page['messages']:
+        attachment = message['attachment']
+        if attachment:
+            names.append(attachment['file'])
+            names += [v['name'] for v in attachment['thumbnails'].values()]
+    urls = file_urls(default_storage, names)
+
+    messages = []
+    for message in page['messages']:
+        attachment = message['attachment']
+        if attachment:
+            attachment = {
+                'name': attachment['name'],
+                'size': attachment['size'],
+                'content_type': attachment['content_type'],
+                'url': urls.get(attachment['file'], ''),
+                'thumbnails': {
+                    label: dict(v, url=urls.get(v['name'], '')) for label, v in attachment['thumbnails'].items()
+                },
+            }
+        messages.append(dict(message, attachment=attachment))
+
+    if kind == 'direct':
+        other = identities.get(ids[0] if ids[1] == viewer_id else ids[1]) or {}
+        header = {
+            'title': other.get('display_name', ''),
+            'subtitle': f"@{other.get('username', '')}",
+            'avatar_url': urls.get(other.get('avatar_name'), ''),
+        }
+    elif page['group']:
+        count = page['group']['member_count']
+        header = {
+            'title': page['group']['name'],
+            'subtitle': f"{count} member{'' if count == 1 else 's'}",
+            'creator_id': page['group']['creator_id'],
+        }
+    else:
+        header = None
+
+    return {
+        'header': header,
+        'people': {
+            user_id: {
+                'username': identity['username'],
+                'display_name': identity['display_name'],
+                'color': identity['color'],
+            }
+            for user_id, identity in identities.items()
+        },
+        'messages': messages,
+        'before': page['messages'][0]['id'] if page['has_more'] and page['messages'] else None,
+    }
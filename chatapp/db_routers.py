@@ -0,0 +1,132 @@
+# chatapp/db_routers.py
+
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+
+REPLICA_ALIAS = 'replica'
+
+# True inside a replica_reads() block; contextvars follow sync_to_async hops
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def _pin_key(user_id):
+    return f'db:pin:{user_id}'
+
+
+# This process's own pins: user_id -> monotonic expiry. Checked before the
+# shared cache, so a consumer that just wrote needs no cache round trip.
+_local_pins = {}
+_local_pins_lock = threading.Lock()
+
+
+def _pin_seconds():
+    return getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 5)
+
+
+def _pin_locally(user_id):
+    """Pin `user_id` in this process; returns the seconds the previous local pin had left."""
+    now = time.monotonic()
+    with _local_pins_lock:
+        left = _local_pins.get(user_id, now) - now
+        _local_pins[user_id] = now + _pin_seconds()
+        if len(_local_pins) > 10000:
+            for pinned_id, expires in list(_local_pins.items()):
+                if expires <= now:
+                    del _local_pins[pinned_id]
+    return left
+
+
+def _pinned_locally(user_id):
+    with _local_pins_lock:
+        return _local_pins.get(user_id, 0) > time.monotonic()
+
+
+def mark_write(user_id):
+    """Keep this user's reads on the primary for DATABASE_REPLICA_PIN_SECONDS."""
+    if user_id and REPLICA_ALIAS in settings.DATABASES:
+        _pin_locally(user_id)
+        cache.set(_pin_key(user_id), 1, _pin_seconds())
+
+
+async def amark_write(user_id):
+    """
+    mark_write() for async code (consumers). Django's async cache methods
+    run the sync ones in a thread, so the shared pin is only written when
+    this process's pin has less than half its time left: a user sending a
+    burst of messages costs one thread hop per half pin window, and other
+    processes always see the pin for at least half of it.
+    """
+    if user_id and REPLICA_ALIAS in settings.DATABASES:
+        if _pin_locally(user_id) < _pin_seconds() / 2:
+            await cache.aset(_pin_key(user_id), 1, _pin_seconds())
+
+
+def is_pinned(user_id):
+    return bool(user_id) and (_pinned_locally(user_id) or cache.get(_pin_key(user_id)) is not None)
+
+
+async def ais_pinned(user_id):
+    """A pin set by this process answers without a thread hop; otherwise the shared cache is asked (one hop)."""
+    if not user_id:
+        return False
+    return _pinned_locally(user_id) or await cache.aget(_pin_key(user_id)) is not None
+
+
+@contextmanager
+def replica_reads(user_id=None):
+    """
+    Route reads inside the block to the replica, unless there is none or
+    `user_id` wrote recently (read-your-writes).
+    """
+    enabled = REPLICA_ALIAS in settings.DATABASES and not is_pinned(user_id)
+    token = _use_replica.set(enabled)
+    try:
+        yield enabled
+    finally:
+        _use_replica.reset(token)
+
+
+@asynccontextmanager
+async def areplica_reads(user_id=None):
+    """replica_reads() for async code; see ais_pinned() for what the pin check costs."""
+    enabled = REPLICA_ALIAS in settings.DATABASES and not await ais_pinned(user_id)
+    token = _use_replica.set(enabled)
+    try:
+        yield enabled
+    finally:
+        _use_replica.reset(token)
+
+
+def replica_view(view_func):
+    """View decorator: the whole view (template rendering included) reads from the replica."""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        with replica_reads(request.user.id):
+            return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Reads go to the replica only inside replica_reads(); everything else,
+    and every write, uses the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        return REPLICA_ALIAS if _use_replica.get() else 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
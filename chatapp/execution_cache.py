@@ -0,0 +1,152 @@
+# chatapp/execution_cache.py
+
+import os
+import sys
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from django.conf import settings
+
+from . import metrics
+
+metrics.register_gauge(
+    'execution_cache.hit_ratio',
+    lambda: round(metrics.ratio('execution_cache.hits', 'execution_cache.misses'), 4),
+)
+
+
+def make_key(code, input_files=None):
+    """
+    Build a cache key from the code, the interpreter version and the
+    content hashes of any input files ({path: sha256}).
+    """
+    digest = hashlib.sha256()
+    digest.update(sys.version.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update((code or '').encode('utf-8'))
+    for path, sha in sorted((input_files or {}).items()):
+        digest.update(b'\0')
+        digest.update(f"{path}={sha}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ExecutionCache:
+    """
+    Two-tier (memory + disk) cache of execution output with TTL and LRU
+    eviction on both tiers.
+    """
+
+    def __init__(self, max_entries=256, ttl=600, directory=None, max_disk_entries=2048):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.directory = Path(directory) if directory else None
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                expires_at, output = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    metrics.incr('execution_cache.hits')
+                    metrics.incr('execution_cache.memory_hits')
+                    return output
+                del self._memory[key]
+
+        entry = self._disk_get(key, now)
+        if entry is not None:
+            # Promote to memory with the remaining disk TTL
+            expires_at, output = entry
+            self._memory_set(key, output, expires_at)
+            metrics.incr('execution_cache.hits')
+            metrics.incr('execution_cache.disk_hits')
+            return output
+
+        metrics.incr('execution_cache.misses')
+        return None
+
+    def set(self, key, output):
+        expires_at = time.time() + self.ttl
+        self._memory_set(key, output, expires_at)
+        self._disk_set(key, output, expires_at)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.directory and self.directory.is_dir():
+            for path in self.directory.glob('*.json'):
+                path.unlink(missing_ok=True)
+
+    def _memory_set(self, key, output, expires_at):
+        with self._lock:
+            self._memory[key] = (expires_at, output)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                metrics.incr('execution_cache.evictions')
+
+    def _disk_path(self, key):
+        return self.directory / f"{key}.json"
+
+    def _disk_get(self, key, now):
+        if not self.directory:
+            return None
+        path = self._disk_path(key)
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        if data.get('expires_at', 0) <= now:
+            path.unlink(missing_ok=True)
+            return None
+        # Touch so mtime tracks recency for LRU eviction
+        os.utime(path)
+        return data['expires_at'], data.get('output')
+
+    def _disk_set(self, key, output, expires_at):
+        if not self.directory:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._disk_path(key).with_suffix('.tmp')
+            tmp_path.write_text(json.dumps({'expires_at': expires_at, 'output': output}))
+            os.replace(tmp_path, self._disk_path(key))
+            entries = list(self.directory.glob('*.json'))
+            if len(entries) > self.max_disk_entries:
+                entries.sort(key=lambda p: p.stat().st_mtime)
+                for path in entries[:len(entries) - self.max_disk_entries]:
+                    path.unlink(missing_ok=True)
+                    metrics.incr('execution_cache.evictions')
+        except OSError as e:
+            print(f"Execution cache write failed: {e}")
+
+
+_cache = None
+_cache_guard = threading.Lock()
+
+
+def get_execution_cache():
+    """Return the process-wide cache, or None when caching is disabled."""
+    global _cache
+    if not getattr(settings, 'CODE_EXECUTION_CACHE_ENABLED', False):
+        return None
+    with _cache_guard:
+        if _cache is None:
+            directory = getattr(settings, 'CODE_EXECUTION_CACHE_DIR', None) or (
+                Path(tempfile.gettempdir()) / 'collabx-exec-cache'
+            )
+            _cache = ExecutionCache(
+                max_entries=getattr(settings, 'CODE_EXECUTION_CACHE_MAX_ENTRIES', 256),
+                ttl=getattr(settings, 'CODE_EXECUTION_CACHE_TTL', 600),
+                directory=directory,
+            )
+        return _cache
@@ -0,0 +1,129 @@
+# chatapp/fragments.py
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db.models import Value
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from .conversations import fresh_version
+from .models import Profile, Group, ContactRequest
+from .rooms import direct_room_key, group_room_key
+
+
+def _sidebar_key(user_id):
+    return f'fragment:sidebar:v:{user_id}'
+
+
+def sidebar_version(user_id):
+    """
+    Version of a user's dashboard sidebar (requests, contacts, groups; the
+    last-message previews have their own fragment, see activity.py),
+    part of its {% cache %} key. A missing version restarts from the clock,
+    so invalidating is a plain delete and never revives an old fragment.
+    """
+    key = _sidebar_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, fresh_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def sidebar_rooms(user_id, version):
+    """Room keys of the chats listed in a user's sidebar, cached per sidebar version."""
+    key = f'fragment:sidebar:rooms:{user_id}:{version}'
+    rooms = cache.get(key)
+    if rooms is None:
+        # Contacts and groups in one query
+        contacts = Profile.contacts.through.objects.filter(from_profile__user_id=user_id).annotate(
+            kind=Value('direct')
+        ).values_list('kind', 'to_profile__user_id')
+        groups = Group.members.through.objects.filter(user_id=user_id).annotate(
+            kind=Value('group')
+        ).values_list('kind', 'group_id')
+        rooms = [
+            direct_room_key(user_id, chat_id) if kind == 'direct' else group_room_key(chat_id)
+            for kind, chat_id in contacts.union(groups, all=True)
+        ]
+        cache.set(key, rooms, fragment_timeout())
+    return rooms
+
+
+def touch_sidebars(user_ids):
+    """The sidebars of `user_ids` changed; one shared-cache round trip for all."""
+    keys = [_sidebar_key(user_id) for user_id in set(user_ids)]
+    if keys:
+        cache.delete_many(keys)
+
+
+def touch_contact_sidebars(profile):
+    """`profile`'s name or avatar changed: refresh everyone listing them as a contact."""
+    touch_sidebars(Profile.contacts.through.objects.filter(
+        to_profile_id=profile.pk
+    ).values_list('from_profile__user_id', flat=True))
+
+
+def fragment_timeout():
+    """Seconds a rendered fragment may be served from the cache."""
+    timeout = settings.FRAGMENT_CACHE_SECONDS
+    if getattr(default_storage, 'querystring_auth', False):
+        # Fragments embed presigned media URLs, which are handed out with at
+        # least the refresh margin left; stay well inside it
+        timeout = min(timeout, max(1, settings.SIGNED_URL_REFRESH_MARGIN // 2))
+    return timeout
+
+
+@receiver(post_save, sender=Profile)
+def profile_changed(sender, instance, **kwargs):
+    touch_contact_sidebars(instance)
+
+
+@receiver(m2m_changed, sender=Profile.contacts.through)
+def contacts_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        related = instance.contact_of if reverse else instance.contacts
+        touch_sidebars([instance.user_id, *related.values_list('user_id', flat=True)])
+        return
+    if action not in ('post_add', 'post_remove'):
+        return
+    touch_sidebars([instance.user_id, *Profile.objects.filter(id__in=pk_set).values_list('user_id', flat=True)])
+
+
+# Every member's sidebar shows the group's name and member count
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    touch_sidebars(instance.members.values_list('id', flat=True))
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('pre_clear', 'post_add', 'post_remove'):
+        return
+    if reverse:
+        group_ids = instance.chat_groups.values_list('id', flat=True) if action == 'pre_clear' else pk_set
+        members = Group.members.through.objects.filter(group_id__in=list(group_ids)).values_list('user_id', flat=True)
+        touch_sidebars([instance.id, *members])
+    else:
+        touch_sidebars([*(pk_set or ()), *instance.members.values_list('id', flat=True)])
+
+
+@receiver(post_save, sender=ContactRequest)
+@receiver(post_delete, sender=ContactRequest)
+def contact_request_changed(sender, instance, **kwargs):
+    touch_sidebars([instance.to_user_id])
+
+
+# Deleting a user drops their contact and membership rows without m2m_changed
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    listing = Profile.contacts.through.objects.filter(
+        to_profile__user_id=instance.id
+    ).values_list('from_profile__user_id', flat=True)
+    members = Group.members.through.objects.filter(
+        group__members=instance
+    ).values_list('user_id', flat=True)
+    touch_sidebars([*listing, *members])
@@ -1,13 +1,9 @@
 # chatapp/gemini_utils.py
 
-import google.generativeai as genai
-from django.conf import settings
+from .llm_backends import get_backend, LLMBackendError
 
-# Configure the API client
-if settings.GOOGLE_GEMINI_API_KEY:
-    genai.configure(api_key=settings.GOOGLE_GEMINI_API_KEY)
-else:
-    print("WARNING: GOOGLE_GEMINI_API_KEY not set. Bot features will be disabled.")
+NOT_CONFIGURED_REPLY = "Sorry, the bot is not configured. (Missing API Key)"
+ERROR_REPLY = "Sorry, I had trouble processing that request. Please try again."
 
 def format_chat_history(messages_queryset):
     """
@@ -27,19 +23,12 @@ def format_chat_history(messages_queryset):
     
     return "\n".join(history)
 
-def get_collab_response(chat_history_string, user_query):
+def build_collab_prompt(chat_history_string, user_query):
     """
-    Sends the formatted chat history and a user query to the Gemini API
-    with the 'Collab-X' personality.
+    Builds the 'Collab-X' personality prompt for a chat history and query.
     """
-    if not settings.GOOGLE_GEMINI_API_KEY:
-         return "Sorry, the bot is not configured. (Missing API Key)"
-         
-    # Use a fast model
-    model = genai.GenerativeModel('gemini-2.5-flash')
-
     # --- UPDATED "Personality" Prompt ---
-    prompt = f"""
+    return f"""
     You are 'Collab-X', a helpful AI assistant integrated into this chat application.
     Your personality is helpful, concise, and professional.
     You are part of the Collab-X application.
@@ -65,9 +54,118 @@ def get_collab_response(chat_history_string, user_query):
     Your Answer:
     """
 
+def get_collab_response(chat_history_string, user_query):
+    """
+    Sends the formatted chat history and a user query to the configured
+    LLM backend with the 'Collab-X' personality.
+    """
+    backend = get_backend()
+    if not backend.is_configured:
+         return NOT_CONFIGURED_REPLY
+
+    prompt = build_collab_prompt(chat_history_string, user_query)
+
+    try:
+        return backend.generate(prompt)
+    except LLMBackendError as e:
+        print(f"Error calling {backend.name} backend: {e}")
+        return ERROR_REPLY
+
+async def stream_collab_response(chat_history_string, user_query):
+    """
+    Asyncio-native variant of get_collab_response.
+    Yields the answer as text chunks while the backend streams it, without
+    holding a sync thread for the round-trip.
+    """
+    backend = get_backend()
+    if not backend.is_configured:
+        yield NOT_CONFIGURED_REPLY
+        return
+
+    prompt = build_collab_prompt(chat_history_string, user_query)
+
+    produced = False
+    try:
+        async for text in backend.astream(prompt):
+            produced = True
+            yield text
+    except LLMBackendError as e:
+        print(f"Error calling {backend.name} backend: {e}")
+        if not produced:
+            yield ERROR_REPLY
+
+def build_summary_prompt(previous_summary, new_history_string):
+    """
+    Builds the prompt that folds new messages into a rolling summary.
+    """
+    return f"""
+    You maintain a running summary of a chat conversation for the 'Collab-X' assistant.
+    Update the summary below with the new messages. Keep decisions, deadlines, owners,
+    open questions and the MESSAGE_ID of key messages in the form [id:MESSAGE_ID].
+    Stay under 250 words. Reply with the updated summary only.
+    
+    --- CURRENT SUMMARY ---
+    {previous_summary or "(empty)"}
+    
+    --- NEW MESSAGES ---
+    {new_history_string}
+    """
+
+async def summarize_history(previous_summary, new_history_string):
+    """
+    Returns the updated rolling summary, or None if the backend failed
+    (the caller should then keep the previous summary).
+    """
+    backend = get_backend()
+    if not backend.is_configured:
+        return None
+    try:
+        summary = await backend.agenerate(build_summary_prompt(previous_summary, new_history_string))
+    except LLMBackendError as e:
+        print(f"Error summarizing with {backend.name} backend: {e}")
+        return None
+    return summary.strip() or None
+
+def build_codegen_prompt(target_type, target_path, instructions, language=None, existing_content=None):
+    """
+    Builds the prompt for /Collab file and /Collab folder: the model answers
+    with fenced code blocks labelled ```language:filename.
+    """
+    if target_type == 'folder':
+        target = f'the folder "{target_path}". Create every file the task needs inside it; ' \
+                 'use filenames relative to that folder.'
+    else:
+        target = f'the file "{target_path}"' + (f' (language: {language})' if language else '') + \
+                 '. Reply with the complete new contents of that file.'
+    current = ""
+    if existing_content:
+        current = f"""
+    --- CURRENT CONTENTS OF {target_path} ---
+    {existing_content}
+    --- END CURRENT CONTENTS ---
+    """
+    return f"""
+    You are 'Collab-X', a coding assistant writing into a shared project workspace.
+    Your output is written to {target}
+    
+    --- TASK ---
+    {instructions or "Write a sensible starting point."}
+    {current}
+    Reply ONLY with fenced code blocks, one per file, each opened as ```language:filename
+    (for example ```python:main.py). Do not add explanations outside the code blocks.
+    """
+
+async def generate_workspace_code(target_type, target_path, instructions, language=None, existing_content=None):
+    """
+    Returns the model's code-block answer for a /Collab file|folder command,
+    or None if the backend is not configured or failed.
+    """
+    backend = get_backend()
+    if not backend.is_configured:
+        return None
+    prompt = build_codegen_prompt(target_type, target_path, instructions, language, existing_content)
     try:
-        response = model.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        print(f"Error calling Gemini API: {e}")
-        return "Sorry, I had trouble processing that request. Please try again."
\ No newline at end of file
+        return await backend.agenerate(prompt)
+    except LLMBackendError as e:
+        print(f"Error generating code with {backend.name} backend: {e}")
+        return None
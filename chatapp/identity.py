@@ -0,0 +1,198 @@
+# chatapp/identity.py
+
+import threading
+import time
+from collections import OrderedDict
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from . import metrics
+from .models import Profile
+from .storage import file_urls
+
+WORKSPACE_COLORS = [
+    '#FF6B6B', '#4ECDC4', '#45B7D1', '#FFA07A', '#98D8C8',
+    '#F7DC6F', '#BB8FCE', '#85C1E2', '#F8B739', '#52BE80'
+]
+
+
+def color_for(user_id):
+    """Consistent workspace color for a user, based on their ID."""
+    return WORKSPACE_COLORS[user_id % len(WORKSPACE_COLORS)]
+
+
+def _version_key(user_id):
+    return f'identity:v:{user_id}'
+
+
+def _avatar_name(profile):
+    if not profile or not profile.profile_picture:
+        return ''
+    thumbnails = profile.thumbnails or {}
+    if thumbnails.get('source') == profile.profile_picture.name and isinstance(thumbnails.get('md'), dict):
+        return thumbnails['md']['name']
+    return profile.profile_picture.name
+
+
+class IdentityCache:
+    """
+    Bounded, process-local LRU of {id, username, display_name, avatar_name,
+    color} keyed by user id. avatar_name is the storage name; presigned
+    URLs expire, so callers resolve it with avatar_urls() when rendering.
+
+    Saves of a User/Profile bump a per-user version in the shared Django
+    cache; every process re-checks an entry's version at most once per
+    `check_interval` seconds, so renames reach all workers without any
+    database query on the hot path.
+    """
+
+    def __init__(self, max_entries=2048, check_interval=5.0):
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self._entries = OrderedDict()  # user_id -> (identity, version, checked_at)
+        self._lock = threading.Lock()
+
+    def _entry(self, user_id):
+        """(identity, version, recheck) of a cached entry; `recheck` once its check interval is up."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(user_id)
+        identity, version, checked_at = entry
+        return identity, version, time.monotonic() - checked_at >= self.check_interval
+
+    def _checked(self, user_id, identity, version, current):
+        # `current` is the shared version just read from the cache
+        if (current or 0) != version:
+            self.discard(user_id)
+            return None
+        with self._lock:
+            if user_id in self._entries:
+                self._entries[user_id] = (identity, version, time.monotonic())
+        return identity
+
+    def _fresh(self, user_id):
+        entry = self._entry(user_id)
+        if entry is None:
+            return None
+        identity, version, recheck = entry
+        if not recheck:
+            return identity
+        return self._checked(user_id, identity, version, cache.get(_version_key(user_id)))
+
+    def _store(self, identity, version):
+        with self._lock:
+            self._entries[identity['id']] = (identity, version, time.monotonic())
+            self._entries.move_to_end(identity['id'])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def _load(self, user_ids):
+        # Read the versions first: a save racing with the load then only
+        # causes one extra reload later, never a stale entry.
+        versions = cache.get_many([_version_key(user_id) for user_id in user_ids])
+        users = User.objects.filter(id__in=user_ids).select_related('profile').only(
+            'id', 'username', 'profile__display_name', 'profile__profile_picture', 'profile__thumbnails'
+        )
+        loaded = {}
+        for user in users:
+            profile = getattr(user, 'profile', None)
+            identity = {
+                'id': user.id,
+                'username': user.username,
+                'display_name': (profile.display_name if profile else None) or user.username,
+                'avatar_name': _avatar_name(profile),
+                'color': color_for(user.id),
+            }
+            self._store(identity, versions.get(_version_key(user.id)) or 0)
+            loaded[user.id] = identity
+        return loaded
+
+    def get_many(self, user_ids):
+        """{user_id: identity} for the ids that exist; one query for all misses."""
+        found = {}
+        missing = []
+        for user_id in user_ids:
+            identity = self._fresh(user_id)
+            if identity is None:
+                missing.append(user_id)
+            else:
+                found[user_id] = identity
+        metrics.incr('identity_cache.hits', len(found))
+        if missing:
+            metrics.incr('identity_cache.misses', len(missing))
+            found.update(self._load(missing))
+        return found
+
+    def get(self, user_id):
+        return self.get_many([user_id]).get(user_id)
+
+    async def aget(self, user_id):
+        """
+        Async lookup. An entry inside its check interval is served on the
+        event loop; a due version re-check or a miss runs get() in one
+        thread hop (Django's async cache API is itself a thread hop, so
+        the re-check and the reload share it).
+        """
+        entry = self._entry(user_id)
+        if entry is not None and not entry[2]:
+            metrics.incr('identity_cache.hits')
+            return entry[0]
+        return await database_sync_to_async(self.get)(user_id)
+
+
+identity_cache = IdentityCache(
+    max_entries=getattr(settings, 'IDENTITY_CACHE_SIZE', 2048),
+    check_interval=getattr(settings, 'IDENTITY_CACHE_CHECK_SECONDS', 5.0),
+)
+
+
+def get_identity(user_id):
+    return identity_cache.get(user_id)
+
+
+async def aget_identity(user_id):
+    return await identity_cache.aget(user_id)
+
+
+def avatar_urls(identities):
+    """{avatar_name: url} for identities, signed in one batch."""
+    return file_urls(default_storage, [identity['avatar_name'] for identity in identities])
+
+
+def identity_versions(user_ids):
+    """{user_id: version} of the given identities, in one shared-cache round trip."""
+    keys = {_version_key(user_id): user_id for user_id in user_ids}
+    found = cache.get_many(list(keys))
+    return {user_id: found.get(key) or 0 for key, user_id in keys.items()}
+
+
+def invalidate_identity(user_id):
+    """Drop the local entry and bump the shared version so other processes reload."""
+    identity_cache.discard(user_id)
+    key = _version_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_identity(sender, instance, **kwargs):
+    invalidate_identity(instance.id)
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_profile_identity(sender, instance, **kwargs):
+    invalidate_identity(instance.user_id)
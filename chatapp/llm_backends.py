@@ -0,0 +1,203 @@
+# chatapp/llm_backends.py
+
+import asyncio
+import hashlib
+import importlib
+import threading
+import time
+
+from django.conf import settings
+
+
+class LLMBackendError(Exception):
+    """Raised when a backend gives up after its retries."""
+
+
+class LLMBackend:
+    """
+    Interface every bot model provider implements.
+
+    Backends are long-lived: one instance per process is created by
+    get_backend() and reused for every request.
+    """
+    name = 'base'
+
+    def __init__(self, timeout=30, max_retries=2, retry_backoff=0.5):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+    @property
+    def is_configured(self):
+        return True
+
+    def generate(self, prompt):
+        """Return the full answer for a prompt (blocking)."""
+        raise NotImplementedError
+
+    async def astream(self, prompt):
+        """Yield the answer as text chunks (asyncio-native)."""
+        raise NotImplementedError
+        yield  # pragma: no cover
+
+    async def agenerate(self, prompt):
+        chunks = []
+        async for chunk in self.astream(prompt):
+            chunks.append(chunk)
+        return ''.join(chunks)
+
+    def _retry_delay(self, attempt):
+        return self.retry_backoff * (2 ** attempt)
+
+
+class GeminiBackend(LLMBackend):
+    name = 'gemini'
+
+    def __init__(self, api_key=None, model_name='gemini-2.5-flash', **kwargs):
+        super().__init__(**kwargs)
+        self.api_key = api_key
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+        if not api_key:
+            print("WARNING: GOOGLE_GEMINI_API_KEY not set. Bot features will be disabled.")
+
+    @property
+    def is_configured(self):
+        return bool(self.api_key)
+
+    @property
+    def model(self):
+        # Configure the SDK and build the model once; the SDK keeps the
+        # underlying client (and its connection pool) alive for reuse.
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate(self, prompt):
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.model.generate_content(
+                    prompt, request_options={'timeout': self.timeout}
+                )
+                return response.text
+            except Exception as e:
+                last_error = e
+                if attempt < self.max_retries:
+                    time.sleep(self._retry_delay(attempt))
+        raise LLMBackendError(str(last_error))
+
+    async def astream(self, prompt):
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            produced = False
+            try:
+                response = await asyncio.wait_for(
+                    self.model.generate_content_async(
+                        prompt, stream=True, request_options={'timeout': self.timeout}
+                    ),
+                    timeout=self.timeout,
+                )
+                async for chunk in response:
+                    text = chunk.text
+                    if text:
+                        produced = True
+                        yield text
+                return
+            except Exception as e:
+                # Once text reached the caller a retry would duplicate it
+                if produced:
+                    raise LLMBackendError(str(e))
+                last_error = e
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self._retry_delay(attempt))
+        raise LLMBackendError(str(last_error))
+
+
+class StubBackend(LLMBackend):
+    """
+    Deterministic offline provider for development and load testing.
+
+    The answer depends only on the prompt, and latency is simulated as a
+    fixed time-to-first-token plus a delay per streamed word.
+    """
+    name = 'stub'
+
+    def __init__(self, latency=0.5, token_delay=0.02, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.token_delay = token_delay
+
+    def _answer(self, prompt):
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        if '```language:filename' in prompt:
+            # Code-generation prompts get one fenced block, like a real model would send
+            return f"```text:stub_{digest[:8]}.txt\nSimulated Collab-X file ({digest[:8]}). No model was called.\n```"
+        return (
+            f"This is a simulated Collab-X answer ({digest[:8]}) for a prompt of "
+            f"{len(prompt)} characters. No model was called."
+        )
+
+    def _tokens(self, prompt):
+        words = self._answer(prompt).split(' ')
+        return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+    def generate(self, prompt):
+        tokens = self._tokens(prompt)
+        time.sleep(self.latency + self.token_delay * len(tokens))
+        return ''.join(tokens)
+
+    async def astream(self, prompt):
+        await asyncio.sleep(self.latency)
+        for token in self._tokens(prompt):
+            yield token
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+
+
+BACKENDS = {
+    'gemini': GeminiBackend,
+    'stub': StubBackend,
+}
+
+_backend = None
+_backend_guard = threading.Lock()
+
+
+def build_backend(name=None):
+    """Instantiate the backend named in settings (or a dotted class path)."""
+    name = name or getattr(settings, 'COLLAB_LLM_BACKEND', 'gemini')
+    common = {
+        'timeout': getattr(settings, 'COLLAB_LLM_TIMEOUT', 30),
+        'max_retries': getattr(settings, 'COLLAB_LLM_MAX_RETRIES', 2),
+    }
+    if name == 'gemini':
+        return GeminiBackend(
+            api_key=getattr(settings, 'GOOGLE_GEMINI_API_KEY', None),
+            model_name=getattr(settings, 'COLLAB_LLM_MODEL', 'gemini-2.5-flash'),
+            **common,
+        )
+    if name == 'stub':
+        return StubBackend(
+            latency=getattr(settings, 'COLLAB_LLM_STUB_LATENCY', 0.5),
+            token_delay=getattr(settings, 'COLLAB_LLM_STUB_TOKEN_DELAY', 0.02),
+            **common,
+        )
+    module_path, _, class_name = name.rpartition('.')
+    backend_class = getattr(importlib.import_module(module_path), class_name)
+    return backend_class(**common)
+
+
+def get_backend():
+    """Return the process-wide backend, creating it on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_guard:
+            if _backend is None:
+                _backend = build_backend()
+    return _backend
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from chatapp.attachments import METADATA_FIELDS, attachment_metadata
+from chatapp.models import Message, GroupMessage
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill file_size, content_type, checksum and image dimensions for attachments "
+        "uploaded before they were captured at upload. Reads each file from storage "
+        "once; safe to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--dry-run', action='store_true', help="Only count the rows that need a backfill.")
+
+    def handle(self, *args, **options):
+        for model in (Message, GroupMessage):
+            pending = model.objects.exclude(file='').exclude(file__isnull=True).filter(file_size__isnull=True)
+            if options['dry_run']:
+                self.stdout.write(f"{model.__name__}: {pending.count()} attachments to backfill")
+                continue
+
+            done = missing = 0
+            last_id = 0
+            while True:
+                batch = list(pending.filter(id__gt=last_id).order_by('id').only('id', 'file', 'file_name')[:options['batch_size']])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                updated = []
+                for message in batch:
+                    try:
+                        with message.file.open('rb') as stored:
+                            metadata = attachment_metadata(stored, name=message.file_name or message.file.name)
+                    except (FileNotFoundError, OSError) as e:
+                        print(f"Skipping {model.__name__} {message.id}: {e}")
+                        missing += 1
+                        continue
+                    for field, value in metadata.items():
+                        setattr(message, field, value)
+                    updated.append(message)
+                model.objects.bulk_update(updated, METADATA_FIELDS)
+                done += len(updated)
+
+            self.stdout.write(self.style.SUCCESS(
+                f"{model.__name__}: backfilled {done} attachments ({missing} missing from storage)"
+            ))
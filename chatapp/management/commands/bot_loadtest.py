@@ -0,0 +1,59 @@
+import asyncio
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatapp.gemini_utils import build_collab_prompt
+from chatapp.llm_backends import build_backend
+
+
+class Command(BaseCommand):
+    help = "Fire concurrent bot requests at an LLM backend and report latency and throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', default='stub', help="Backend name or dotted class path (default: stub).")
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--history-lines', type=int, default=50)
+
+    def handle(self, *args, **options):
+        backend = build_backend(options['backend'])
+        history = "\n".join(
+            f"[id:{i}] user{i % 5}: message number {i}" for i in range(options['history_lines'])
+        )
+        results = asyncio.run(self._run(backend, history, options['requests'], options['concurrency']))
+
+        ttft = sorted(r[0] for r in results)
+        total = sorted(r[1] for r in results)
+        wall = max(r[2] for r in results) - min(r[3] for r in results)
+
+        def pct(values, p):
+            return values[min(len(values) - 1, int(len(values) * p))]
+
+        self.stdout.write(f"backend={backend.name} requests={len(results)} concurrency={options['concurrency']}")
+        self.stdout.write(
+            f"time-to-first-token p50={pct(ttft, 0.5) * 1000:.1f}ms "
+            f"p95={pct(ttft, 0.95) * 1000:.1f}ms"
+        )
+        self.stdout.write(
+            f"full response      p50={pct(total, 0.5) * 1000:.1f}ms "
+            f"p95={pct(total, 0.95) * 1000:.1f}ms mean={statistics.mean(total) * 1000:.1f}ms"
+        )
+        self.stdout.write(f"throughput={len(results) / wall:.2f} req/s")
+
+    async def _run(self, backend, history, count, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with semaphore:
+                prompt = build_collab_prompt(history, f"Summarize request {i}")
+                started = time.perf_counter()
+                first = None
+                async for _ in backend.astream(prompt):
+                    if first is None:
+                        first = time.perf_counter()
+                finished = time.perf_counter()
+                return (first or finished) - started, finished - started, finished, started
+
+        return await asyncio.gather(*(one(i) for i in range(count)))
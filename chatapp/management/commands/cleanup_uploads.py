@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chatapp.models import UploadSession
+from chatapp.uploads import abort_upload
+
+
+class Command(BaseCommand):
+    help = (
+        "Abort attachment uploads that have been idle for too long (freeing staged chunks "
+        "and incomplete multipart uploads) and delete finished upload sessions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help="Idle time after which a pending upload is abandoned.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        aborted = failed = 0
+        # A completion claimed but never finished (the process died mid-way) is abandoned too
+        unfinished = [UploadSession.Status.PENDING, UploadSession.Status.COMPLETING]
+        stale = UploadSession.objects.filter(status__in=unfinished, updated_at__lt=cutoff)
+        for session in stale.iterator():
+            try:
+                if abort_upload(session):
+                    aborted += 1
+            except Exception as e:
+                print(f"Could not abort upload {session.id}: {e}")
+                failed += 1
+
+        deleted, _ = UploadSession.objects.exclude(status__in=unfinished).filter(updated_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f"Aborted {aborted} stale uploads ({failed} failed), deleted {deleted} finished sessions"
+        ))
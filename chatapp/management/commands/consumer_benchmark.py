@@ -0,0 +1,141 @@
+import asyncio
+import time
+import uuid
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from chatapp.models import Group, WorkspaceNode
+from chatapp.rooms import direct_room_key
+from chatapp.routing import websocket_urlpatterns
+
+BENCH_PREFIX = 'bench_consumer_'
+
+
+def _pct(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure per-frame latency of the chat, group and workspace consumers under "
+        "concurrent load. Creates temporary bench_consumer_* users in the configured "
+        "database and removes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=20, help="Concurrent sockets (rounded up to even).")
+        parser.add_argument('--frames', type=int, default=50, help="Frames sent per socket.")
+        parser.add_argument('--kind', choices=['chat', 'group', 'workspace', 'all'], default='all')
+
+    def handle(self, *args, **options):
+        clients = options['clients'] + options['clients'] % 2
+        kinds = ['chat', 'group', 'workspace'] if options['kind'] == 'all' else [options['kind']]
+        users = self._setup(clients)
+        try:
+            for kind in kinds:
+                started = time.perf_counter()
+                latencies = asyncio.run(getattr(self, f'_run_{kind}')(users, options['frames']))
+                wall = time.perf_counter() - started
+                latencies.sort()
+                self.stdout.write(
+                    f"{kind:<9} frames={len(latencies)} "
+                    f"p50={_pct(latencies, 0.5) * 1000:.2f}ms "
+                    f"p95={_pct(latencies, 0.95) * 1000:.2f}ms "
+                    f"p99={_pct(latencies, 0.99) * 1000:.2f}ms "
+                    f"throughput={len(latencies) / wall:.0f} frames/s"
+                )
+        finally:
+            # Workspace nodes go with their creators
+            User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+
+    def _setup(self, count):
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+        users = [User.objects.create(username=f'{BENCH_PREFIX}{i}') for i in range(count)]
+        for a, b in zip(users[::2], users[1::2]):
+            a.profile.contacts.add(b.profile)
+            b.profile.contacts.add(a.profile)
+        self.group = Group.objects.create(name=f'{BENCH_PREFIX}group', creator=users[0])
+        self.group.members.add(*users)
+        # Workspaces live on the pairs' direct room keys, like the real ones
+        self.nodes = [
+            WorkspaceNode.objects.create(
+                workspace_key=direct_room_key(a.id, b.id), name='main.py', node_type=WorkspaceNode.NodeType.FILE,
+                language='python', content='', created_by=a,
+            )
+            for a, b in zip(users[::2], users[1::2])
+        ]
+        return users
+
+    async def _connect(self, path, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        if not connected:
+            raise RuntimeError(f"Could not connect to {path}")
+        return communicator
+
+    async def _echo_loop(self, communicator, frames, latencies):
+        # Each frame is timed from send until the sender sees its own broadcast
+        for _ in range(frames):
+            token = uuid.uuid4().hex
+            started = time.perf_counter()
+            await communicator.send_json_to({'type': 'chat_message', 'message': token})
+            while True:
+                frame = await communicator.receive_json_from(timeout=60)
+                if frame.get('type') == 'chat_message' and frame.get('content') == token:
+                    break
+            latencies.append(time.perf_counter() - started)
+
+    async def _run_sockets(self, communicators, loops):
+        try:
+            await asyncio.gather(*loops)
+        finally:
+            for communicator in communicators:
+                await communicator.disconnect()
+
+    async def _run_chat(self, users, frames):
+        latencies = []
+        communicators = []
+        for a, b in zip(users[::2], users[1::2]):
+            communicators.append(await self._connect(f'/ws/chat/{b.id}/', a))
+            communicators.append(await self._connect(f'/ws/chat/{a.id}/', b))
+        await self._run_sockets(communicators, [self._echo_loop(c, frames, latencies) for c in communicators])
+        return latencies
+
+    async def _run_group(self, users, frames):
+        latencies = []
+        communicators = [await self._connect(f'/ws/group/{self.group.id}/', user) for user in users]
+        await self._run_sockets(communicators, [self._echo_loop(c, frames, latencies) for c in communicators])
+        return latencies
+
+    async def _run_workspace(self, users, frames):
+        # Pairs share a workspace: one socket edits, the other times the file_update it receives
+        latencies = []
+        communicators = []
+        loops = []
+        for node, (a, b) in zip(self.nodes, zip(users[::2], users[1::2])):
+            writer = await self._connect(f'/ws/workspace/{node.workspace_key}/', a)
+            watcher = await self._connect(f'/ws/workspace/{node.workspace_key}/', b)
+            await writer.receive_json_from(timeout=10)  # watcher's user_joined
+            communicators += [writer, watcher]
+            loops.append(self._edit_loop(writer, watcher, node.id, frames, latencies))
+        await self._run_sockets(communicators, loops)
+        return latencies
+
+    async def _edit_loop(self, writer, watcher, node_id, frames, latencies):
+        for position in range(frames):
+            started = time.perf_counter()
+            await writer.send_json_to({
+                'type': 'write_file',
+                'node_id': node_id,
+                'delta': {'type': 'insert', 'position': position, 'text': 'x'},
+                'cursor_position': position + 1,
+            })
+            while True:
+                frame = await watcher.receive_json_from(timeout=60)
+                if frame.get('type') == 'file_update':
+                    break
+            latencies.append(time.perf_counter() - started)
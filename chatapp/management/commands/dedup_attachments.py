@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chatapp.attachments import METADATA_FIELDS
+from chatapp.background import drain, submit_on_commit
+from chatapp.blobs import ATTACHMENT_MODELS, adopt_blob, count_references, dedup_report, delete_stored_files, variant_names
+from chatapp.conversations import touch_conversation, message_room_key
+from chatapp.models import StoredBlob
+from chatapp.rendering import store_body
+from chatapp.thumbnails import shared_thumbnails
+
+
+def _size(n):
+    return f"{n / (1024 * 1024):.1f} MB"
+
+
+class Command(BaseCommand):
+    help = (
+        "Move attachments stored before deduplication onto shared blobs, deleting the "
+        "duplicate copies, then report how many bytes sharing saves. Needs checksums "
+        "(run backfill_attachment_metadata first); safe to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--report-only', action='store_true', help="Only print the report.")
+        parser.add_argument('--recount', action='store_true', help="Recompute every blob's reference count from the messages.")
+
+    def handle(self, *args, **options):
+        if not options['report_only']:
+            for model in ATTACHMENT_MODELS:
+                self._adopt(model, options['batch_size'])
+        if options['recount']:
+            self._recount()
+        # Duplicate copies are deleted by the background pool
+        drain()
+
+        report = dedup_report()
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['references']} attachments share {report['blobs']} stored files: "
+            f"{_size(report['stored_bytes'])} stored for {_size(report['referenced_bytes'])} referenced, "
+            f"{_size(report['bytes_saved'])} saved"
+        ))
+
+    def _adopt(self, model, batch_size):
+        pending = model.objects.exclude(file='').exclude(file__isnull=True).filter(blob__isnull=True)
+        adopted = duplicates = unhashed = 0
+        last_id = 0
+        while True:
+            # Bodies are re-rendered below, so the content is loaded too
+            batch = list(pending.filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            for message in batch:
+                if not message.checksum or message.file_size is None:
+                    unhashed += 1
+                    continue
+                metadata = {field: getattr(message, field) for field in METADATA_FIELDS}
+                with transaction.atomic():
+                    blob = adopt_blob(message.file.name, metadata)
+                    thumbnails = message.thumbnails
+                    if blob.name != message.file.name:
+                        # Its file was a duplicate (and is going); so are its own variants
+                        duplicates += 1
+                        submit_on_commit(delete_stored_files, variant_names(thumbnails))
+                        thumbnails = shared_thumbnails(blob.id) or {}
+                    model.objects.filter(pk=message.pk).update(blob=blob, file=blob.name, thumbnails=thumbnails)
+                    # The stored body links the old file's variants
+                    message.blob, message.file, message.thumbnails = blob, blob.name, thumbnails
+                    store_body(message)
+                    touch_conversation(message_room_key(message))
+                adopted += 1
+        self.stdout.write(
+            f"{model.__name__}: {adopted} attachments moved to blobs, {duplicates} duplicate copies "
+            f"deleted, {unhashed} skipped without a checksum"
+        )
+
+    def _recount(self):
+        counts = count_references()
+        fixed = 0
+        for blob in StoredBlob.objects.only('id', 'ref_count').iterator():
+            if blob.ref_count != counts.get(blob.id, 0):
+                StoredBlob.objects.filter(pk=blob.id).update(ref_count=counts.get(blob.id, 0))
+                fixed += 1
+        self.stdout.write(f"Fixed {fixed} reference counts")
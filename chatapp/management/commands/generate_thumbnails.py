@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from chatapp.models import Message, GroupMessage, Profile
+from chatapp.thumbnails import needs_avatar_variants, thumbnail_attachment, thumbnail_avatar
+
+
+class Command(BaseCommand):
+    help = (
+        "Render missing thumbnails for image attachments and avatars (uploads from before "
+        "the background pipeline, or ones the worker missed). Runs in this process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['attachments', 'avatars', 'all'], default='all')
+        parser.add_argument('--limit', type=int, default=None, help="Stop after this many items per kind.")
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+        if options['kind'] in ('attachments', 'all'):
+            for model in (Message, GroupMessage):
+                pending = model.objects.filter(
+                    content_type__startswith='image/', thumbnails={}, is_deleted=False
+                ).exclude(file='').order_by('-id').values_list('id', flat=True)
+                ids = list(pending[:limit] if limit else pending)
+                for message_id in ids:
+                    thumbnail_attachment(model._meta.model_name, message_id)
+                self.stdout.write(f"{model.__name__}: processed {len(ids)} attachments")
+
+        if options['kind'] in ('avatars', 'all'):
+            done = 0
+            for profile in Profile.objects.only('id', 'profile_picture', 'thumbnails').iterator():
+                if limit and done >= limit:
+                    break
+                if needs_avatar_variants(profile):
+                    thumbnail_avatar(profile.id)
+                    done += 1
+            self.stdout.write(f"Profile: processed {done} avatars")
+        self.stdout.write(self.style.SUCCESS("Thumbnail backlog done"))
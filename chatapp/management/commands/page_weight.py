@@ -0,0 +1,99 @@
+import gzip
+import re
+
+import brotli
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import reverse
+
+from chatapp.models import Group
+
+WEIGHT_PREFIX = 'page_weight_'
+ASSET_RE = re.compile(r'<(?:link[^>]+href|script[^>]+src)="([^"]+)"')
+
+
+def _sizes(data):
+    return len(data), len(gzip.compress(data, 9)), len(brotli.compress(data))
+
+
+def _kb(n):
+    return f"{n / 1024:.1f}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Report what each page weighs: its HTML plus the local CSS/JS it references, "
+        "raw, gzip and brotli. A repeat visit only re-downloads the HTML, since the "
+        "fingerprinted assets are cached as immutable. Renders the pages as temporary "
+        "page_weight_* users in the configured database. Run collectstatic first to "
+        "measure the minified bundles."
+    )
+
+    def handle(self, *args, **options):
+        host = next((h for h in settings.ALLOWED_HOSTS if h and h != '*'), 'localhost')
+        User.objects.filter(username__startswith=WEIGHT_PREFIX).delete()
+        user = User.objects.create(username=f'{WEIGHT_PREFIX}user')
+        contact = User.objects.create(username=f'{WEIGHT_PREFIX}contact')
+        try:
+            user.profile.contacts.add(contact.profile)
+            contact.profile.contacts.add(user.profile)
+            group = Group.objects.create(name=f'{WEIGHT_PREFIX}group', creator=user)
+            group.members.add(user, contact)
+
+            anonymous = Client(HTTP_HOST=host)
+            signed_in = Client(HTTP_HOST=host)
+            signed_in.force_login(user)
+            pages = [
+                ('home', anonymous, reverse('chatapp:home')),
+                ('login', anonymous, reverse('chatapp:login')),
+                ('dashboard', signed_in, reverse('chatapp:dashboard')),
+                ('dashboard_chat', signed_in, reverse('chatapp:dashboard_chat', args=[contact.id])),
+                ('dashboard_group', signed_in, reverse('chatapp:dashboard_group_chat', args=[group.id])),
+                ('settings', signed_in, reverse('chatapp:settings')),
+            ]
+            self.stdout.write(
+                f"{'page':<16} {'html raw/gz/br KB':>20} {'assets':>6} {'assets raw/gz/br KB':>22} "
+                f"{'first visit br KB':>18} {'repeat visit br KB':>19}"
+            )
+            for label, client, url in pages:
+                self._report(label, client, url)
+        finally:
+            User.objects.filter(username__startswith=WEIGHT_PREFIX).delete()
+
+    def _report(self, label, client, url):
+        response = client.get(url)
+        if response.status_code != 200:
+            self.stderr.write(f"{label}: {url} returned {response.status_code}")
+            return
+        html = _sizes(response.content)
+        assets = [0, 0, 0]
+        count = 0
+        for src in ASSET_RE.findall(response.content.decode('utf-8')):
+            data = self._asset(src)
+            if data is None:
+                continue
+            count += 1
+            assets = [total + size for total, size in zip(assets, _sizes(data))]
+        self.stdout.write(
+            f"{label:<16} {'/'.join(map(_kb, html)):>20} {count:>6} {'/'.join(map(_kb, assets)):>22} "
+            f"{_kb(html[2] + assets[2]):>18} {_kb(html[2]):>19}"
+        )
+
+    def _asset(self, src):
+        """Bytes of a local static file referenced by the page (CDN assets are skipped)."""
+        prefix = '/' + settings.STATIC_URL.lstrip('/')
+        if not src.startswith(prefix):
+            return None
+        name = src[len(prefix):].split('?')[0]
+        if staticfiles_storage.exists(name):
+            with staticfiles_storage.open(name) as f:
+                return f.read()
+        found = finders.find(name)
+        if not found:
+            return None
+        with open(found, 'rb') as f:
+            return f.read()
@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from chatapp.background import drain
+from chatapp.blobs import ATTACHMENT_MODELS, detach_attachment
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove the attachments of deleted messages and, with a retention period, of all "
+        "old messages. A stored file is only deleted once no other message shares it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--deleted-days', type=int, default=settings.ATTACHMENT_PURGE_DELETED_DAYS,
+            help="Purge attachments of deleted messages sent more than this many days ago.",
+        )
+        parser.add_argument(
+            '--retention-days', type=int, default=settings.ATTACHMENT_RETENTION_DAYS,
+            help="Also purge attachments of every message older than this.",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Only count the attachments to purge.")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = Q(is_deleted=True, timestamp__lt=now - timedelta(days=options['deleted_days']))
+        if options['retention_days'] is not None:
+            expired |= Q(timestamp__lt=now - timedelta(days=options['retention_days']))
+
+        for model in ATTACHMENT_MODELS:
+            pending = model.objects.filter(expired).exclude(file='').exclude(file__isnull=True)
+            if options['dry_run']:
+                self.stdout.write(f"{model.__name__}: {pending.count()} attachments to purge")
+                continue
+            purged = freed = 0
+            for message in pending.defer('rendered_html').iterator():
+                with transaction.atomic():
+                    freed += detach_attachment(message)
+                purged += 1
+            self.stdout.write(f"{model.__name__}: purged {purged} attachments, freed {freed / (1024 * 1024):.1f} MB")
+        drain()
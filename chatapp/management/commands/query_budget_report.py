@@ -0,0 +1,72 @@
+import json
+import statistics
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Aggregate the QUERY_BUDGET_REPORT_PATH log (one JSON line per request/frame) "
+        "into per-label query, DB time and thread-hop summaries."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help="Report file (default: QUERY_BUDGET_REPORT_PATH).")
+        parser.add_argument('--json', dest='json_path', help="Also write the summary as JSON (for CI trend tracking).")
+        parser.add_argument('--fail-on-exceeded', action='store_true', help="Exit non-zero if any label went over budget.")
+
+    def handle(self, *args, **options):
+        path = options['path'] or getattr(settings, 'QUERY_BUDGET_REPORT_PATH', None)
+        if not path:
+            raise CommandError("No report path given and QUERY_BUDGET_REPORT_PATH is not set.")
+
+        rows = {}
+        try:
+            with open(path, encoding='utf-8') as report:
+                for line in report:
+                    if line.strip():
+                        record = json.loads(line)
+                        rows.setdefault(record['label'], []).append(record)
+        except FileNotFoundError:
+            raise CommandError(f"Report file not found: {path}")
+
+        summary = []
+        for label, records in sorted(rows.items()):
+            queries = [r['queries'] for r in records]
+            budget = records[-1].get('budget')
+            summary.append({
+                'label': label,
+                'count': len(records),
+                'queries_mean': round(statistics.mean(queries), 2),
+                'queries_p95': _pct(queries, 0.95),
+                'queries_max': max(queries),
+                'db_ms_p95': _pct([r['db_ms'] for r in records], 0.95),
+                'hops_mean': round(statistics.mean(r['hops'] for r in records), 2),
+                'budget': budget,
+                'exceeded': sum(1 for q in queries if budget is not None and q > budget),
+            })
+
+        self.stdout.write(
+            f"{'label':<48} {'count':>6} {'q mean':>7} {'q p95':>6} {'q max':>6} "
+            f"{'db p95':>8} {'hops':>5} {'budget':>6} {'over':>5}"
+        )
+        for row in summary:
+            self.stdout.write(
+                f"{row['label']:<48} {row['count']:>6} {row['queries_mean']:>7} {row['queries_p95']:>6} "
+                f"{row['queries_max']:>6} {row['db_ms_p95']:>7}ms {row['hops_mean']:>5} "
+                f"{row['budget'] if row['budget'] is not None else '-':>6} {row['exceeded']:>5}"
+            )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as out:
+                json.dump(summary, out, indent=2)
+
+        exceeded = [row['label'] for row in summary if row['exceeded']]
+        if exceeded and options['fail_on_exceeded']:
+            raise CommandError("Query budgets exceeded: " + ", ".join(exceeded))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from chatapp.rendering import MODELS, RENDER_VERSION, rerender_messages
+
+
+class Command(BaseCommand):
+    help = (
+        "Store current-version HTML bodies for messages rendered by an older renderer "
+        "(or before bodies were stored). Reads re-render stale pages in the background "
+        "anyway; run this after bumping RENDER_VERSION to do the whole history at once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model_name, model in MODELS.items():
+            total = 0
+            last_id = 0
+            while True:
+                ids = list(
+                    model.objects.filter(id__gt=last_id).exclude(render_version=RENDER_VERSION)
+                    .order_by('id').values_list('id', flat=True)[:batch_size]
+                )
+                if not ids:
+                    break
+                total += rerender_messages(model_name, ids)
+                last_id = ids[-1]
+            self.stdout.write(f"{model.__name__}: re-rendered {total} messages")
+        self.stdout.write(self.style.SUCCESS(f"Message bodies are at render version {RENDER_VERSION}"))
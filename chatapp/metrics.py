@@ -0,0 +1,44 @@
+# chatapp/metrics.py
+
+import threading
+from collections import defaultdict
+
+_counters = defaultdict(int)
+_gauges = {}
+_lock = threading.Lock()
+
+
+def incr(name, amount=1):
+    """Increment a process-local counter."""
+    with _lock:
+        _counters[name] += amount
+
+
+def get(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def ratio(numerator, *others):
+    """
+    Ratio of counter `numerator` to the sum of `numerator` and `others`,
+    e.g. ratio('cache.hits', 'cache.misses'). Returns 0.0 with no samples.
+    """
+    with _lock:
+        hits = _counters.get(numerator, 0)
+        total = hits + sum(_counters.get(name, 0) for name in others)
+    return hits / total if total else 0.0
+
+
+def register_gauge(name, func):
+    """Register a callable evaluated whenever a snapshot is taken."""
+    _gauges[name] = func
+
+
+def snapshot():
+    """Return all counters plus the current value of every gauge."""
+    with _lock:
+        data = dict(_counters)
+    for name, func in _gauges.items():
+        data[name] = func()
+    return data
@@ -0,0 +1,41 @@
+# chatapp/middleware.py
+
+from .db_routers import mark_write
+from .query_budget import track_queries
+
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class ReadYourWritesMiddleware:
+    """
+    Pins a user's reads to the primary database for a few seconds after
+    any request that may have written, so a redirect back to the dashboard
+    never shows replica-stale data.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        if request.method in UNSAFE_METHODS and user is not None and user.is_authenticated:
+            mark_write(user.id)
+        return response
+
+
+class QueryBudgetMiddleware:
+    """
+    Counts queries, DB time and thread hops per request, labelled
+    http:<url name>, and logs requests that exceed their query budget.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with track_queries('http:unresolved') as stats:
+            response = self.get_response(request)
+            if request.resolver_match is not None:
+                stats.label = f'http:{request.resolver_match.view_name}'
+        return response
@@ -0,0 +1,97 @@
+# Generated by Django 5.2.8 on 2026-10-19 12:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # Prefix (LIKE 'q%') lookups on the lowercased columns
+    "CREATE INDEX chatapp_userdir_username_prefix ON chatapp_userdirectoryentry (username text_pattern_ops)",
+    "CREATE INDEX chatapp_userdir_display_prefix ON chatapp_userdirectoryentry (display_name text_pattern_ops)",
+    "CREATE INDEX chatapp_userdir_email_prefix ON chatapp_userdirectoryentry (email text_pattern_ops)",
+    # Substring (LIKE '%q%') lookups anywhere in the three fields
+    "CREATE INDEX chatapp_userdir_search_trgm ON chatapp_userdirectoryentry USING gin (search_text gin_trgm_ops)",
+]
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS chatapp_userdir_search_trgm",
+    "DROP INDEX IF EXISTS chatapp_userdir_email_prefix",
+    "DROP INDEX IF EXISTS chatapp_userdir_display_prefix",
+    "DROP INDEX IF EXISTS chatapp_userdir_username_prefix",
+]
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE chatapp_userdirectory_fts USING fts5("
+    "search_text, content='chatapp_userdirectoryentry', content_rowid='user_id', prefix='2 3')",
+    "CREATE TRIGGER chatapp_userdirectory_ai AFTER INSERT ON chatapp_userdirectoryentry BEGIN "
+    "INSERT INTO chatapp_userdirectory_fts(rowid, search_text) VALUES (new.user_id, new.search_text); END",
+    "CREATE TRIGGER chatapp_userdirectory_ad AFTER DELETE ON chatapp_userdirectoryentry BEGIN "
+    "INSERT INTO chatapp_userdirectory_fts(chatapp_userdirectory_fts, rowid, search_text) "
+    "VALUES ('delete', old.user_id, old.search_text); END",
+    "CREATE TRIGGER chatapp_userdirectory_au AFTER UPDATE ON chatapp_userdirectoryentry BEGIN "
+    "INSERT INTO chatapp_userdirectory_fts(chatapp_userdirectory_fts, rowid, search_text) "
+    "VALUES ('delete', old.user_id, old.search_text); "
+    "INSERT INTO chatapp_userdirectory_fts(rowid, search_text) VALUES (new.user_id, new.search_text); END",
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS chatapp_userdirectory_au",
+    "DROP TRIGGER IF EXISTS chatapp_userdirectory_ad",
+    "DROP TRIGGER IF EXISTS chatapp_userdirectory_ai",
+    "DROP TABLE IF EXISTS chatapp_userdirectory_fts",
+]
+
+
+def _run_for_vendor(postgres, sqlite):
+    def run(apps, schema_editor):
+        statements = {'postgresql': postgres, 'sqlite': sqlite}.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+def backfill_directory(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    UserDirectoryEntry = apps.get_model('chatapp', 'UserDirectoryEntry')
+
+    entries = []
+    for user in User.objects.select_related('profile').iterator():
+        profile = getattr(user, 'profile', None)
+        username = user.username.lower()
+        display_name = ((profile.display_name if profile else None) or '').lower()
+        email = (user.email or '').lower()
+        entries.append(UserDirectoryEntry(
+            user_id=user.id,
+            username=username,
+            display_name=display_name,
+            email=email,
+            search_text=' '.join(part for part in (username, display_name, email) if part),
+        ))
+    UserDirectoryEntry.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0010_conversationsummary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDirectoryEntry',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='directory_entry', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('username', models.CharField(max_length=150)),
+                ('display_name', models.CharField(blank=True, max_length=50)),
+                ('email', models.CharField(blank=True, max_length=254)),
+                ('search_text', models.TextField(blank=True)),
+            ],
+        ),
+        # Indexes first so the SQLite triggers also index the backfilled rows
+        migrations.RunPython(
+            _run_for_vendor(POSTGRES_FORWARD, SQLITE_FORWARD),
+            reverse_code=_run_for_vendor(POSTGRES_REVERSE, SQLITE_REVERSE),
+        ),
+        migrations.RunPython(backfill_directory, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-19 12:00
+
+import uuid
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0012_attachment_metadata'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('chat_type', models.CharField(max_length=10)),
+                ('chat_id', models.PositiveIntegerField()),
+                ('file_name', models.CharField(max_length=255)),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('caption', models.TextField(blank=True)),
+                ('total_size', models.PositiveBigIntegerField()),
+                ('storage_name', models.CharField(max_length=512)),
+                ('mode', models.CharField(choices=[('multipart', 'Direct multipart'), ('chunked', 'Chunked')], max_length=12)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('aborted', 'Aborted')], db_index=True, default='pending', max_length=12)),
+                ('multipart_upload_id', models.CharField(blank=True, max_length=255)),
+                ('part_size', models.PositiveBigIntegerField(default=0)),
+                ('received_bytes', models.PositiveBigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.8 on 2026-10-19 12:00
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+from django.utils.text import Truncator
+import django.db.models.deletion
+
+PREVIEW_LENGTH = 80
+
+
+def _preview(message):
+    # Same text as chatapp.activity.preview_text
+    text = re.sub(r'\s+', ' ', message.content or '').strip()
+    if message.file and not message.is_deleted:
+        text = f"\U0001F4CE {text or message.file_name or 'Attachment'}"
+    return Truncator(text).chars(PREVIEW_LENGTH)
+
+
+def backfill_activity(apps, schema_editor):
+    Message = apps.get_model('chatapp', 'Message')
+    GroupMessage = apps.get_model('chatapp', 'GroupMessage')
+    ConversationActivity = apps.get_model('chatapp', 'ConversationActivity')
+
+    latest = {}
+    for row in Message.objects.values('sender_id', 'receiver_id').annotate(last=Max('id')).order_by():
+        low, high = sorted([row['sender_id'], row['receiver_id']])
+        key = f'chat_{low}_{high}'
+        latest[key] = max(latest.get(key, 0), row['last'])
+    group_latest = {
+        f"group_{row['group_id']}": row['last']
+        for row in GroupMessage.objects.values('group_id').annotate(last=Max('id')).order_by()
+    }
+
+    rows = []
+    for model, pointers in ((Message, latest), (GroupMessage, group_latest)):
+        messages = model.objects.in_bulk(list(pointers.values()))
+        for key, message_id in pointers.items():
+            message = messages[message_id]
+            rows.append(ConversationActivity(
+                room_key=key,
+                last_message_id=message.id,
+                last_sender_id=message.sender_id,
+                preview=_preview(message),
+                last_message_at=message.timestamp,
+            ))
+    ConversationActivity.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0016_rendered_html'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room_key', models.CharField(max_length=64, unique=True)),
+                ('last_message_id', models.BigIntegerField(default=0)),
+                ('preview', models.CharField(blank=True, max_length=120)),
+                ('last_message_at', models.DateTimeField()),
+                ('last_sender', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(backfill_activity, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0017_conversationactivity'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadsession',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('completing', 'Completing'), ('completed', 'Completed'), ('aborted', 'Aborted')], db_index=True, default='pending', max_length=12),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-19 12:00
+
+from django.db import migrations
+
+# The triggers from 0011 keep feeding the table by name, so only the table
+# itself is rebuilt. Trigram tokens make MATCH a substring search ("lic"
+# finds alice) instead of a word-prefix one; needs SQLite 3.34+.
+SQLITE_FORWARD = [
+    "DROP TABLE chatapp_userdirectory_fts",
+    "CREATE VIRTUAL TABLE chatapp_userdirectory_fts USING fts5("
+    "search_text, content='chatapp_userdirectoryentry', content_rowid='user_id', tokenize='trigram')",
+    "INSERT INTO chatapp_userdirectory_fts(chatapp_userdirectory_fts) VALUES ('rebuild')",
+]
+SQLITE_REVERSE = [
+    "DROP TABLE chatapp_userdirectory_fts",
+    "CREATE VIRTUAL TABLE chatapp_userdirectory_fts USING fts5("
+    "search_text, content='chatapp_userdirectoryentry', content_rowid='user_id', prefix='2 3')",
+    "INSERT INTO chatapp_userdirectory_fts(chatapp_userdirectory_fts) VALUES ('rebuild')",
+]
+
+
+def _run_on_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'sqlite':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0018_uploadsession_completing'),
+    ]
+
+    operations = [
+        migrations.RunPython(_run_on_sqlite(SQLITE_FORWARD), reverse_code=_run_on_sqlite(SQLITE_REVERSE)),
+    ]
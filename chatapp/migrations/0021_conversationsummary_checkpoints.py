@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+def carry_stale(apps, schema_editor):
+    # Which message was deleted is not known: 0 rebuilds without a checkpoint
+    ConversationSummary = apps.get_model('chatapp', 'ConversationSummary')
+    ConversationSummary.objects.filter(stale=True).update(stale_from=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0020_conversationsummary_stale'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationsummary',
+            name='stale_from',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversationsummary',
+            name='checkpoints',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(carry_stale, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='conversationsummary',
+            name='stale',
+        ),
+    ]
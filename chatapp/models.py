@@ -1,4 +1,6 @@
 # chatapp/models.py
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
@@ -12,6 +14,8 @@ class Profile(models.Model):
     display_name = models.CharField(max_length=50, blank=True, null=True)
     about_me = models.TextField(max_length=200, blank=True)
     profile_picture = models.ImageField(default='profile_pics/default.jpg', upload_to='profile_pics')
+    # Avatar variants plus the 'source' picture they were made from
+    thumbnails = models.JSONField(default=dict, blank=True)
 
     def __str__(self):
         return self.user.username
@@ -34,6 +38,19 @@ class Message(models.Model):
     content = models.TextField(blank=True)
     file = models.FileField(upload_to='chat_attachments/', blank=True, null=True)
     file_name = models.CharField(max_length=255, blank=True)
+    # Captured at upload (chatapp/attachments.py) so rendering never touches storage
+    file_size = models.PositiveBigIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    checksum = models.CharField(max_length=64, blank=True)
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    # {label: {name, width, height}} of resized variants (chatapp/thumbnails.py)
+    thumbnails = models.JSONField(default=dict, blank=True)
+    # The deduplicated stored file `file` points at (chatapp/blobs.py)
+    blob = models.ForeignKey('StoredBlob', related_name='+', null=True, blank=True, on_delete=models.PROTECT)
+    # Safe HTML of the body, rendered on write by chatapp/rendering.py
+    rendered_html = models.TextField(blank=True)
+    render_version = models.PositiveSmallIntegerField(default=0)
     timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
     is_deleted = models.BooleanField(default=False, db_index=True)
 
@@ -81,6 +98,19 @@ class GroupMessage(models.Model):
     content = models.TextField(blank=True)
     file = models.FileField(upload_to='chat_attachments/', blank=True, null=True)
     file_name = models.CharField(max_length=255, blank=True)
+    # Captured at upload (chatapp/attachments.py) so rendering never touches storage
+    file_size = models.PositiveBigIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    checksum = models.CharField(max_length=64, blank=True)
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    # {label: {name, width, height}} of resized variants (chatapp/thumbnails.py)
+    thumbnails = models.JSONField(default=dict, blank=True)
+    # The deduplicated stored file `file` points at (chatapp/blobs.py)
+    blob = models.ForeignKey('StoredBlob', related_name='+', null=True, blank=True, on_delete=models.PROTECT)
+    # Safe HTML of the body, rendered on write by chatapp/rendering.py
+    rendered_html = models.TextField(blank=True)
+    render_version = models.PositiveSmallIntegerField(default=0)
     timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
     is_deleted = models.BooleanField(default=False, db_index=True)
 
@@ -142,4 +172,114 @@ class WorkspaceNode(models.Model):
         while parent:
             parts.append(parent.name)
             parent = parent.parent
-        return "/".join(reversed(parts))
\ No newline at end of file
+        return "/".join(reversed(parts))
+
+class ConversationSummary(models.Model):
+    """
+    Rolling summary of a conversation for the Collab-X bot.
+    Covers every message up to and including last_message_id; newer
+    messages are folded in incrementally. `stale_from` is the oldest
+    since-deleted message the summary still includes, until it is rebuilt
+    from the newest of `checkpoints` ([last_message_id, summary] after
+    recent folds) before it.
+    """
+    room_key = models.CharField(max_length=64, unique=True)
+    summary = models.TextField(blank=True)
+    last_message_id = models.BigIntegerField(default=0)
+    stale_from = models.BigIntegerField(null=True, blank=True)
+    checkpoints = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.room_key} (up to #{self.last_message_id})'
+
+
+class ConversationActivity(models.Model):
+    """
+    Pointer to the newest message of a conversation, with the preview the
+    dashboard sidebar shows. Kept current on every message write (see
+    chatapp/activity.py), so the sidebar reads all its chats in one query.
+    """
+    room_key = models.CharField(max_length=64, unique=True)
+    last_message_id = models.BigIntegerField(default=0)
+    last_sender = models.ForeignKey(User, related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    preview = models.CharField(max_length=120, blank=True)
+    last_message_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.room_key} (#{self.last_message_id})'
+
+
+class UserDirectoryEntry(models.Model):
+    """
+    Search copy of a user's username, display name and email, lowercased.
+    Kept in sync from Profile saves (see chatapp/user_directory.py); the
+    migration adds the vendor-specific indexes (pg_trgm on Postgres, an
+    FTS5 table on SQLite).
+    """
+    user = models.OneToOneField(User, related_name='directory_entry', on_delete=models.CASCADE, primary_key=True)
+    username = models.CharField(max_length=150)
+    display_name = models.CharField(max_length=50, blank=True)
+    email = models.CharField(max_length=254, blank=True)
+    search_text = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.username
+
+
+class UploadSession(models.Model):
+    """
+    An attachment upload in progress (see chatapp/uploads.py). Either a
+    multipart upload the browser sends straight to the bucket, or a
+    resumable chunked upload into local storage. The chat message is only
+    created once the upload completes.
+    """
+    class Mode(models.TextChoices):
+        MULTIPART = 'multipart', 'Direct multipart'
+        CHUNKED = 'chunked', 'Chunked'
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        # Claimed by the request finishing it (storing, hashing, posting)
+        COMPLETING = 'completing', 'Completing'
+        COMPLETED = 'completed', 'Completed'
+        ABORTED = 'aborted', 'Aborted'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, related_name='upload_sessions', on_delete=models.CASCADE)
+    chat_type = models.CharField(max_length=10)
+    chat_id = models.PositiveIntegerField()
+    file_name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    caption = models.TextField(blank=True)
+    total_size = models.PositiveBigIntegerField()
+    storage_name = models.CharField(max_length=512)
+    mode = models.CharField(max_length=12, choices=Mode.choices)
+    status = models.CharField(max_length=12, choices=Status.choices, default=Status.PENDING, db_index=True)
+    multipart_upload_id = models.CharField(max_length=255, blank=True)
+    part_size = models.PositiveBigIntegerField(default=0)
+    received_bytes = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.file_name} ({self.mode}, {self.status})'
+
+
+class StoredBlob(models.Model):
+    """
+    One stored attachment file, shared by every message whose upload had
+    the same content (see chatapp/blobs.py). ref_count is the number of
+    messages pointing at it; the file is deleted when it drops to zero.
+    Direct multipart uploads are never hashed, so their checksum is NULL
+    and they are never shared.
+    """
+    checksum = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    size = models.PositiveBigIntegerField()
+    name = models.CharField(max_length=512, unique=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.ref_count} refs)'
@@ -0,0 +1,186 @@
+# chatapp/query_budget.py
+
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import SyncToAsync
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Stats of the HTTP request / WebSocket frame being handled. The object is
+# mutable, so queries made in sync_to_async threads (which run in a copy of
+# the context) still add to it.
+_current = ContextVar('query_stats', default=None)
+
+_listeners = []
+_report_lock = threading.Lock()
+
+FRAME_TYPE_RE = re.compile(r'"type"\s*:\s*"(\w+)"')
+
+
+class QueryStats:
+    __slots__ = ('label', 'queries', 'db_time', 'hops', 'started', 'elapsed', 'closed', '_last_hop')
+
+    def __init__(self, label):
+        self.label = label
+        self.queries = 0
+        self.db_time = 0.0
+        self.hops = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.closed = False
+        self._last_hop = None
+
+    def as_dict(self):
+        return {
+            'label': self.label,
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 3),
+            'hops': self.hops,
+            'elapsed_ms': round(self.elapsed * 1000, 3),
+            'budget': budget_for(self.label),
+        }
+
+
+def _count_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None or stats.closed:
+        return execute(sql, params, many, context)
+    # Approximate thread hops: asgiref gives every sync_to_async call its own
+    # task_context list, so a new list on this thread means a new hop.
+    hop = getattr(SyncToAsync.threadlocal, 'task_context', None)
+    if hop is not None and hop is not stats._last_hop:
+        stats._last_hop = hop
+        stats.hops += 1
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+def _install(connection):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    _install(connection)
+
+
+for _connection in connections.all(initialized_only=True):
+    _install(_connection)
+
+
+def budget_for(label):
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    if label in budgets:
+        return budgets[label]
+    if label.startswith('ws:'):
+        return getattr(settings, 'QUERY_BUDGET_DEFAULT_FRAME', 5)
+    return getattr(settings, 'QUERY_BUDGET_DEFAULT_HTTP', 30)
+
+
+def _finish(stats):
+    stats.closed = True
+    stats.elapsed = time.perf_counter() - stats.started
+    budget = budget_for(stats.label)
+    if budget is not None and stats.queries > budget:
+        metrics.incr('query_budget.exceeded')
+        logger.warning(
+            "Query budget exceeded for %s: %d queries (budget %d), %.1f ms in DB, %d thread hops",
+            stats.label, stats.queries, budget, stats.db_time * 1000, stats.hops,
+        )
+    for records in _listeners:
+        records.append(stats)
+    report_path = getattr(settings, 'QUERY_BUDGET_REPORT_PATH', None)
+    if report_path:
+        line = json.dumps(stats.as_dict())
+        with _report_lock, open(report_path, 'a', encoding='utf-8') as report:
+            report.write(line + '\n')
+
+
+@contextmanager
+def track_queries(label):
+    """
+    Count queries, DB time and thread hops for the enclosed request/frame.
+    `label` may be reassigned on the yielded stats before the block ends.
+    """
+    if not getattr(settings, 'QUERY_BUDGET_ENABLED', True):
+        yield QueryStats(label)
+        return
+    stats = QueryStats(label)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        _finish(stats)
+
+
+class QueryBudgetMixin:
+    """
+    Consumer mixin: tracks every incoming frame as ws:<Consumer>:<type>
+    (and the handshake as ws:<Consumer>:connect).
+    """
+    default_frame_type = 'unknown'
+
+    async def websocket_connect(self, message):
+        with track_queries(f'ws:{type(self).__name__}:connect'):
+            await super().websocket_connect(message)
+
+    async def websocket_receive(self, message):
+        text = message.get('text') or ''
+        match = FRAME_TYPE_RE.search(text[:512])
+        frame_type = match.group(1) if match else self.default_frame_type
+        with track_queries(f'ws:{type(self).__name__}:{frame_type}'):
+            await super().websocket_receive(message)
+
+
+@contextmanager
+def capture_query_stats():
+    """Collect the QueryStats of every request/frame finished inside the block (any task)."""
+    records = []
+    _listeners.append(records)
+    try:
+        yield records
+    finally:
+        _listeners.remove(records)
+
+
+def assert_within_budgets(records):
+    """Test helper: fail if any captured request/frame went over its budget."""
+    over = [
+        f"{stats.label}: {stats.queries} queries (budget {budget_for(stats.label)})"
+        for stats in records
+        if budget_for(stats.label) is not None and stats.queries > budget_for(stats.label)
+    ]
+    if over:
+        raise AssertionError("Query budgets exceeded:\n" + "\n".join(over))
+
+
+@contextmanager
+def assert_max_queries(limit, label='block'):
+    """Test helper: fail if the enclosed (same-context) code runs more than `limit` queries."""
+    stats = QueryStats(label)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        stats.closed = True
+    if stats.queries > limit:
+        raise AssertionError(f"{label}: {stats.queries} queries, expected at most {limit}")
@@ -0,0 +1,109 @@
+# chatapp/rendering.py
+
+from django.db.models.signals import pre_save, post_save
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.safestring import mark_safe
+
+from . import metrics
+from .background import submit
+from .models import Message, GroupMessage
+
+# Bump whenever message_body.html or render_body changes: stored bodies of
+# an older version are re-rendered in the background as they are read
+# (and all at once by `manage.py rerender_messages`).
+RENDER_VERSION = 1
+
+MODELS = {'message': Message, 'groupmessage': GroupMessage}
+
+
+def attachment_path(message):
+    """Stable link to a message's attachment; attachment_view signs it on request."""
+    chat_type = 'group' if isinstance(message, GroupMessage) else '1on1'
+    return reverse('chatapp:attachment', args=[chat_type, message.pk])
+
+
+def render_body(message):
+    """
+    Safe HTML of a message body: text, image preview and attachment card.
+    Storage URLs expire, so attachments link to attachment_view instead.
+    Needs message.pk when there is an attachment.
+    """
+    preview = (message.thumbnails or {}).get('md')
+    return render_to_string('chatapp/partials/message_body.html', {
+        'message': message,
+        'attachment_url': attachment_path(message) if message.file else '',
+        'preview': preview if isinstance(preview, dict) else None,
+    }).strip()
+
+
+def body_html(message):
+    """The stored body if it is current, else a fresh render (not stored)."""
+    if message.render_version == RENDER_VERSION:
+        return mark_safe(message.rendered_html)
+    return mark_safe(render_body(message))
+
+
+def prepare_bodies(messages):
+    """
+    Set `body_html` on a page of messages. Bodies from an older renderer are
+    rendered in place and handed to one background task to be stored.
+    """
+    stale = {}
+    for message in messages:
+        message.body_html = body_html(message)
+        if message.render_version != RENDER_VERSION:
+            stale.setdefault(message._meta.model_name, []).append(message.pk)
+    for model_name, ids in stale.items():
+        metrics.incr('rendering.stale_reads', len(ids))
+        submit(rerender_messages, model_name, ids)
+    return messages
+
+
+def store_body(message):
+    """Re-render and store the body after fields were changed with update()."""
+    html = render_body(message)
+    type(message).objects.filter(pk=message.pk, is_deleted=message.is_deleted).update(
+        rendered_html=html, render_version=RENDER_VERSION
+    )
+    return html
+
+
+def deleted_body():
+    return render_body(Message(is_deleted=True))
+
+
+def rerender_messages(model_name, ids):
+    """Background task: store current-version bodies for the given messages."""
+    model = MODELS[model_name]
+    done = 0
+    for message in model.objects.filter(pk__in=ids).exclude(render_version=RENDER_VERSION):
+        # Only if nothing re-rendered the message since it was read
+        done += model.objects.filter(pk=message.pk, render_version=message.render_version).update(
+            rendered_html=render_body(message), render_version=RENDER_VERSION
+        )
+    metrics.incr('rendering.rerendered', done)
+    return done
+
+
+# Text-only messages are rendered before the INSERT; attachment links need
+# the id, so those are rendered right after it.
+@receiver(pre_save, sender=Message)
+@receiver(pre_save, sender=GroupMessage)
+def render_on_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None or (instance.file and instance.pk is None):
+        return
+    instance.rendered_html = render_body(instance)
+    instance.render_version = RENDER_VERSION
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=GroupMessage)
+def render_after_insert(sender, instance, created, **kwargs):
+    if created and instance.render_version != RENDER_VERSION:
+        instance.rendered_html = render_body(instance)
+        instance.render_version = RENDER_VERSION
+        sender.objects.filter(pk=instance.pk).update(
+            rendered_html=instance.rendered_html, render_version=RENDER_VERSION
+        )
@@ -0,0 +1,180 @@
+# chatapp/room_access.py
+
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
+
+from . import metrics
+from .models import Profile, Group
+from .rooms import direct_room_key, group_room_key, parse_room_key
+
+REVOKED_CLOSE_CODE = 4403
+
+
+def _access_key(user_id, room_key):
+    return f'room_access:{room_key}:{user_id}'
+
+
+def _compute_access(user_id, room_key):
+    kind, ids = parse_room_key(room_key)
+    if kind == 'direct':
+        if user_id not in ids:
+            return False
+        other_id = ids[1] if ids[0] == user_id else ids[0]
+        return Profile.contacts.through.objects.filter(
+            from_profile__user_id=user_id, to_profile__user_id=other_id
+        ).exists()
+    if kind == 'group':
+        return Group.members.through.objects.filter(group_id=ids[0], user_id=user_id).exists()
+    return False
+
+
+def _cached_access(user_id, room_key):
+    allowed = cache.get(_access_key(user_id, room_key))
+    if allowed is not None:
+        metrics.incr('room_access.hits')
+    return allowed
+
+
+def can_access(user_id, room_key):
+    """
+    Can `user_id` use the chat (and workspace) `room_key`? Answers come from
+    the shared cache and are kept current by the m2m signals below.
+    """
+    allowed = _cached_access(user_id, room_key)
+    if allowed is None:
+        metrics.incr('room_access.misses')
+        allowed = _compute_access(user_id, room_key)
+        cache.set(_access_key(user_id, room_key), allowed, getattr(settings, 'ROOM_ACCESS_CACHE_SECONDS', 300))
+    return allowed
+
+
+# Access granted to a socket of this process in the last
+# ROOM_ACCESS_LOCAL_SECONDS: (user_id, room_key) -> monotonic expiry. A page
+# opens its chat and workspace sockets together, so the second check is
+# served here. Only grants are kept, and only briefly: a revoke in another
+# process reaches this one at most that late.
+_local_grants = OrderedDict()
+_local_grants_lock = threading.Lock()
+LOCAL_GRANTS_MAX = 4096
+
+
+def _local_grant(user_id, room_key):
+    with _local_grants_lock:
+        expires = _local_grants.get((user_id, room_key))
+        if expires is None:
+            return False
+        if expires <= time.monotonic():
+            del _local_grants[(user_id, room_key)]
+            return False
+        return True
+
+
+def _remember_grant(user_id, room_key):
+    seconds = getattr(settings, 'ROOM_ACCESS_LOCAL_SECONDS', 2)
+    if seconds <= 0:
+        return
+    with _local_grants_lock:
+        _local_grants[(user_id, room_key)] = time.monotonic() + seconds
+        _local_grants.move_to_end((user_id, room_key))
+        while len(_local_grants) > LOCAL_GRANTS_MAX:
+            _local_grants.popitem(last=False)
+
+
+async def acan_access(user_id, room_key):
+    """
+    Async can_access. A recent grant of this process answers on the event
+    loop; otherwise can_access() runs in one thread hop, shared cache
+    lookup and (on a miss) query together. Django's async cache API would
+    be a thread hop of its own.
+    """
+    if _local_grant(user_id, room_key):
+        metrics.incr('room_access.local_hits')
+        return True
+    allowed = await database_sync_to_async(can_access)(user_id, room_key)
+    if allowed:
+        _remember_grant(user_id, room_key)
+    return allowed
+
+
+def _forget(pairs):
+    pairs = list(pairs)
+    with _local_grants_lock:
+        for pair in pairs:
+            _local_grants.pop(pair, None)
+    cache.delete_many([_access_key(user_id, room_key) for user_id, room_key in pairs])
+
+
+def _revoke(room_key, user_ids=None):
+    """Close the room's chat and workspace sockets of `user_ids` (all if None) after commit."""
+    def send():
+        channel_layer = get_channel_layer()
+        event = {'type': 'access_revoked', 'user_ids': user_ids}
+        for group_name in (room_key, f'workspace_{room_key}'):
+            async_to_sync(channel_layer.group_send)(group_name, dict(event))
+    transaction.on_commit(send)
+
+
+@receiver(m2m_changed, sender=Profile.contacts.through)
+def contacts_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # pk_set is None on clear; remember who is about to go
+        related = instance.contact_of if reverse else instance.contacts
+        instance._cleared_contact_user_ids = list(related.values_list('user_id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action == 'post_clear':
+        other_user_ids = getattr(instance, '_cleared_contact_user_ids', [])
+    else:
+        other_user_ids = list(Profile.objects.filter(id__in=pk_set).values_list('user_id', flat=True))
+
+    # Access to a direct room belongs to the owner of the contact list
+    if reverse:
+        pairs = [(owner_id, instance.user_id) for owner_id in other_user_ids]
+    else:
+        pairs = [(instance.user_id, other_id) for other_id in other_user_ids]
+    rooms = [(owner_id, direct_room_key(owner_id, other_id)) for owner_id, other_id in pairs]
+    _forget(rooms)
+    if action != 'post_add':
+        for owner_id, room_key in rooms:
+            _revoke(room_key, [owner_id])
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        related = instance.chat_groups if reverse else instance.members
+        instance._cleared_member_ids = list(related.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    ids = getattr(instance, '_cleared_member_ids', []) if action == 'post_clear' else list(pk_set)
+
+    # Forward: instance is the Group and ids are users; reverse: the other way round
+    if reverse:
+        pairs = [(instance.id, group_room_key(group_id)) for group_id in ids]
+    else:
+        pairs = [(user_id, group_room_key(instance.id)) for user_id in ids]
+    _forget(pairs)
+    if action != 'post_add':
+        for user_id, room_key in pairs:
+            _revoke(room_key, [user_id])
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    # The membership rows go away with the group without m2m_changed
+    room_key = group_room_key(instance.id)
+    _forget((user_id, room_key) for user_id in instance.members.values_list('id', flat=True))
+    _revoke(room_key)
+
@@ -0,0 +1,27 @@
+# chatapp/rooms.py
+
+def direct_room_key(user_a_id, user_b_id):
+    """Room key shared by a 1-to-1 chat, its channel group and its workspace."""
+    ordered = sorted([int(user_a_id), int(user_b_id)])
+    return f"chat_{ordered[0]}_{ordered[1]}"
+
+
+def group_room_key(group_id):
+    return f"group_{group_id}"
+
+
+def parse_room_key(room_key):
+    """
+    ('direct', (user_a_id, user_b_id)) or ('group', (group_id,)) for a room
+    key, or (None, ()) if it is not one.
+    """
+    kind, _, rest = (room_key or '').partition('_')
+    try:
+        ids = tuple(int(part) for part in rest.split('_'))
+    except ValueError:
+        return None, ()
+    if kind == 'chat' and len(ids) == 2:
+        return 'direct', ids
+    if kind == 'group' and len(ids) == 1:
+        return 'group', ids
+    return None, ()
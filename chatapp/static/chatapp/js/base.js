@@ -0,0 +1,29 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const profilePicModal = document.getElementById('profilePicModal');
+    const modalImage = document.getElementById('modalProfilePicImage');
+
+    document.body.addEventListener('click', function(event) {
+        const clickableImage = event.target.closest('.profile-pic-clickable');
+
+        if (clickableImage) {
+            event.preventDefault();
+            const img = clickableImage.querySelector('img');
+            if (img && img.src) {
+                modalImage.src = img.src;
+                const bsModal = new bootstrap.Modal(profilePicModal);
+                bsModal.show();
+            }
+        }
+    });
+
+    // Add smooth scroll behavior
+    document.querySelectorAll('a[href^="#"]').forEach(anchor => {
+        anchor.addEventListener('click', function (e) {
+            const target = document.querySelector(this.getAttribute('href'));
+            if (target) {
+                e.preventDefault();
+                target.scrollIntoView({ behavior: 'smooth', block: 'start' });
+            }
+        });
+    });
+});
@@ -20,6 +20,8 @@
     document.addEventListener('DOMContentLoaded', () => {
         setupSidebarNavigation();
         setupSearchFilter();
+        applySidebarActivity();
+        setupCodePanel();
         initializeDashboard();
     });
 
@@ -33,6 +35,7 @@
 
         state.chatContainer = chatContainer;
         state.botAvatar = chatContainer.dataset.botAvatar || '';
+        window.currentUserId = Number(chatContainer.dataset.currentUserId) || null;
 
         const elements = gatherElements(chatContainer);
 
@@ -65,6 +68,7 @@
             workspaceKey: container.dataset.workspaceKey || '',
             currentUsername: container.dataset.currentUsername || '',
             uploadUrl: document.getElementById('chat-form')?.dataset.uploadUrl || '',
+            uploadStartUrl: document.getElementById('chat-form')?.dataset.uploadStartUrl || '',
             workspacePanel: document.getElementById('workspacePanel'),
             workspaceTree: document.getElementById('workspace-file-tree'),
             workspaceNewFileBtn: document.getElementById('workspace-new-file-btn'),
@@ -110,63 +114,192 @@
         if (!sidebar) return;
 
         sidebar.addEventListener('click', (event) => {
-            const link = event.target.closest('.contact-item[data-dynamic="true"]');
+            const link = event.target.closest('.contact-item[data-conversation-url]');
             if (!link) return;
+            // Coming from the welcome screen there is no chat form or
+            // workspace tree to fill in yet: take the full page once
+            if (!document.getElementById('chat-messages')) return;
 
             event.preventDefault();
-            const url = link.getAttribute('href');
-            if (!url) return;
-
             sidebar.querySelectorAll('.contact-item.active').forEach(item => item.classList.remove('active'));
             link.classList.add('active');
 
-            loadConversation(url);
+            loadConversation(link);
         });
+
+        window.addEventListener('popstate', () => window.location.reload());
     }
 
-    function loadConversation(url) {
+    function loadConversation(link) {
         cleanupRealtime();
         const indicator = document.getElementById('chatLoadingIndicator');
         showChatLoading(indicator, true);
 
-        fetch(url, {
-            headers: { 'X-Requested-With': 'XMLHttpRequest' }
+        // Revalidated with If-None-Match: an unchanged chat comes back as a
+        // 304 and the browser hands us its cached copy
+        fetchJson(link.dataset.conversationUrl, {
+            headers: { 'X-Requested-With': 'XMLHttpRequest' },
+            cache: 'no-cache'
         })
-            .then(response => {
-                if (!response.ok) {
-                    throw new Error('Failed to load conversation');
-                }
-                return response.json();
-            })
             .then(data => {
-                replaceSection('chatArea', data.chat_html);
-                replaceSection('workspacePanel', data.workspace_html);
-
-                const container = document.querySelector('.chat-container');
-                if (container) {
-                    container.dataset.chatType = data.chat_type || '';
-                    container.dataset.chatId = data.chat_id || '';
-                    container.dataset.workspaceKey = data.workspace_key || '';
+                renderConversation(data, link.dataset.conversationUrl);
+                if (window.location.pathname !== new URL(link.href, window.location.href).pathname) {
+                    history.pushState({}, '', link.href);
                 }
-
                 initializeDashboard();
             })
             .catch(error => {
                 console.error(error);
-                window.location.href = url;
+                window.location.href = link.href;
             })
             .finally(() => showChatLoading(indicator, false));
     }
 
-    function replaceSection(id, html) {
-        if (!html) return;
-        const target = document.getElementById(id);
-        if (!target) return;
-        const template = document.createElement('template');
-        template.innerHTML = html.trim();
-        const content = template.content.firstElementChild;
-        if (content) {
-            target.replaceWith(content);
+    // Swaps in a copy of the node: listeners bound by initializeDashboard go with the old one
+    function freshNode(node, deep = true) {
+        if (!node) return null;
+        const copy = node.cloneNode(deep);
+        node.replaceWith(copy);
+        return copy;
+    }
+
+    function renderConversation(data, conversationUrl) {
+        const container = document.querySelector('.chat-container');
+        container.dataset.chatType = data.chat_type || '';
+        container.dataset.chatId = data.chat_id || '';
+        container.dataset.workspaceKey = data.workspace_key || '';
+
+        renderChatHeader(data.header);
+
+        const chatMessages = freshNode(document.getElementById('chat-messages'), false);
+        chatMessages.dataset.conversationUrl = conversationUrl;
+        chatMessages.dataset.before = data.before || '';
+        chatMessages.appendChild(buildHistory(data, data.messages));
+
+        freshNode(document.querySelector('#chatArea .chat-input'));
+        const chatForm = document.getElementById('chat-form');
+        chatForm.dataset.uploadUrl = data.upload_url || '';
+        chatForm.dataset.uploadStartUrl = data.upload_start_url || '';
+
+        const workspacePanel = freshNode(document.getElementById('workspacePanel'));
+        const tree = workspacePanel?.querySelector('#workspace-file-tree');
+        if (tree) tree.innerHTML = '';
+    }
+
+    function renderChatHeader(header) {
+        const chatHeader = document.querySelector('#chatArea .chat-header');
+        if (!chatHeader || !header) return;
+        chatHeader.innerHTML = '';
+
+        const info = document.createElement('div');
+        info.className = 'chat-header-info';
+        if (header.avatar_url !== undefined) {
+            const link = document.createElement('a');
+            link.href = '#';
+            link.className = 'profile-pic-clickable';
+            const img = document.createElement('img');
+            img.src = header.avatar_url;
+            img.alt = header.title;
+            link.appendChild(img);
+            info.appendChild(link);
+        } else {
+            const icon = document.createElement('div');
+            icon.className = 'group-icon';
+            icon.textContent = (header.title || '').charAt(0).toUpperCase();
+            info.appendChild(icon);
+        }
+        const text = document.createElement('div');
+        text.className = 'chat-header-text';
+        const title = document.createElement('h6');
+        title.textContent = header.title;
+        const subtitle = document.createElement('small');
+        subtitle.textContent = header.subtitle;
+        text.append(title, subtitle);
+        info.appendChild(text);
+        chatHeader.appendChild(info);
+
+        if (header.manage_urls) {
+            const urls = header.manage_urls;
+            const dropdown = document.createElement('div');
+            dropdown.className = 'dropdown';
+            dropdown.innerHTML = `
+                <button class="btn btn-outline-secondary btn-sm" type="button" data-bs-toggle="dropdown" aria-expanded="false" style="border-color: var(--border-color); color: var(--text-secondary);">
+                    <i class="bi bi-three-dots-vertical"></i>
+                </button>
+                <ul class="dropdown-menu dropdown-menu-end dropdown-menu-dark">
+                    <li><a class="dropdown-item" href="${urls.edit}"><i class="bi bi-pencil me-2"></i>Change Name</a></li>
+                    <li><a class="dropdown-item" href="${urls.add_members}"><i class="bi bi-person-plus me-2"></i>Add Members</a></li>
+                    <li><a class="dropdown-item" href="${urls.remove_members}"><i class="bi bi-person-dash me-2"></i>Remove Members</a></li>
+                    <li><hr class="dropdown-divider"></li>
+                    <li><a class="dropdown-item text-danger" href="${urls.delete}" onclick="return confirm('Are you sure you want to delete this group? This action cannot be undone.');"><i class="bi bi-trash me-2"></i>Delete Group</a></li>
+                </ul>
+            `;
+            chatHeader.appendChild(dropdown);
+        }
+    }
+
+    function buildHistory(data, messages) {
+        const fragment = document.createDocumentFragment();
+        const currentUsername = document.querySelector('.chat-container')?.dataset.currentUsername || '';
+        if (!messages.length && !data.before) {
+            const empty = document.createElement('div');
+            empty.className = 'text-center text-muted my-4';
+            empty.innerHTML = `
+                <i class="bi bi-chat-quote" style="font-size: 3rem; opacity: 0.3;"></i>
+                <p class="mt-2">Start the conversation</p>
+            `;
+            fragment.appendChild(empty);
+            return fragment;
+        }
+        messages.forEach(message => {
+            const sender = data.people[message.sender_id] || {};
+            const isSent = sender.username === currentUsername;
+            if (message.deleted) {
+                const bubble = document.createElement('div');
+                bubble.className = `message-bubble ${isSent ? 'sent' : 'received'}`;
+                bubble.dataset.messageId = message.id;
+                bubble.innerHTML = `
+                    <p class="fst-italic" style="opacity: 0.7;">This message was deleted.</p>
+                    <span class="message-time"></span>
+                `;
+                bubble.querySelector('.message-time').textContent = message.time;
+                fragment.appendChild(bubble);
+                return;
+            }
+            const bubble = createMessageBubble({
+                content: message.content,
+                timestamp: message.time,
+                isSent,
+                senderDisplayName: data.chat_type === 'group' ? sender.display_name : null,
+                messageId: message.id,
+                attachment: message.attachment,
+                html: message.html
+            });
+            if (message.attachment && !message.html) showAttachmentPreview(bubble, message.attachment.thumbnails);
+            fragment.appendChild(bubble);
+        });
+        return fragment;
+    }
+
+    // Older pages load when the history is scrolled to the top
+    async function loadOlderMessages(chatMessages) {
+        const before = chatMessages.dataset.before;
+        const url = chatMessages.dataset.conversationUrl;
+        if (!before || !url || chatMessages.dataset.loading === 'true') return;
+        chatMessages.dataset.loading = 'true';
+        try {
+            const data = await fetchJson(`${url}?before=${encodeURIComponent(before)}`, {
+                headers: { 'X-Requested-With': 'XMLHttpRequest' },
+                cache: 'no-cache'
+            });
+            const previousHeight = chatMessages.scrollHeight;
+            chatMessages.prepend(buildHistory(data, data.messages));
+            chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+            chatMessages.dataset.before = data.before || '';
+        } catch (error) {
+            console.error(error);
+        } finally {
+            chatMessages.dataset.loading = 'false';
         }
     }
 
@@ -182,15 +315,99 @@
         input.addEventListener('input', () => {
             const filter = input.value.toLowerCase();
             document.querySelectorAll('.contact-list .contact-item').forEach(item => {
-                const name = item.querySelector('.contact-info h6')?.textContent.toLowerCase() || '';
-                const username = item.querySelector('.contact-info small')?.textContent.toLowerCase() || '';
-                item.style.display = (name + username).includes(filter) ? 'flex' : 'none';
+                // Previews are not searched: names and usernames only
+                const text = (item.dataset.search || item.querySelector('.contact-info h6')?.textContent || '').toLowerCase();
+                item.style.display = text.includes(filter) ? 'flex' : 'none';
             });
         });
 
         input.dataset.bound = 'true';
     }
 
+    // Last-message previews come in their own fragment (#sidebar-activity),
+    // so a new message never invalidates the cached sidebar markup
+    function applySidebarActivity() {
+        const source = document.getElementById('sidebar-activity');
+        if (!source) return;
+        const activity = JSON.parse(source.textContent);
+        document.querySelectorAll('.contact-list .section-header').forEach(header => {
+            const items = [];
+            let node = header.nextElementSibling;
+            while (node && !node.classList.contains('section-header')) {
+                if (node.dataset.chat) items.push(node);
+                node = node.nextElementSibling;
+            }
+            const active = items.filter(item => activity[item.dataset.chat]);
+            active.forEach(item => {
+                const entry = activity[item.dataset.chat];
+                item.querySelector('.contact-preview').textContent = entry.preview;
+                item.querySelector('.contact-time').textContent = entry.time;
+            });
+            // Most recently active first; chats without messages keep their order
+            active.sort((a, b) => activity[b.dataset.chat].at - activity[a.dataset.chat].at);
+            header.after(...active);
+        });
+    }
+
+    // Keep the open chat's sidebar entry in step with live messages; the
+    // other entries refresh with the activity fragment on the next page load
+    function updateActivePreview(data, isSent) {
+        const item = document.querySelector('.contact-list .contact-item.active');
+        if (!item) return;
+        let text = data.content || '';
+        if (data.attachment_name) {
+            text = `\u{1F4CE} ${text || data.attachment_name}`;
+        }
+        if (isSent) {
+            text = `You: ${text}`;
+        } else if (state.chatUI.chatType === 'group' && data.sender_display_name) {
+            text = `${data.sender_display_name}: ${text}`;
+        }
+        const preview = item.querySelector('.contact-preview');
+        const time = item.querySelector('.contact-time');
+        if (preview) preview.textContent = text;
+        if (time) time.textContent = data.timestamp || '';
+
+        // Most recently active first within its section
+        let header = item.previousElementSibling;
+        while (header && !header.classList.contains('section-header')) {
+            header = header.previousElementSibling;
+        }
+        if (header && header.nextElementSibling !== item) {
+            header.after(item);
+        }
+    }
+
+    // The Code Playground runs snippets over the open chat's socket
+    function setupCodePanel() {
+        const codePanel = document.getElementById('code-panel');
+        const toggleBtn = document.getElementById('toggle-code-panel');
+        const closeBtn = document.getElementById('close-code-panel');
+        const runBtn = document.getElementById('run-code-btn');
+        const codeInput = document.getElementById('code-input');
+        const codeOutput = document.getElementById('code-output');
+        const cachedMarker = document.getElementById('code-output-cached');
+        if (!codePanel) return;
+
+        toggleBtn?.addEventListener('click', () => codePanel.classList.toggle('open'));
+        closeBtn?.addEventListener('click', () => codePanel.classList.remove('open'));
+
+        runBtn?.addEventListener('click', () => {
+            const code = codeInput?.value || '';
+            if (!code.trim() || !codeOutput) return;
+            if (cachedMarker) cachedMarker.hidden = true;
+            if (state.chatSocket?.readyState === WebSocket.OPEN) {
+                codeOutput.textContent = 'Running...';
+                state.chatSocket.send(JSON.stringify({
+                    type: 'execute_code',
+                    code
+                }));
+            } else {
+                codeOutput.textContent = 'Open a chat to run code.';
+            }
+        });
+    }
+
     function setupMobileSidebar({ mobileToggle, mobileOverlay, sidebar }) {
         if (!mobileToggle || mobileToggle.dataset.bound === 'true' || !sidebar) return;
 
@@ -230,10 +447,10 @@
         emojiBtn.addEventListener('click', () => picker.togglePicker(emojiBtn));
     }
 
-    function setupAttachmentUploads({ attachmentBtn, attachmentInput, attachmentStatus, uploadUrl, messageInput }) {
+    function setupAttachmentUploads({ attachmentBtn, attachmentInput, attachmentStatus, uploadUrl, uploadStartUrl, messageInput }) {
         if (!attachmentBtn) return;
 
-        if (!uploadUrl) {
+        if (!uploadUrl && !uploadStartUrl) {
             attachmentBtn.disabled = true;
             return;
         }
@@ -246,22 +463,15 @@
             const caption = messageInput?.value.trim() || '';
             toggleAttachmentStatus(attachmentStatus, 'Uploading attachment...', 'remove');
 
-            const formData = new FormData();
-            formData.append('file', file);
-            formData.append('caption', caption);
-
             try {
-                const response = await fetch(uploadUrl, {
-                    method: 'POST',
-                    headers: { 'X-CSRFToken': getCsrfToken() },
-                    body: formData
-                });
-
-                if (!response.ok) {
-                    throw new Error(await response.text());
+                if (uploadStartUrl) {
+                    await uploadResumable(file, caption, uploadStartUrl, (done) => {
+                        const percent = Math.floor((done / file.size) * 100);
+                        toggleAttachmentStatus(attachmentStatus, `Uploading attachment... ${percent}%`, 'remove');
+                    });
+                } else {
+                    await uploadInOneRequest(file, caption, uploadUrl);
                 }
-
-                await response.json();
                 toggleAttachmentStatus(attachmentStatus, 'Attachment sent', 'success');
                 if (messageInput) messageInput.value = '';
             } catch (error) {
@@ -274,6 +484,135 @@
         });
     }
 
+    async function uploadInOneRequest(file, caption, uploadUrl) {
+        const formData = new FormData();
+        formData.append('file', file);
+        formData.append('caption', caption);
+
+        const response = await fetch(uploadUrl, {
+            method: 'POST',
+            headers: { 'X-CSRFToken': getCsrfToken() },
+            body: formData
+        });
+        if (!response.ok) {
+            throw new Error(await response.text());
+        }
+        return response.json();
+    }
+
+    async function fetchJson(url, options = {}) {
+        const response = await fetch(url, options);
+        const data = await response.json().catch(() => ({}));
+        if (!response.ok) {
+            const error = new Error(data.error || `HTTP ${response.status}`);
+            error.status = response.status;
+            error.data = data;
+            throw error;
+        }
+        return data;
+    }
+
+    // Picking the same file again (e.g. after a reload) resumes its upload
+    function resumeKey(file, startUrl) {
+        return `collabx-upload:${startUrl}:${file.name}:${file.size}:${file.lastModified}`;
+    }
+
+    async function uploadResumable(file, caption, startUrl, onProgress) {
+        const key = resumeKey(file, startUrl);
+        let upload = null;
+        const savedStatusUrl = localStorage.getItem(key);
+        if (savedStatusUrl) {
+            upload = await fetchJson(savedStatusUrl).catch(() => null);
+            if (!upload || upload.status !== 'pending') upload = null;
+        }
+        if (!upload) {
+            upload = await fetchJson(startUrl, {
+                method: 'POST',
+                headers: { 'X-CSRFToken': getCsrfToken(), 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    file_name: file.name,
+                    size: file.size,
+                    content_type: file.type,
+                    caption
+                })
+            });
+            localStorage.setItem(key, upload.status_url);
+        }
+
+        const body = upload.mode === 'multipart'
+            ? { parts: await sendParts(file, upload, onProgress) }
+            : (await sendChunks(file, upload, onProgress), {});
+
+        const result = await fetchJson(upload.complete_url, {
+            method: 'POST',
+            headers: { 'X-CSRFToken': getCsrfToken(), 'Content-Type': 'application/json' },
+            body: JSON.stringify(body)
+        });
+        localStorage.removeItem(key);
+        return result;
+    }
+
+    async function sendParts(file, upload, onProgress) {
+        // Straight to the bucket; the bucket's CORS rule must expose ETag
+        const parts = [...(upload.completed_parts || [])];
+        let done = parts.length * upload.part_size;
+        for (const { part_number: partNumber, url } of upload.parts) {
+            const start = (partNumber - 1) * upload.part_size;
+            const blob = file.slice(start, Math.min(start + upload.part_size, file.size));
+            let response = null;
+            for (let attempt = 0; attempt < 3 && !response?.ok; attempt++) {
+                response = await fetch(url, { method: 'PUT', body: blob }).catch(() => null);
+            }
+            if (!response?.ok) throw new Error(`Part ${partNumber} failed`);
+            parts.push({ part_number: partNumber, etag: response.headers.get('ETag') });
+            done += blob.size;
+            onProgress(Math.min(done, file.size));
+        }
+        return parts;
+    }
+
+    async function sendChunks(file, upload, onProgress) {
+        let offset = upload.offset || 0;
+        let failures = 0;
+        while (offset < file.size) {
+            const blob = file.slice(offset, offset + upload.part_size);
+            try {
+                const data = await fetchJson(upload.chunk_url, {
+                    method: 'PUT',
+                    headers: { 'X-CSRFToken': getCsrfToken(), 'Upload-Offset': String(offset) },
+                    body: blob
+                });
+                offset = data.offset;
+                failures = 0;
+                onProgress(offset);
+            } catch (error) {
+                if (++failures > 3) throw error;
+                // 409 carries the server's offset; otherwise ask where to resume
+                const state = error.data?.offset !== undefined ? error.data : await fetchJson(upload.status_url);
+                offset = state.offset;
+            }
+        }
+    }
+
+    // Previews arrive after the message, once the background worker has rendered them
+    function showAttachmentPreview(bubble, thumbnails) {
+        const preview = thumbnails && thumbnails.md;
+        if (!bubble || !preview || bubble.querySelector('.attachment-preview')) return;
+        const link = document.createElement('a');
+        link.href = (thumbnails.lg || preview).url;
+        link.target = '_blank';
+        link.rel = 'noopener';
+        const img = document.createElement('img');
+        img.className = 'attachment-preview';
+        img.src = preview.url;
+        img.width = preview.width;
+        img.height = preview.height;
+        img.loading = 'lazy';
+        link.appendChild(img);
+        const card = bubble.querySelector('.attachment-card');
+        bubble.insertBefore(link, card || bubble.firstChild);
+    }
+
     function toggleAttachmentStatus(element, text, state) {
         if (!element) return;
         element.classList.remove('d-none', 'text-danger', 'text-success');
@@ -315,19 +654,27 @@
         const container = state.chatUI.chatMessages;
 
         if (data.type === 'chat_message') {
+            const isSent = data.sender_username === state.chatUI.currentUsername;
             const bubble = createMessageBubble({
                 content: data.content,
                 timestamp: data.timestamp,
-                isSent: data.sender_username === state.chatUI.currentUsername,
+                isSent,
                 senderDisplayName: state.chatUI.chatType === 'group' ? data.sender_display_name : null,
                 messageId: data.message_id,
                 attachment: {
                     url: data.attachment_url,
                     name: data.attachment_name
-                }
+                },
+                html: data.html
             });
             container.appendChild(bubble);
             scrollToBottom(container);
+            updateActivePreview(data, isSent);
+        } else if (data.type === 'attachment_thumbnails') {
+            showAttachmentPreview(
+                container.querySelector(`.message-bubble[data-message-id='${data.message_id}']`),
+                data.thumbnails
+            );
         } else if (data.type === 'message_deleted') {
             const bubble = container.querySelector(`.message-bubble[data-message-id='${data.message_id}']`);
             if (bubble) {
@@ -338,6 +685,11 @@
             }
         } else if (data.type === 'bot_message') {
             handleBotMessage(data);
+        } else if (data.type === 'execution_result') {
+            const codeOutput = document.getElementById('code-output');
+            const cachedMarker = document.getElementById('code-output-cached');
+            if (codeOutput) codeOutput.textContent = data.output;
+            if (cachedMarker) cachedMarker.hidden = !data.cached;
         }
     }
 
@@ -345,16 +697,45 @@
         if (!state.chatUI || !state.chatUI.chatMessages) return;
         const container = state.chatUI.chatMessages;
 
-        if (data.status === 'thinking') {
-            const bubble = createBotMessageBubble({
-                content: data.content,
-                senderUsername: data.sender_username,
-                jumpId: null,
-                requestId: data.request_id
-            });
-            container.appendChild(bubble);
-        } else if (data.status === 'complete') {
+        if (data.status === 'queued' || data.status === 'thinking') {
+            // A queued request keeps its bubble and just updates the text
+            const contentP = document.getElementById(`bot-content-${data.request_id}`);
+            if (contentP) {
+                contentP.textContent = data.content;
+            } else {
+                const bubble = createBotMessageBubble({
+                    content: data.content,
+                    senderUsername: data.sender_username,
+                    jumpId: null,
+                    requestId: data.request_id
+                });
+                container.appendChild(bubble);
+            }
+        } else if (data.status === 'cancelled') {
             const existing = document.getElementById(`bot-response-${data.request_id}`);
+            if (existing) existing.remove();
+        } else if (data.status === 'streaming') {
+            // Append partial tokens; the first chunk replaces "Thinking..."
+            const contentP = document.getElementById(`bot-content-${data.request_id}`);
+            if (contentP) {
+                if (contentP.dataset.streaming !== 'true') {
+                    contentP.dataset.streaming = 'true';
+                    contentP.textContent = '';
+                }
+                contentP.textContent += data.content;
+            }
+        } else if (data.status === 'complete') {
+            let existing = document.getElementById(`bot-response-${data.request_id}`);
+            if (!existing) {
+                // e.g. a "busy" reply for a request that was never queued
+                existing = createBotMessageBubble({
+                    content: data.content,
+                    senderUsername: data.sender_username,
+                    jumpId: null,
+                    requestId: data.request_id
+                });
+                container.appendChild(existing);
+            }
             if (existing) {
                 const contentP = existing.querySelector(`#bot-content-${data.request_id}`);
                 if (contentP) {
@@ -395,6 +776,10 @@
     function setupMessageActions({ chatMessages }) {
         if (!chatMessages) return;
 
+        chatMessages.addEventListener('scroll', () => {
+            if (chatMessages.scrollTop === 0) loadOlderMessages(chatMessages);
+        });
+
         chatMessages.addEventListener('click', (event) => {
             const deleteBtn = event.target.closest('.delete-msg-btn');
             if (deleteBtn) {
@@ -652,6 +1037,13 @@
                 });
                 state.workspaceTree = buildWorkspaceTree(Array.from(state.workspaceNodes.values()));
                 renderWorkspaceTree();
+                // Files rewritten by Collab-X: reload the one open in the editor
+                if (state.activeWorkspaceNode && (data.changed_node_ids || []).includes(state.activeWorkspaceNode)) {
+                    state.workspaceSocket.send(JSON.stringify({
+                        type: 'read_file',
+                        node_id: state.activeWorkspaceNode
+                    }));
+                }
             } else if (data.type === 'file_content') {
                 // Handle file content response
                 const nodeId = data.node_id;
@@ -680,7 +1072,7 @@
                 if (workspaceConsole && workspaceOutputMeta) {
                     const output = data.output || '(no output)';
                     workspaceConsole.textContent = output;
-                    workspaceOutputMeta.textContent = `${(data.language || 'python').toUpperCase()} • Execution Result`;
+                    workspaceOutputMeta.textContent = `${(data.language || 'python').toUpperCase()} • Execution Result${data.cached ? ' (cached)' : ''}`;
                 }
             }
         };
@@ -1081,7 +1473,7 @@
         workspaceOutputMeta.textContent = `${language.toUpperCase()} • requested by ${requested_by}`;
     }
 
-    function createMessageBubble({ content, timestamp, isSent, senderDisplayName, messageId, attachment }) {
+    function createMessageBubble({ content, timestamp, isSent, senderDisplayName, messageId, attachment, html }) {
         const bubble = document.createElement('div');
         bubble.className = `message-bubble ${isSent ? 'sent' : 'received'}`;
         bubble.dataset.messageId = messageId;
@@ -1094,24 +1486,35 @@
             bubble.appendChild(sender);
         }
 
-        if (content) {
+        if (html) {
+            // Body pre-rendered (and escaped) by the server when the message was saved
+            bubble.insertAdjacentHTML('beforeend', html);
+        } else if (content) {
             const contentNode = document.createElement('p');
             contentNode.textContent = content;
             bubble.appendChild(contentNode);
         }
 
-        if (attachment?.url) {
+        if (attachment?.url && !html) {
             const attachmentCard = document.createElement('div');
             attachmentCard.className = 'attachment-card';
             attachmentCard.innerHTML = `
                 <i class="bi bi-paperclip"></i>
                 <div class="flex-grow-1">
-                    <strong>${attachment.name || 'Attachment'}</strong>
+                    <strong></strong>
                 </div>
-                <a class="btn btn-sm btn-outline-light" href="${attachment.url}" download>
+                <a class="btn btn-sm btn-outline-light" download>
                     <i class="bi bi-download me-1"></i>Download
                 </a>
             `;
+            attachmentCard.querySelector('strong').textContent = attachment.name || 'Attachment';
+            attachmentCard.querySelector('a').href = attachment.url;
+            if (attachment.size !== null && attachment.size !== undefined) {
+                const size = document.createElement('small');
+                size.className = 'text-muted';
+                size.textContent = formatFileSize(attachment.size);
+                attachmentCard.querySelector('.flex-grow-1').append(document.createElement('br'), size);
+            }
             bubble.appendChild(attachmentCard);
         }
 
@@ -1170,6 +1573,17 @@
         return bubble;
     }
 
+    function formatFileSize(bytes) {
+        const units = ['bytes', 'KB', 'MB', 'GB'];
+        let size = bytes;
+        let unit = 0;
+        while (size >= 1024 && unit < units.length - 1) {
+            size /= 1024;
+            unit += 1;
+        }
+        return unit === 0 ? `${size} ${units[0]}` : `${size.toFixed(1)} ${units[unit]}`;
+    }
+
     function scrollToBottom(container) {
         if (!container) return;
         container.scrollTop = container.scrollHeight;
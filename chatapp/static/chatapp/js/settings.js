@@ -0,0 +1,23 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const profilePicInput = document.getElementById('id_profile_picture');
+    const profilePicPreview = document.getElementById('profile-pic-preview');
+    const profileForm = document.getElementById('profile-form');
+
+    // This function runs when a new file is chosen
+    profilePicInput.addEventListener('change', function(event) {
+        const file = event.target.files[0];
+        if (file) {
+            // Show a live preview of the new image
+            const reader = new FileReader();
+            reader.onload = function(e) {
+                profilePicPreview.src = e.target.result;
+            }
+            reader.readAsDataURL(file);
+
+            // Automatically submit the form to save the change
+            setTimeout(() => {
+                profileForm.submit();
+            }, 500); // Small delay to see the preview
+        }
+    });
+});
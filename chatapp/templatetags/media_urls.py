@@ -0,0 +1,36 @@
+from django import template
+from django.core.files.storage import default_storage
+
+from chatapp.thumbnails import variant
+
+register = template.Library()
+
+
+@register.filter
+def signed_url(field_file):
+    """URL of a FieldFile, using the one prefetched by storage.prefetch_file_urls if present."""
+    if not field_file:
+        return ''
+    return getattr(field_file, '_prefetched_url', None) or field_file.url
+
+
+@register.filter
+def thumbnail(instance, label):
+    """The {name, width, height} variant of a message attachment or avatar, if ready."""
+    return variant(instance, label)
+
+
+@register.filter
+def thumbnail_url(instance, label):
+    """URL of a resized variant (prefetched by thumbnails.prefetch_variant_urls if possible), or ''."""
+    prefetched = getattr(instance, '_variant_urls', {}).get(label)
+    if prefetched:
+        return prefetched
+    found = variant(instance, label)
+    return default_storage.url(found['name']) if found else ''
+
+
+@register.filter
+def avatar_url(profile, label='sm'):
+    """Avatar variant URL, falling back to the original picture until variants exist."""
+    return thumbnail_url(profile, label) or signed_url(profile.profile_picture)
@@ -0,0 +1,45 @@
+# chatapp/tests/helpers.py
+
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.test import override_settings
+
+from chatapp.models import Group, GroupMessage, Message
+
+# Templates resolve {% static %} without a collectstatic manifest, media
+# stays on the local disk and background tasks run inline
+TEST_SETTINGS = {
+    'STORAGES': {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    'BACKGROUND_TASKS_EAGER': True,
+    'QUERY_BUDGET_ENABLED': True,
+}
+
+
+def make_chat_users(messages=30):
+    """alice and bob, contacts of each other and members of group 'team', with some history."""
+    alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+    bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+    alice.profile.contacts.add(bob.profile)
+    bob.profile.contacts.add(alice.profile)
+    group = Group.objects.create(name='team', creator=alice)
+    group.members.add(alice, bob)
+    for n in range(messages):
+        Message.objects.create(sender=alice if n % 2 else bob, receiver=bob if n % 2 else alice, content=f'direct {n}')
+        GroupMessage.objects.create(group=group, sender=alice if n % 2 else bob, content=f'group {n}')
+    return alice, bob, group
+
+
+def use_temp_media(test_case, **settings):
+    """TEST_SETTINGS for the rest of the test, with media and staged uploads in throwaway directories."""
+    media_root = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+    overrides = override_settings(
+        **TEST_SETTINGS, MEDIA_ROOT=media_root, CHUNKED_UPLOAD_DIR=f'{media_root}/staged', **settings
+    )
+    overrides.enable()
+    test_case.addCleanup(overrides.disable)
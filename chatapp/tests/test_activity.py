@@ -0,0 +1,71 @@
+# chatapp/tests/test_activity.py
+
+from django.test import TestCase
+
+from chatapp.activity import (
+    DELETED_PREVIEW, activity_version, message_deleted, record_message, sidebar_activity,
+)
+from chatapp.conversations import direct_room_key, group_room_key
+from chatapp.models import ConversationActivity, GroupMessage, Message
+from chatapp.query_budget import assert_max_queries
+
+from .helpers import make_chat_users
+
+
+class ActivityTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob, self.group = make_chat_users(messages=0)
+        self.direct_key = direct_room_key(self.alice.id, self.bob.id)
+        self.group_key = group_room_key(self.group.id)
+
+    def direct(self, content, sender=None):
+        sender = sender or self.alice
+        receiver = self.bob if sender == self.alice else self.alice
+        return Message.objects.create(sender=sender, receiver=receiver, content=content)
+
+    def activity(self, room_key):
+        return ConversationActivity.objects.get(room_key=room_key)
+
+    def test_write_moves_the_pointer(self):
+        self.direct('first')
+        latest = self.direct('second\n  line', sender=self.bob)
+        row = self.activity(self.direct_key)
+        self.assertEqual((row.last_message_id, row.last_sender_id, row.preview), (latest.id, self.bob.id, 'second line'))
+
+    def test_attachment_preview(self):
+        Message.objects.create(sender=self.alice, receiver=self.bob, content='', file='chat_attachments/notes.txt', file_name='notes.txt')
+        self.assertEqual(self.activity(self.direct_key).preview, '\U0001F4CE notes.txt')
+
+    def test_pointer_never_moves_back(self):
+        older = self.direct('older')
+        newer = self.direct('newer')
+        record_message(older)  # A late upsert for an earlier message
+        self.assertEqual(self.activity(self.direct_key).last_message_id, newer.id)
+
+    def test_soft_delete_of_the_newest_message(self):
+        older = self.direct('older')
+        newer = self.direct('newer')
+        message_deleted(self.direct_key, older.id)
+        self.assertEqual(self.activity(self.direct_key).preview, 'newer')
+        message_deleted(self.direct_key, newer.id)
+        self.assertEqual(self.activity(self.direct_key).preview, DELETED_PREVIEW)
+
+    def test_hard_delete_falls_back_to_the_previous_message(self):
+        older = self.direct('older')
+        self.direct('newer').delete()
+        self.assertEqual(self.activity(self.direct_key).last_message_id, older.id)
+        older.delete()
+        self.assertFalse(ConversationActivity.objects.filter(room_key=self.direct_key).exists())
+
+    def test_sidebar_reads_every_chat_in_one_query(self):
+        self.direct('hi bob')
+        GroupMessage.objects.create(group=self.group, sender=self.bob, content='hi team')
+        with assert_max_queries(1, 'sidebar activity'):
+            activity = sidebar_activity(self.alice.id, [self.direct_key, self.group_key])
+        self.assertEqual(activity[f'1on1:{self.bob.id}']['preview'], 'You: hi bob')
+        self.assertEqual(activity[f'group:{self.group.id}']['preview'], 'bob: hi team')
+
+    def test_version_changes_with_each_write(self):
+        before = activity_version([self.direct_key, self.group_key])
+        self.direct('hello')
+        self.assertNotEqual(activity_version([self.direct_key, self.group_key]), before)
@@ -0,0 +1,84 @@
+# chatapp/tests/test_blobs.py
+
+from io import StringIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase
+
+from chatapp.blobs import detach_attachment, store_blob
+from chatapp.models import Message, StoredBlob
+
+from .helpers import make_chat_users, use_temp_media
+
+BODY = b'0123456789'
+
+
+def variants(stem, width):
+    return {label: {'name': f'chat_attachments/{stem}__{label}.webp', 'width': width, 'height': width * 3 // 4}
+            for label in ('md', 'lg')}
+
+
+class BlobTestCase(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        self.alice, self.bob, self.group = make_chat_users(messages=0)
+
+    def attachment(self, name, thumbnails=None, blob=None):
+        name = default_storage.save(f'chat_attachments/{name}', ContentFile(BODY))
+        return Message.objects.create(
+            sender=self.alice, receiver=self.bob, content='', file=name, blob=blob,
+            file_size=len(BODY), checksum='c' * 64, content_type='image/png', thumbnails=thumbnails or {},
+        )
+
+
+class StoreBlobTests(BlobTestCase):
+    def test_identical_content_is_stored_once(self):
+        metadata = {'file_size': len(BODY), 'checksum': 'c' * 64, 'content_type': 'text/plain'}
+        first = store_blob(ContentFile(BODY), 'a.txt', metadata)
+        second = store_blob(ContentFile(BODY), 'b.txt', metadata)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(StoredBlob.objects.get().ref_count, 2)
+
+    def test_last_reference_deletes_the_file(self):
+        metadata = {'file_size': len(BODY), 'checksum': 'c' * 64}
+        blob = store_blob(ContentFile(BODY), 'a.txt', metadata)
+        store_blob(ContentFile(BODY), 'a.txt', metadata)
+        first = self.attachment('one.png', blob=blob)
+        second = self.attachment('two.png', blob=blob)
+        Message.objects.filter(pk__in=[first.pk, second.pk]).update(file=blob.name)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(detach_attachment(first), 0)
+        self.assertTrue(default_storage.exists(blob.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(detach_attachment(second), len(BODY))
+        self.assertFalse(StoredBlob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.name))
+
+
+class DedupCommandTests(BlobTestCase):
+    def test_duplicates_share_a_blob_and_re_render(self):
+        original = self.attachment('a.png', variants('a', 320))
+        duplicate = self.attachment('b.png', variants('b', 100))
+        self.assertIn('width="100"', duplicate.rendered_html)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedup_attachments', stdout=StringIO())
+
+        blob = StoredBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        original.refresh_from_db()
+        duplicate.refresh_from_db()
+        self.assertEqual(duplicate.file.name, original.file.name)
+        self.assertEqual(duplicate.thumbnails, original.thumbnails)
+        # The stored body shows the shared variants, not the deleted ones
+        self.assertIn('width="320"', duplicate.rendered_html)
+        self.assertFalse(default_storage.exists('chat_attachments/b.png'))
+
+        # Re-running changes nothing
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedup_attachments', '--recount', stdout=StringIO())
+        self.assertEqual(StoredBlob.objects.get().ref_count, 2)
@@ -0,0 +1,128 @@
+# chatapp/tests/test_bot_context.py
+
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+
+from chatapp import bot_context
+from chatapp.bot_context import build_history_context, discard_summary
+from chatapp.models import ConversationSummary, Message
+from chatapp.query_budget import assert_max_queries
+from chatapp.rooms import direct_room_key
+
+from .helpers import TEST_SETTINGS, make_chat_users
+
+
+async def fake_summarize(previous, history):
+    # A "summary" that is just every folded line, so tests can see what it covers
+    return '\n'.join(part for part in (previous, history) if part)
+
+
+@override_settings(**TEST_SETTINGS, COLLAB_CONTEXT_TAIL=5, COLLAB_SUMMARY_BATCH=5, COLLAB_SUMMARY_MAX_BATCH=10)
+class SummaryTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob, self.group = make_chat_users(messages=0)
+        self.room_key = direct_room_key(self.alice.id, self.bob.id)
+        patcher = mock.patch.object(bot_context, 'summarize_history', side_effect=fake_summarize)
+        self.summarize = patcher.start()
+        self.addCleanup(patcher.stop)
+        bot_context._rebuilds.clear()
+
+    def post(self, count):
+        return [
+            Message.objects.create(sender=self.alice, receiver=self.bob, content=f'line {Message.objects.count()}')
+            for _ in range(count)
+        ]
+
+    def history(self):
+        return Message.objects.filter(sender__in=[self.alice, self.bob], is_deleted=False)
+
+    def delete(self, message):
+        Message.objects.filter(pk=message.pk).update(is_deleted=True)
+        async_to_sync(discard_summary)(self.room_key, message.id)
+
+    def fold(self, count):
+        # Post `count` messages and let the next bot call fold them
+        messages = self.post(count)
+        self.context()
+        return messages
+
+    def context(self):
+        return async_to_sync(build_history_context)(self.room_key, self.history())
+
+    def test_reading_creates_no_summary_row(self):
+        self.post(3)
+        # Summary lookup, tail and the "is a batch due" probe; no write
+        with assert_max_queries(3, 'context without a fold'):
+            self.context()
+        self.assertFalse(ConversationSummary.objects.exists())
+
+    def test_first_fold_creates_the_summary(self):
+        messages = self.post(12)
+        self.context()
+        summary = ConversationSummary.objects.get(room_key=self.room_key)
+        # Everything older than the 5-message tail
+        self.assertEqual(summary.last_message_id, messages[6].id)
+        self.assertIn('line 0', summary.summary)
+        self.assertNotIn('line 7', summary.summary)
+
+    def test_stale_summary_is_not_served_until_rebuilt(self):
+        messages = self.fold(12)
+        # Model backend down: the rebuild fails and the summary stays stale
+        self.summarize.side_effect = None
+        self.summarize.return_value = None
+        self.delete(messages[2])
+        summary = ConversationSummary.objects.get(room_key=self.room_key)
+        self.assertEqual(summary.stale_from, messages[2].id)
+        self.assertIn('line 2', summary.summary)
+        self.assertNotIn('SUMMARY', self.context())
+
+        # Backend back: the read path retries the rebuild once the delay has passed
+        self.summarize.side_effect = fake_summarize
+        with self.settings(COLLAB_SUMMARY_RETRY_SECONDS=0):
+            self.assertNotIn('SUMMARY', self.context())
+        summary.refresh_from_db()
+        self.assertIsNone(summary.stale_from)
+        self.assertNotIn('line 2', summary.summary)
+        self.assertIn('line 3', summary.summary)
+        self.assertIn('SUMMARY', self.context())
+
+    def test_failed_rebuild_is_not_retried_at_once(self):
+        messages = self.fold(12)
+        self.summarize.side_effect = None
+        self.summarize.return_value = None
+        self.delete(messages[2])
+        self.summarize.reset_mock()
+        self.context()
+        self.summarize.assert_not_called()
+
+    def test_rebuild_restarts_from_the_checkpoint_before_the_delete(self):
+        messages = self.fold(10) + self.fold(5) + self.fold(5)
+        summary = ConversationSummary.objects.get(room_key=self.room_key)
+        self.assertEqual([checkpoint[0] for checkpoint in summary.checkpoints],
+                         [messages[4].id, messages[9].id, messages[14].id])
+        self.summarize.reset_mock()
+        self.delete(messages[12])
+        # Only the batch after the checkpoint at messages[9] is folded again
+        self.assertEqual(self.summarize.call_count, 1)
+        previous, history = self.summarize.call_args.args
+        self.assertEqual(previous, summary.checkpoints[1][1])
+        self.assertIn('line 13', history)
+        self.assertNotIn('line 12', history)
+        summary.refresh_from_db()
+        self.assertIsNone(summary.stale_from)
+        self.assertEqual(summary.last_message_id, messages[14].id)
+        self.assertEqual(summary.checkpoints[-1][0], messages[14].id)
+
+    @override_settings(COLLAB_SUMMARY_REBUILD_BATCHES=1)
+    def test_rebuild_is_bounded_without_a_checkpoint(self):
+        messages = self.fold(10) + self.fold(5) + self.fold(5)
+        self.summarize.reset_mock()
+        self.delete(messages[0])
+        # One max batch (10 messages) back from the summary's end, not the whole history
+        self.assertEqual(self.summarize.call_count, 1)
+        previous, history = self.summarize.call_args.args
+        self.assertEqual(previous, '')
+        self.assertIn('line 5', history)
+        self.assertNotIn('line 4', history)
@@ -0,0 +1,116 @@
+# chatapp/tests/test_bot_queue.py
+
+import asyncio
+
+from django.test import SimpleTestCase
+
+from chatapp.bot_queue import BotScheduler, PRIORITY_SHARED
+from chatapp.bot_singleflight import CACHED, COALESCED, LEADER, SingleFlight
+
+
+class SingleFlightTests(SimpleTestCase):
+    async def test_identical_requests_share_one_call(self):
+        flights = SingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def produce():
+            calls.append(1)
+            await release.wait()
+            return 'answer'
+
+        key = ('chat_1_2', 'what changed', 10)
+        first = asyncio.ensure_future(flights.run(key, produce))
+        second = asyncio.ensure_future(flights.run(key, produce))
+        await asyncio.sleep(0)
+        release.set()
+        self.assertEqual(await first, ('answer', LEADER))
+        self.assertEqual(await second, ('answer', COALESCED))
+        self.assertEqual(await flights.run(key, produce), ('answer', CACHED))
+        self.assertEqual(len(calls), 1)
+
+    async def test_a_new_message_misses_the_cache(self):
+        flights = SingleFlight()
+
+        async def produce():
+            return 'answer'
+
+        await flights.run(('chat_1_2', 'q', 10), produce)
+        self.assertEqual((await flights.run(('chat_1_2', 'q', 11), produce))[1], LEADER)
+
+    async def test_uncacheable_answers_are_not_kept(self):
+        flights = SingleFlight()
+
+        async def produce():
+            return 'error'
+
+        await flights.run(('chat_1_2', 'q', 10), produce, cacheable=lambda text: text != 'error')
+        self.assertEqual((await flights.run(('chat_1_2', 'q', 10), produce))[1], LEADER)
+
+
+class BotSchedulerTests(SimpleTestCase):
+    async def settle(self):
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+    async def test_rooms_take_turns_within_the_concurrency_cap(self):
+        scheduler = BotScheduler(max_concurrency=1)
+        order = []
+
+        def job(name):
+            async def run():
+                order.append(name)
+            return run
+
+        # x0 takes the only slot while the rest queue up
+        for name in ('x0', 'a1', 'a2', 'b1'):
+            scheduler.submit(name[0], PRIORITY_SHARED, job(name))
+        await self.settle()
+        self.assertEqual(order, ['x0', 'a1', 'b1', 'a2'])
+
+    async def test_follower_of_a_cancelled_leader_waits_for_a_slot(self):
+        scheduler = BotScheduler(max_concurrency=1)
+        flights = SingleFlight()
+        key = ('room', 'q', 1)
+        running, peak, produced = [0], [0], []
+        release = asyncio.Event()
+
+        def keyed(name):
+            async def produce():
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+                try:
+                    await release.wait()
+                finally:
+                    running[0] -= 1
+                produced.append(name)
+                return name
+
+            async def run():
+                return (await flights.run(key, produce))[0]
+            return run
+
+        async def other():
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await release.wait()
+            running[0] -= 1
+            return 'other'
+
+        leader = scheduler.submit('room', PRIORITY_SHARED, keyed('leader'), key=key)
+        follower = scheduler.submit('room', PRIORITY_SHARED, keyed('follower'), key=key)
+        queued = scheduler.submit('elsewhere', PRIORITY_SHARED, other)
+        await self.settle()
+        self.assertTrue(follower.follower)
+
+        scheduler.cancel(leader)
+        await self.settle()
+        # The follower went back in line instead of calling the model without a slot
+        self.assertFalse(follower.done.done())
+        self.assertEqual(scheduler._running_total, 1)
+        release.set()
+        self.assertEqual(await follower.done, 'follower')
+        self.assertEqual(await queued.done, 'other')
+        self.assertTrue(leader.done.cancelled())
+        self.assertEqual(peak[0], 1)
+        self.assertEqual(produced, ['follower'])
@@ -0,0 +1,100 @@
+# chatapp/tests/test_bot_retrieval.py
+
+import random
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from chatapp import bot_retrieval
+from chatapp.bot_retrieval import RoomIndex, get_room_index, retrieve_relevant
+from chatapp.models import GroupMessage
+from chatapp.rooms import group_room_key
+
+from .helpers import TEST_SETTINGS, make_chat_users
+
+
+def scored_ids(hits):
+    return [message_id for _, message_id in hits]
+
+
+class RoomIndexSearchTests(SimpleTestCase):
+    def test_matching_messages_rank_by_bm25(self):
+        index = RoomIndex()
+        index.add(1, 'deploy the staging server tonight')
+        index.add(2, 'lunch plans for tonight')
+        index.add(3, 'staging deploy failed on the migration step')
+        index.add(4, 'tonight tonight tonight')
+        # Both terms in each; the shorter message ranks first
+        self.assertEqual(scored_ids(index.search('staging deploy', 10)), [1, 3])
+        self.assertEqual(scored_ids(index.search('staging lunch', 10)), [2, 1, 3])
+        self.assertEqual(index.search('nothing matches', 10), [])
+
+    def test_excluded_messages_are_skipped(self):
+        index = RoomIndex()
+        for message_id in range(1, 6):
+            index.add(message_id, 'release notes')
+        hits = index.search('release', 10, exclude_ids={2, 4})
+        self.assertEqual(sorted(scored_ids(hits)), [1, 3, 5])
+
+    def test_very_common_terms_are_dropped(self):
+        index = RoomIndex()
+        for message_id in range(1, 11):
+            index.add(message_id, 'hello team' + (' rollback' if message_id == 7 else ''))
+        # "hello" is in every message: only the rarest term is scored
+        self.assertEqual(scored_ids(index.search('hello rollback', 10)), [7])
+        # ...unless it is the only term there is
+        self.assertEqual(len(index.search('hello', 10)), 10)
+
+    def test_early_termination_keeps_the_exact_top_hits(self):
+        rng = random.Random(7)
+        vocab = [f'term{n}' for n in range(200)]
+        weights = [1 / (n + 1) for n in range(200)]
+        index, reference = RoomIndex(), RoomIndex()
+        for message_id in range(1, 3001):
+            text = ' '.join(rng.choices(vocab, weights, k=rng.randint(3, 15)))
+            index.add(message_id, text)
+            reference.add(message_id, text)
+        for _ in range(20):
+            query = ' '.join(rng.sample(vocab[5:], 4))
+            hits = index.search(query, 12, exclude_ids={1, 2})
+            # Scoring every message of every term: no pruning past the top 12
+            everything = reference.search(query, 3000, exclude_ids={1, 2})
+            self.assertEqual([round(score, 9) for score, _ in hits],
+                             [round(score, 9) for score, _ in everything[:12]])
+
+
+@override_settings(**TEST_SETTINGS)
+class RetrieveRelevantTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob, self.group = make_chat_users(messages=0)
+        self.room_key = group_room_key(self.group.id)
+        bot_retrieval._indexes.clear()
+        self.addCleanup(bot_retrieval._indexes.clear)
+
+    def post(self, content):
+        return GroupMessage.objects.create(group=self.group, sender=self.alice, content=content)
+
+    def history(self):
+        return GroupMessage.objects.filter(group=self.group, is_deleted=False)
+
+    def test_deleted_messages_are_not_returned(self):
+        kept = self.post('the invoice template lives in the shared drive')
+        gone = self.post('invoice numbers restart every year')
+        self.post('unrelated chatter')
+        self.assertEqual({m.id for m in retrieve_relevant(self.room_key, self.history(), 'invoice', 5)},
+                         {kept.id, gone.id})
+        GroupMessage.objects.filter(pk=gone.pk).update(is_deleted=True)
+        self.assertEqual([m.id for m in retrieve_relevant(self.room_key, self.history(), 'invoice', 5)], [kept.id])
+
+    @override_settings(COLLAB_RETRIEVAL_COLD_SEED=2)
+    def test_cold_room_searches_its_newest_messages(self):
+        self.post('old design doc for the parser')
+        recent = self.post('parser rewrite merged')
+        self.post('coffee?')
+        # The full build is queued but has not run yet
+        with mock.patch.object(bot_retrieval, 'submit'):
+            hits = retrieve_relevant(self.room_key, self.history(), 'parser', 5)
+        self.assertEqual([m.id for m in hits], [recent.id])
+        index = get_room_index(self.room_key)
+        self.assertFalse(index.ready)
+        self.assertIsNotNone(index.seed)
@@ -0,0 +1,100 @@
+# chatapp/tests/test_changeset.py
+
+from unittest import mock
+
+from django.test import TestCase
+
+from chatapp.models import WorkspaceNode
+from chatapp.query_budget import assert_max_queries
+from chatapp.workspace_utils import apply_changeset, build_changeset, extract_code_blocks
+
+from .helpers import make_chat_users
+
+WORKSPACE = 'chat_1_2'
+
+FOLDER_ANSWER = """Here you go:
+```python:app/main.py
+from app.util import add
+print(add(1, 2))
+```
+```python:util.py
+def add(a, b):
+    return a + b
+```
+```python
+print('extra')
+```
+"""
+
+
+class BuildChangesetTests(TestCase):
+    def test_folder_answer_becomes_one_entry_per_file(self):
+        changes = build_changeset('folder', 'app', extract_code_blocks(FOLDER_ANSWER))
+        self.assertEqual([c['path'] for c in changes], ['app/main.py', 'app/util.py', 'app/file3.py'])
+        self.assertTrue(all(c['language'] == 'python' for c in changes))
+
+    def test_file_answer_prefers_the_matching_block(self):
+        changes = build_changeset('file', 'lib/util.py', extract_code_blocks(FOLDER_ANSWER))
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0]['path'], 'lib/util.py')
+        self.assertIn('def add', changes[0]['content'])
+
+    def test_unsafe_paths_are_contained(self):
+        self.assertEqual(build_changeset('folder', '../etc', extract_code_blocks(FOLDER_ANSWER)), [])
+        blocks = [{'filename': '../../escape.py', 'language': 'python', 'content': 'x = 1'}]
+        self.assertEqual([c['path'] for c in build_changeset('folder', 'app', blocks)], ['app/file1.py'])
+
+
+class ApplyChangesetTests(TestCase):
+    def setUp(self):
+        self.alice, _, _ = make_chat_users(messages=0)
+
+    def node(self, name, content='', parent=None, folder=False):
+        return WorkspaceNode.objects.create(
+            workspace_key=WORKSPACE, name=name, parent=parent, created_by=self.alice, content=content,
+            node_type=WorkspaceNode.NodeType.FOLDER if folder else WorkspaceNode.NodeType.FILE,
+        )
+
+    def change(self, path, content):
+        return {'path': path, 'language': 'python', 'content': content}
+
+    def test_creates_folders_and_files(self):
+        result = apply_changeset(WORKSPACE, [self.change('a/b/c.py', 'x = 1'), self.change('a/d.py', 'y = 2')], user=self.alice)
+        self.assertEqual(result['created'], ['a/b/c.py', 'a/d.py'])
+        c = WorkspaceNode.objects.get(name='c.py')
+        self.assertEqual((c.parent.name, c.parent.parent.name, c.content), ('b', 'a', 'x = 1'))
+        self.assertEqual(len(result['changed_ids']), 2)
+
+    def test_updates_only_changed_files(self):
+        app = self.node('app', folder=True)
+        same = self.node('same.py', 'x = 1', parent=app)
+        edited = self.node('edited.py', 'old', parent=app)
+        result = apply_changeset(
+            WORKSPACE, [self.change('app/same.py', 'x = 1'), self.change('app/edited.py', 'new')], user=self.alice,
+        )
+        self.assertEqual((result['created'], result['updated']), ([], ['app/edited.py']))
+        self.assertEqual(result['changed_ids'], [edited.id])
+        edited.refresh_from_db()
+        self.assertEqual(edited.content, 'new')
+        self.assertEqual(WorkspaceNode.objects.get(id=same.id).content, 'x = 1')
+
+    def test_name_collisions_are_skipped(self):
+        self.node('app', 'not a folder')
+        self.node('pkg', folder=True)
+        result = apply_changeset(WORKSPACE, [self.change('app/main.py', 'x'), self.change('pkg', 'y')], user=self.alice)
+        self.assertEqual(result['skipped'], ['app/main.py', 'pkg'])
+        self.assertEqual(WorkspaceNode.objects.count(), 2)
+
+    def test_query_count_does_not_grow_with_files(self):
+        self.node('src', folder=True)
+        changes = [self.change(f'src/pkg{i}/mod{j}.py', 'x') for i in range(5) for j in range(5)]
+        with assert_max_queries(5, 'apply changeset'):
+            apply_changeset(WORKSPACE, changes, user=self.alice)
+        self.assertEqual(WorkspaceNode.objects.filter(node_type=WorkspaceNode.NodeType.FILE).count(), 25)
+
+    def test_failure_rolls_back_the_whole_changeset(self):
+        changes = [self.change('a/one.py', 'x'), self.change('a/two.py', 'y')]
+        with mock.patch.object(WorkspaceNode.objects, 'bulk_update', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                apply_changeset(WORKSPACE, changes, user=self.alice)
+        self.assertFalse(WorkspaceNode.objects.exists())
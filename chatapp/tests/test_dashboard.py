@@ -0,0 +1,62 @@
+# chatapp/tests/test_dashboard.py
+
+import re
+
+from django.contrib.staticfiles import finders
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from chatapp.models import Message
+
+from .helpers import TEST_SETTINGS, make_chat_users
+
+ELEMENT_ID_RE = re.compile(r"getElementById\('([\w-]+)'\)")
+# Elements the script creates itself when missing
+CREATED_ID_RE = re.compile(r"\.id = '([\w-]+)'")
+CONVERSATION_URL_RE = re.compile(r'data-conversation-url="([^"]+)"')
+
+
+@override_settings(**TEST_SETTINGS)
+class DashboardSmokeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.group = make_chat_users(messages=5)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.alice)
+
+    def test_dashboard_loads_its_client(self):
+        response = self.client.get(reverse('chatapp:dashboard_chat', args=[self.bob.id]))
+        self.assertContains(response, 'chatapp/js/dashboard.js')
+        html = response.content.decode()
+        with open(finders.find('chatapp/js/dashboard.js'), encoding='utf-8') as script:
+            source = script.read()
+        ids = set(ELEMENT_ID_RE.findall(source)) - set(CREATED_ID_RE.findall(source))
+        missing = sorted(element_id for element_id in ids if f'id="{element_id}"' not in html)
+        self.assertEqual(missing, [])
+
+    def test_chat_switch_round_trips_with_the_etag(self):
+        html = self.client.get(reverse('chatapp:dashboard')).content.decode()
+        urls = CONVERSATION_URL_RE.findall(html)
+        self.assertIn(reverse('chatapp:conversation', args=['1on1', self.bob.id]), urls)
+        self.assertIn(reverse('chatapp:conversation', args=['group', self.group.id]), urls)
+
+        url = reverse('chatapp:conversation', args=['1on1', self.bob.id])
+        xhr = {'X-Requested-With': 'XMLHttpRequest'}
+        first = self.client.get(url, headers=xhr)
+        self.assertEqual(first.status_code, 200)
+        data = first.json()
+        self.assertEqual((data['chat_type'], data['chat_id']), ('1on1', self.bob.id))
+        self.assertEqual(len(data['messages']), 5)
+        self.assertIn('header', data)
+
+        again = self.client.get(url, headers=dict(xhr, **{'If-None-Match': first['ETag']}))
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again['ETag'], first['ETag'])
+
+        Message.objects.create(sender=self.bob, receiver=self.alice, content='news')
+        changed = self.client.get(url, headers=dict(xhr, **{'If-None-Match': first['ETag']}))
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()['messages'][-1]['content'], 'news')
@@ -0,0 +1,61 @@
+# chatapp/tests/test_db_routers.py
+
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from chatapp import db_routers
+from chatapp.db_routers import (
+    ReplicaRouter, amark_write, areplica_reads, mark_write, replica_reads,
+)
+
+@override_settings(DATABASE_REPLICA_PIN_SECONDS=5)
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        # Only the alias is looked at; no connection to it is opened
+        patcher = mock.patch.dict(settings.DATABASES, replica=settings.DATABASES['default'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        db_routers._local_pins.clear()
+        self.router = ReplicaRouter()
+
+    def test_reads_use_the_replica_only_inside_the_block(self):
+        self.assertEqual(self.router.db_for_read(None), 'default')
+        with replica_reads(7) as enabled:
+            self.assertTrue(enabled)
+            self.assertEqual(self.router.db_for_read(None), 'replica')
+            self.assertEqual(self.router.db_for_write(None), 'default')
+        self.assertEqual(self.router.db_for_read(None), 'default')
+
+    def test_no_replica_configured(self):
+        del settings.DATABASES['replica']
+        with replica_reads(7) as enabled:
+            self.assertFalse(enabled)
+            self.assertEqual(self.router.db_for_read(None), 'default')
+
+    def test_a_writer_reads_its_writes_from_the_primary(self):
+        mark_write(7)
+        with replica_reads(7) as enabled:
+            self.assertFalse(enabled)
+        with replica_reads(8) as enabled:
+            self.assertTrue(enabled)
+
+    async def test_pins_set_elsewhere_come_from_the_shared_cache(self):
+        # Another process pinned user 7
+        await cache.aset('db:pin:7', 1, 5)
+        async with areplica_reads(7) as enabled:
+            self.assertFalse(enabled)
+
+    async def test_a_burst_of_writes_sets_the_shared_pin_once(self):
+        with mock.patch.object(db_routers.cache, 'aset', wraps=cache.aset) as aset:
+            for _ in range(5):
+                await amark_write(7)
+        self.assertEqual(aset.call_count, 1)
+        self.assertIsNotNone(await cache.aget('db:pin:7'))
+        with mock.patch.object(db_routers.cache, 'aget') as aget:
+            async with areplica_reads(7) as enabled:
+                self.assertFalse(enabled)
+        aget.assert_not_called()
@@ -0,0 +1,116 @@
+# chatapp/tests/test_execution_cache.py
+
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from chatapp import code_executor, execution_cache
+from chatapp.execution_cache import ExecutionCache, make_key
+from chatapp.models import WorkspaceNode
+
+from .helpers import TEST_SETTINGS, make_chat_users
+
+
+class ExecutionCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_memory_and_disk_hits(self):
+        cache = ExecutionCache(directory=self.directory)
+        cache.set('k', 'out')
+        self.assertEqual(cache.get('k'), 'out')
+        # A new process only has the disk tier
+        self.assertEqual(ExecutionCache(directory=self.directory).get('k'), 'out')
+        self.assertIsNone(cache.get('other'))
+
+    def test_entries_expire(self):
+        cache = ExecutionCache(ttl=10, directory=self.directory)
+        with mock.patch('chatapp.execution_cache.time.time', return_value=1000):
+            cache.set('k', 'out')
+        with mock.patch('chatapp.execution_cache.time.time', return_value=1011):
+            self.assertIsNone(cache.get('k'))
+
+    def test_disk_hit_keeps_its_remaining_ttl(self):
+        with mock.patch('chatapp.execution_cache.time.time', return_value=1000):
+            ExecutionCache(ttl=10, directory=self.directory).set('k', 'out')
+        fresh = ExecutionCache(ttl=10, directory=self.directory)
+        with mock.patch('chatapp.execution_cache.time.time', return_value=1008):
+            self.assertEqual(fresh.get('k'), 'out')
+        # Promoted to memory, but not with a new full TTL
+        with mock.patch('chatapp.execution_cache.time.time', return_value=1012):
+            self.assertIsNone(fresh.get('k'))
+
+    def test_least_recently_used_entries_go_first(self):
+        cache = ExecutionCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+
+    def test_key_covers_code_and_input_files(self):
+        self.assertEqual(make_key('x', {'a.py': '1'}), make_key('x', {'a.py': '1'}))
+        self.assertNotEqual(make_key('x', {'a.py': '1'}), make_key('x', {'a.py': '2'}))
+        self.assertNotEqual(make_key('x'), make_key('y'))
+
+
+class CachedExecutionTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        overrides = override_settings(CODE_EXECUTION_CACHE_ENABLED=True, CODE_EXECUTION_CACHE_DIR=directory)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        execution_cache._cache = None
+        self.addCleanup(setattr, execution_cache, '_cache', None)
+
+    def test_repeat_run_is_served_from_the_cache(self):
+        self.assertEqual(code_executor.execute_python_code('print(6 * 7)'), ('42\n', False))
+        with mock.patch.object(code_executor, '_run_python') as run:
+            self.assertEqual(code_executor.execute_python_code('print(6 * 7)'), ('42\n', True))
+        run.assert_not_called()
+
+    def test_timeouts_are_not_cached(self):
+        timeout = f"Error: Execution timed out (limit: {code_executor.EXECUTION_TIMEOUT} seconds)."
+        with mock.patch.object(code_executor, '_run_python', return_value=timeout) as run:
+            code_executor.execute_python_code('while True: pass')
+            code_executor.execute_python_code('while True: pass')
+        self.assertEqual(run.call_count, 2)
+
+    def test_opting_out_skips_the_cache(self):
+        code_executor.execute_python_code('print(1)')
+        self.assertEqual(code_executor.execute_python_code('print(1)', use_cache=False), ('1\n', False))
+
+
+class WorkspaceCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        overrides = override_settings(
+            **TEST_SETTINGS, WORKSPACE_SCRATCH_ROOT=f'{directory}/scratch',
+            CODE_EXECUTION_CACHE_ENABLED=True, CODE_EXECUTION_CACHE_DIR=f'{directory}/cache',
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        execution_cache._cache = None
+        self.addCleanup(setattr, execution_cache, '_cache', None)
+        self.alice, _, _ = make_chat_users(messages=0)
+
+    def node(self, name, content):
+        return WorkspaceNode.objects.create(
+            workspace_key='chat_1_2', name=name, created_by=self.alice, content=content,
+            node_type=WorkspaceNode.NodeType.FILE,
+        )
+
+    def test_sibling_module_change_misses_the_cache(self):
+        helper = self.node('helper.py', 'X = 1\n')
+        main = self.node('main.py', 'from helper import X\nprint(X)\n')
+        self.assertEqual(code_executor.execute_workspace('chat_1_2', main.id), ('1\n', False))
+        self.assertEqual(code_executor.execute_workspace('chat_1_2', main.id), ('1\n', True))
+        helper.content = 'X = 2\n'
+        helper.save()
+        self.assertEqual(code_executor.execute_workspace('chat_1_2', main.id), ('2\n', False))
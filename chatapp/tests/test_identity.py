@@ -0,0 +1,54 @@
+# chatapp/tests/test_identity.py
+
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from chatapp.identity import _version_key, aget_identity, get_identity, identity_cache
+from chatapp.models import Profile
+from chatapp.query_budget import assert_max_queries
+
+from .helpers import TEST_SETTINGS, make_chat_users
+
+
+@override_settings(**TEST_SETTINGS)
+class IdentityCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        with identity_cache._lock:
+            identity_cache._entries.clear()
+        self.alice, self.bob, self.group = make_chat_users(messages=0)
+
+    def test_hits_need_no_query(self):
+        self.assertEqual(get_identity(self.alice.id)['username'], 'alice')
+        with assert_max_queries(0, 'identity hit'):
+            self.assertEqual(get_identity(self.alice.id)['username'], 'alice')
+
+    def test_profile_save_reloads_the_identity(self):
+        get_identity(self.alice.id)
+        self.alice.profile.display_name = 'Alice A.'
+        self.alice.profile.save()
+        self.assertEqual(get_identity(self.alice.id)['display_name'], 'Alice A.')
+
+    def test_version_bump_from_another_process_is_seen_after_the_interval(self):
+        get_identity(self.alice.id)
+        # Another worker renamed alice: only the shared version changed here
+        Profile.objects.filter(user=self.alice).update(display_name='Renamed')
+        cache.set(_version_key(self.alice.id), 99, None)
+        self.assertEqual(get_identity(self.alice.id)['display_name'], 'alice')
+        with mock.patch.object(identity_cache, 'check_interval', 0):
+            self.assertEqual(get_identity(self.alice.id)['display_name'], 'Renamed')
+
+    def test_async_hit_stays_on_the_event_loop(self):
+        get_identity(self.alice.id)
+        with mock.patch.object(identity_cache, 'get') as get, mock.patch.object(cache, 'aget') as aget:
+            identity = async_to_sync(aget_identity)(self.alice.id)
+        self.assertEqual(identity['username'], 'alice')
+        get.assert_not_called()
+        aget.assert_not_called()
+
+    def test_async_miss_loads_through_get(self):
+        self.assertEqual(async_to_sync(aget_identity)(self.bob.id)['username'], 'bob')
+        self.assertIn(self.bob.id, identity_cache._entries)
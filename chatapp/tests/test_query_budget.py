@@ -0,0 +1,116 @@
+# chatapp/tests/test_query_budget.py
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from chatapp.models import GroupMessage, Message
+from chatapp.query_budget import assert_max_queries, assert_within_budgets, capture_query_stats
+from chatapp.routing import websocket_urlpatterns
+
+from .helpers import TEST_SETTINGS, make_chat_users
+
+
+@override_settings(**TEST_SETTINGS)
+class HttpQueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.group = make_chat_users()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.alice)
+
+    def get_ok(self, url, **extra):
+        response = self.client.get(url, **extra)
+        self.assertIn(response.status_code, (200, 304))
+        return response
+
+    def test_dashboard_pages_cold_and_warm(self):
+        urls = [
+            reverse('chatapp:dashboard'),
+            reverse('chatapp:dashboard_chat', args=[self.bob.id]),
+            reverse('chatapp:dashboard_group_chat', args=[self.group.id]),
+        ]
+        with capture_query_stats() as records:
+            for url in urls:
+                self.get_ok(url)
+                self.get_ok(url)
+        labels = {stats.label for stats in records}
+        self.assertTrue({
+            'http:chatapp:dashboard', 'http:chatapp:dashboard_chat', 'http:chatapp:dashboard_group_chat',
+        } <= labels)
+        assert_within_budgets(records)
+
+    def test_dashboard_after_new_message(self):
+        url = reverse('chatapp:dashboard')
+        self.get_ok(url)
+        Message.objects.create(sender=self.bob, receiver=self.alice, content='fresh')
+        with capture_query_stats() as records:
+            self.assertContains(self.get_ok(url), 'fresh')
+        assert_within_budgets(records)
+
+    def test_conversation_switch(self):
+        for chat_type, chat_id in (('1on1', self.bob.id), ('group', self.group.id)):
+            url = reverse('chatapp:conversation', args=[chat_type, chat_id])
+            with capture_query_stats() as records:
+                first = self.get_ok(url)
+                self.get_ok(url, HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual([stats.label for stats in records], ['http:chatapp:conversation'] * 2)
+            assert_within_budgets(records)
+
+    def test_message_write_costs_insert_and_pointer(self):
+        # The INSERT plus the conversation's last-message upsert (activity.py)
+        with assert_max_queries(2, 'direct message'):
+            Message.objects.create(sender=self.alice, receiver=self.bob, content='hi')
+        with assert_max_queries(2, 'group message'):
+            GroupMessage.objects.create(group=self.group, sender=self.alice, content='hi all')
+
+
+@override_settings(**TEST_SETTINGS)
+class WebSocketQueryBudgetTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob, self.group = make_chat_users()
+        self.application = URLRouter(websocket_urlpatterns)
+
+    async def connect(self, path, user):
+        communicator = WebsocketCommunicator(self.application, path)
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def exchange(self, communicator):
+        # Send one message, then delete it; each echo is broadcast back to us
+        await communicator.send_json_to({'type': 'chat_message', 'message': 'hello'})
+        sent = await communicator.receive_json_from(timeout=5)
+        self.assertEqual(sent['type'], 'chat_message')
+        await communicator.send_json_to({'type': 'delete_message', 'message_id': sent['message_id']})
+        deleted = await communicator.receive_json_from(timeout=5)
+        self.assertEqual(deleted['type'], 'message_deleted')
+
+    async def test_chat_frames(self):
+        with capture_query_stats() as records:
+            communicator = await self.connect(f'/ws/chat/{self.bob.id}/', self.alice)
+            await self.exchange(communicator)
+            await communicator.disconnect()
+        labels = {stats.label for stats in records}
+        self.assertTrue({
+            'ws:ChatConsumer:connect', 'ws:ChatConsumer:chat_message', 'ws:ChatConsumer:delete_message',
+        } <= labels)
+        assert_within_budgets(records)
+
+    async def test_group_chat_frames(self):
+        with capture_query_stats() as records:
+            communicator = await self.connect(f'/ws/group/{self.group.id}/', self.alice)
+            await self.exchange(communicator)
+            await communicator.disconnect()
+        labels = {stats.label for stats in records}
+        self.assertTrue({
+            'ws:GroupChatConsumer:connect', 'ws:GroupChatConsumer:chat_message',
+            'ws:GroupChatConsumer:delete_message',
+        } <= labels)
+        assert_within_budgets(records)
@@ -0,0 +1,83 @@
+# chatapp/tests/test_rendering.py
+
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from chatapp import metrics, rendering
+from chatapp.models import GroupMessage, Message
+from chatapp.rendering import RENDER_VERSION, deleted_body, prepare_bodies, rerender_messages, store_body
+
+from .helpers import make_chat_users, use_temp_media
+
+
+class RenderingTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        self.alice, self.bob, self.group = make_chat_users(messages=0)
+
+    def direct(self, content):
+        return Message.objects.create(sender=self.alice, receiver=self.bob, content=content)
+
+    def test_bodies_are_rendered_on_write(self):
+        message = self.direct('<b>hi</b>')
+        message.refresh_from_db()
+        self.assertEqual(message.render_version, RENDER_VERSION)
+        self.assertEqual(message.rendered_html, '<p>&lt;b&gt;hi&lt;/b&gt;</p>')
+
+    def test_attachment_links_are_rendered_after_insert(self):
+        message = Message.objects.create(sender=self.alice, receiver=self.bob, content='', file='chat_attachments/a.txt')
+        message.refresh_from_db()
+        self.assertEqual(message.render_version, RENDER_VERSION)
+        self.assertIn(f'/1on1/{message.pk}/', message.rendered_html)
+
+    def test_store_body_after_update(self):
+        message = self.direct('old')
+        Message.objects.filter(pk=message.pk).update(content='new')
+        message.content = 'new'
+        store_body(message)
+        self.assertEqual(Message.objects.get(pk=message.pk).rendered_html, '<p>new</p>')
+
+    def test_store_body_does_not_undo_a_delete(self):
+        message = self.direct('secret')
+        Message.objects.filter(pk=message.pk).update(
+            is_deleted=True, content='This message was deleted.',
+            rendered_html=deleted_body(), render_version=RENDER_VERSION,
+        )
+        store_body(message)  # A stale copy that still has the old content
+        self.assertNotIn('secret', Message.objects.get(pk=message.pk).rendered_html)
+
+    def test_stale_read_serves_current_body_and_stores_it(self):
+        message = self.direct('hello')
+        Message.objects.filter(pk=message.pk).update(rendered_html='<p>old renderer</p>', render_version=0)
+        before = metrics.get('rendering.stale_reads')
+        page = prepare_bodies(list(Message.objects.filter(pk=message.pk)))
+        self.assertEqual(page[0].body_html, '<p>hello</p>')
+        self.assertEqual(metrics.get('rendering.stale_reads'), before + 1)
+        message.refresh_from_db()
+        self.assertEqual((message.render_version, message.rendered_html), (RENDER_VERSION, '<p>hello</p>'))
+
+    def test_current_bodies_are_served_as_stored(self):
+        self.direct('hello')
+        before = metrics.get('rendering.stale_reads')
+        with mock.patch.object(rendering, 'render_body') as render:
+            page = prepare_bodies(list(Message.objects.all()))
+        render.assert_not_called()
+        self.assertEqual(page[0].body_html, '<p>hello</p>')
+        self.assertEqual(metrics.get('rendering.stale_reads'), before)
+
+    def test_rerender_skips_current_messages(self):
+        stale, current = self.direct('a'), self.direct('b')
+        Message.objects.filter(pk=stale.pk).update(render_version=0)
+        self.assertEqual(rerender_messages('message', [stale.pk, current.pk]), 1)
+
+    def test_version_bump_is_applied_by_the_command(self):
+        self.direct('a')
+        GroupMessage.objects.create(group=self.group, sender=self.bob, content='b')
+        with mock.patch.object(rendering, 'RENDER_VERSION', RENDER_VERSION + 1), \
+                mock.patch('chatapp.management.commands.rerender_messages.RENDER_VERSION', RENDER_VERSION + 1):
+            call_command('rerender_messages', batch_size=1, stdout=StringIO())
+        self.assertEqual(set(Message.objects.values_list('render_version', flat=True)), {RENDER_VERSION + 1})
+        self.assertEqual(set(GroupMessage.objects.values_list('render_version', flat=True)), {RENDER_VERSION + 1})
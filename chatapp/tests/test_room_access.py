@@ -0,0 +1,60 @@
+# chatapp/tests/test_room_access.py
+
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from chatapp import room_access
+from chatapp.query_budget import assert_max_queries
+from chatapp.room_access import acan_access, can_access
+from chatapp.rooms import direct_room_key, group_room_key
+
+from .helpers import TEST_SETTINGS, make_chat_users
+
+
+@override_settings(**TEST_SETTINGS)
+class RoomAccessTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        room_access._local_grants.clear()
+        self.alice, self.bob, self.group = make_chat_users(messages=0)
+        self.direct = direct_room_key(self.alice.id, self.bob.id)
+        self.team = group_room_key(self.group.id)
+
+    def test_answers_are_cached(self):
+        self.assertTrue(can_access(self.alice.id, self.direct))
+        with assert_max_queries(0, 'cached access'):
+            self.assertTrue(can_access(self.alice.id, self.direct))
+
+    def test_outsiders_are_refused(self):
+        carol = User.objects.create_user('carol', 'carol@example.com', 'pw')
+        self.assertFalse(can_access(carol.id, self.direct))
+        self.assertFalse(can_access(carol.id, self.team))
+
+    def test_removing_a_contact_revokes_access(self):
+        self.assertTrue(can_access(self.alice.id, self.direct))
+        self.alice.profile.contacts.remove(self.bob.profile)
+        self.assertFalse(can_access(self.alice.id, self.direct))
+        # bob's own list still has alice
+        self.assertTrue(can_access(self.bob.id, self.direct))
+
+    def test_leaving_a_group_revokes_access(self):
+        self.assertTrue(can_access(self.bob.id, self.team))
+        self.group.members.remove(self.bob)
+        self.assertFalse(can_access(self.bob.id, self.team))
+        self.group.members.add(self.bob)
+        self.assertTrue(can_access(self.bob.id, self.team))
+
+    def test_recent_grant_answers_without_a_thread_hop(self):
+        self.assertTrue(async_to_sync(acan_access)(self.bob.id, self.team))
+        with mock.patch.object(room_access, 'can_access') as sync_check:
+            self.assertTrue(async_to_sync(acan_access)(self.bob.id, self.team))
+        sync_check.assert_not_called()
+
+    def test_revoke_in_this_process_drops_the_local_grant(self):
+        self.assertTrue(async_to_sync(acan_access)(self.bob.id, self.team))
+        self.group.members.remove(self.bob)
+        self.assertFalse(async_to_sync(acan_access)(self.bob.id, self.team))
@@ -0,0 +1,63 @@
+# chatapp/tests/test_thumbnails.py
+
+from io import BytesIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.test import TestCase
+from PIL import Image
+
+from chatapp import thumbnails
+from chatapp.models import Message, Profile
+
+from .helpers import make_chat_users, use_temp_media
+
+
+def png_bytes(size=(400, 300)):
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 40, 40)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class ThumbnailTestCase(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        self.alice, self.bob, self.group = make_chat_users(messages=0)
+
+
+class AvatarThumbnailTests(ThumbnailTestCase):
+    def test_default_picture_is_not_thumbnailed(self):
+        with mock.patch.object(thumbnails, 'submit_on_commit') as queue:
+            User.objects.create_user('carol', 'carol@example.com', 'pw')
+        queue.assert_not_called()
+
+    def test_uploaded_picture_gets_variants(self):
+        profile = self.alice.profile
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.profile_picture.save('me.png', ContentFile(png_bytes()))
+        profile = Profile.objects.get(pk=profile.pk)
+        self.assertEqual(profile.thumbnails['source'], profile.profile_picture.name)
+        self.assertEqual(profile.thumbnails['md']['width'], 160)
+        self.assertFalse(thumbnails.needs_avatar_variants(profile))
+
+
+class AttachmentThumbnailTests(ThumbnailTestCase):
+    def test_image_attachment_gets_variants_in_its_body(self):
+        message = Message(sender=self.alice, receiver=self.bob, content='', content_type='image/png')
+        message.file.save('photo.png', ContentFile(png_bytes((1600, 1200))), save=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            message.save()
+            thumbnails.queue_attachment_thumbnails(message)
+        message.refresh_from_db()
+        self.assertEqual(set(message.thumbnails), {'md', 'lg'})
+        self.assertEqual(message.thumbnails['md']['width'], 320)
+        self.assertIn('?variant=md', message.rendered_html)
+
+    def test_unreadable_image_is_marked_failed(self):
+        message = Message(sender=self.alice, receiver=self.bob, content='', content_type='image/png')
+        message.file.save('broken.png', ContentFile(b'not a png'), save=False)
+        message.save()
+        thumbnails.thumbnail_attachment('message', message.id)
+        message.refresh_from_db()
+        self.assertEqual(message.thumbnails, {'failed': True})
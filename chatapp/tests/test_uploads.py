@@ -0,0 +1,111 @@
+# chatapp/tests/test_uploads.py
+
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+
+from chatapp import uploads
+from chatapp.models import Message, UploadSession
+
+from .helpers import make_chat_users, use_temp_media
+
+CHUNK = 1000
+
+
+class UploadTestCase(TestCase):
+    def setUp(self):
+        use_temp_media(self, ATTACHMENT_CHUNK_SIZE=CHUNK)
+        self.alice, self.bob, self.group = make_chat_users(messages=0)
+        self.client.force_login(self.alice)
+
+    def start(self, size):
+        response = self.client.post(
+            reverse('chatapp:start_attachment_upload', args=['1on1', self.bob.id]),
+            {'file_name': 'notes.txt', 'size': size, 'content_type': 'text/plain'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def complete(self, state, parts=()):
+        return self.client.post(state['complete_url'], {'parts': list(parts)}, content_type='application/json')
+
+
+class ChunkedUploadTests(UploadTestCase):
+    def put(self, state, offset, data):
+        return self.client.put(state['chunk_url'], data, content_type='application/octet-stream',
+                               headers={'Upload-Offset': str(offset)})
+
+    def test_chunks_resume_from_the_acknowledged_offset(self):
+        body = b'x' * 2500
+        state = self.start(len(body))
+        self.assertEqual(state['offset'], 0)
+        self.assertEqual(self.put(state, 0, body[:CHUNK]).json(), {'offset': CHUNK})
+        # A repeated chunk is told where to resume
+        repeated = self.put(state, 0, body[:CHUNK])
+        self.assertEqual(repeated.status_code, 409)
+        self.assertEqual(repeated.json()['offset'], CHUNK)
+        self.assertEqual(self.client.get(state['status_url']).json()['offset'], CHUNK)
+        self.put(state, CHUNK, body[CHUNK:2 * CHUNK])
+        self.put(state, 2 * CHUNK, body[2 * CHUNK:])
+
+        self.assertEqual(self.complete(state).status_code, 200)
+        message = Message.objects.get()
+        self.assertEqual(message.file.read(), body)
+        self.assertEqual(UploadSession.objects.get().status, UploadSession.Status.COMPLETED)
+
+    def test_incomplete_upload_stays_resumable(self):
+        state = self.start(2500)
+        self.put(state, 0, b'x' * CHUNK)
+        response = self.complete(state)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(UploadSession.objects.get().status, UploadSession.Status.PENDING)
+        self.assertFalse(Message.objects.exists())
+
+    def test_aborted_upload_takes_no_more_chunks(self):
+        state = self.start(2500)
+        self.assertEqual(self.client.post(state['abort_url']).status_code, 200)
+        self.assertEqual(self.put(state, 0, b'x' * CHUNK).status_code, 404)
+        self.assertEqual(self.complete(state).status_code, 404)
+
+
+class MultipartUploadTests(UploadTestCase):
+    def setUp(self):
+        super().setUp()
+        self.s3 = mock.MagicMock()
+        self.s3.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+        for patcher in (
+            mock.patch.object(uploads, '_s3', return_value=(self.s3, 'bucket')),
+            mock.patch.object(uploads, '_s3_key', side_effect=lambda name, storage=None: name),
+            mock.patch.object(uploads, 'presign_parts', return_value=[]),
+            mock.patch.object(uploads, 'uploaded_parts', return_value={}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.parts = [{'part_number': 1, 'etag': '"a"'}]
+
+    def test_failed_completion_stays_resumable(self):
+        state = self.start(2500)
+        self.s3.complete_multipart_upload.side_effect = RuntimeError('bucket unavailable')
+        with self.assertRaises(RuntimeError):
+            self.complete(state, self.parts)
+        self.assertEqual(UploadSession.objects.get().status, UploadSession.Status.PENDING)
+
+    def test_size_mismatch_after_completion_aborts(self):
+        state = self.start(2500)
+        self.s3.head_object.return_value = {'ContentLength': 2000}
+        self.assertEqual(self.complete(state, self.parts).status_code, 409)
+        self.s3.delete_object.assert_called_once()
+        self.assertEqual(UploadSession.objects.get().status, UploadSession.Status.ABORTED)
+        # The multipart upload id is spent: no retry that would hit NoSuchUpload
+        self.assertEqual(self.complete(state, self.parts).status_code, 404)
+        self.assertEqual(self.s3.complete_multipart_upload.call_count, 1)
+
+    def test_unverifiable_object_aborts(self):
+        state = self.start(2500)
+        self.s3.head_object.side_effect = RuntimeError('timeout')
+        self.assertEqual(self.complete(state, self.parts).status_code, 502)
+        self.s3.delete_object.assert_called_once()
+        self.assertEqual(UploadSession.objects.get().status, UploadSession.Status.ABORTED)
+        self.assertFalse(Message.objects.exists())
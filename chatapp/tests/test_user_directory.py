@@ -0,0 +1,78 @@
+# chatapp/tests/test_user_directory.py
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from chatapp.query_budget import assert_max_queries
+from chatapp.user_directory import search_directory
+
+from .helpers import TEST_SETTINGS, make_chat_users
+
+
+@override_settings(**TEST_SETTINGS)
+class SearchDirectoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob, self.group = make_chat_users(messages=0)
+
+    def user(self, username, contact=False):
+        user = User.objects.create_user(username, f'{username}@example.org', 'pw')
+        if contact:
+            self.alice.profile.contacts.add(user.profile)
+        return user
+
+    def usernames(self, query, **kwargs):
+        results, _ = search_directory(self.alice.id, query, **kwargs)
+        return [result['username'] for result in results]
+
+    @override_settings(USER_SEARCH_CANDIDATES=3)
+    def test_candidate_cap_keeps_the_best_matches(self):
+        for n in range(5):
+            self.user(f'zz_sam_{n}')
+        self.user('samantha')
+        self.user('sam')
+        self.assertEqual(self.usernames('sam')[:2], ['sam', 'samantha'])
+
+    def test_contacts_outrank_equally_good_strangers(self):
+        self.user('samuel')
+        self.user('samira', contact=True)
+        results, _ = search_directory(self.alice.id, 'sam')
+        self.assertEqual([r['username'] for r in results], ['samira', 'samuel'])
+        self.assertEqual([r['is_contact'] for r in results], [True, False])
+
+    @override_settings(USER_SEARCH_CANDIDATES=2)
+    def test_contacts_and_co_members_beyond_the_cap_are_found(self):
+        for n in range(4):
+            self.user(f'sam{n}')
+        self.user('old_sam_friend', contact=True)
+        teammate = self.user('team_sam')
+        self.group.members.add(teammate)
+        found = self.usernames('sam')
+        self.assertIn('old_sam_friend', found)
+        self.assertIn('team_sam', found)
+
+    def test_viewer_is_never_a_result(self):
+        self.assertNotIn('alice', self.usernames('alice'))
+
+    def test_cursor_pages_cover_every_match_once(self):
+        for n in range(7):
+            self.user(f'kim{n}', contact=n % 3 == 0)
+        everything = self.usernames('kim', limit=50)
+        pages, cursor = [], None
+        while True:
+            results, cursor = search_directory(self.alice.id, 'kim', cursor=cursor, limit=3)
+            pages.extend(result['username'] for result in results)
+            if cursor is None:
+                break
+        self.assertEqual(len(everything), 7)
+        self.assertEqual(pages, everything)
+
+    def test_search_view_stays_within_budget(self):
+        self.user('samuel')
+        self.client.force_login(self.alice)
+        with assert_max_queries(6, 'search_users'):
+            response = self.client.get(reverse('chatapp:search_users'), {'q': 'sam'},
+                                       headers={'X-Requested-With': 'XMLHttpRequest'})
+        self.assertEqual([r['username'] for r in response.json()['results']], ['samuel'])
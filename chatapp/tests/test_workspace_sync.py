@@ -0,0 +1,80 @@
+# chatapp/tests/test_workspace_sync.py
+
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from chatapp.code_executor import execute_workspace, sync_workspace
+from chatapp.models import WorkspaceNode
+from chatapp.query_budget import assert_max_queries
+
+from .helpers import TEST_SETTINGS, make_chat_users
+
+WORKSPACE = 'chat_1_2'
+
+
+class WorkspaceSyncTests(TestCase):
+    def setUp(self):
+        scratch_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, scratch_root, ignore_errors=True)
+        overrides = override_settings(**TEST_SETTINGS, WORKSPACE_SCRATCH_ROOT=scratch_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.alice, self.bob, self.group = make_chat_users(messages=0)
+
+    def node(self, name, content='', parent=None, folder=False):
+        return WorkspaceNode.objects.create(
+            workspace_key=WORKSPACE, name=name, parent=parent, created_by=self.alice, content=content,
+            node_type=WorkspaceNode.NodeType.FOLDER if folder else WorkspaceNode.NodeType.FILE,
+        )
+
+    def test_tree_is_materialized_with_paths(self):
+        lib = self.node('lib', folder=True)
+        helper = self.node('helper.py', 'X = 1\n', parent=lib)
+        main = self.node('main.py', 'print(1)\n')
+        scratch_dir, paths = sync_workspace(WORKSPACE)
+        self.assertEqual(paths, {lib.id: 'lib', helper.id: 'lib/helper.py', main.id: 'main.py'})
+        self.assertEqual((scratch_dir / 'lib/helper.py').read_text(), 'X = 1\n')
+
+    def test_unchanged_tree_costs_one_query(self):
+        self.node('main.py', 'print(1)\n')
+        sync_workspace(WORKSPACE)
+        with assert_max_queries(1, 'unchanged sync'):
+            sync_workspace(WORKSPACE)
+
+    def test_edits_and_deletes_reach_the_scratch_dir(self):
+        main = self.node('main.py', 'print(1)\n')
+        old = self.node('old.py', 'pass\n')
+        scratch_dir, _ = sync_workspace(WORKSPACE)
+        main.content = 'print(2)\n'
+        main.save()
+        old.delete()
+        sync_workspace(WORKSPACE)
+        self.assertEqual((scratch_dir / 'main.py').read_text(), 'print(2)\n')
+        self.assertFalse((scratch_dir / 'old.py').exists())
+
+    def test_names_that_escape_the_scratch_dir_are_dropped(self):
+        self.node('..', 'evil')
+        bad_folder = self.node('a/b', folder=True)
+        inside = self.node('x.py', 'pass\n', parent=bad_folder)
+        _, paths = sync_workspace(WORKSPACE)
+        self.assertNotIn(inside.id, paths)
+        self.assertEqual(paths, {})
+
+    def test_entry_file_imports_its_siblings(self):
+        lib = self.node('lib', folder=True)
+        self.node('__init__.py', '', parent=lib)
+        self.node('greet.py', 'def hello():\n    return "hi from lib"\n', parent=lib)
+        main = self.node('main.py', 'from lib.greet import hello\nprint(hello())\n')
+        output, cached = execute_workspace(WORKSPACE, main.id, use_cache=False)
+        self.assertEqual(output.strip(), 'hi from lib')
+        self.assertFalse(cached)
+
+    def test_editor_content_overrides_the_stored_file(self):
+        main = self.node('main.py', 'print("stored")\n')
+        output, _ = execute_workspace(WORKSPACE, main.id, code='print("unsaved")\n', use_cache=False)
+        self.assertEqual(output.strip(), 'unsaved')
+        # The next plain run goes back to the database copy
+        output, _ = execute_workspace(WORKSPACE, main.id, use_cache=False)
+        self.assertEqual(output.strip(), 'stored')
@@ -0,0 +1,194 @@
+# chatapp/thumbnails.py
+
+import os
+import time
+from io import BytesIO
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import OperationalError
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from . import metrics
+from .background import submit_on_commit
+from .conversations import touch_conversation, message_room_key
+from .fragments import touch_contact_sidebars
+from .identity import invalidate_identity
+from .models import Message, GroupMessage, Profile
+from .rendering import store_body
+from .storage import file_urls
+
+ATTACHMENT_MODELS = {'message': Message, 'groupmessage': GroupMessage}
+
+# Tries (and the first back-off, doubled each time) for a variant save that
+# finds SQLite locked
+SAVE_ATTEMPTS = 5
+SAVE_RETRY_DELAY = 0.05
+
+
+def variant_name(name, label):
+    """Variants live next to the original: photo.jpg -> photo__md.webp"""
+    stem, _ = os.path.splitext(name)
+    return f'{stem}__{label}.webp'
+
+
+def render_variants(field_file, sizes):
+    """
+    Re-encode `field_file` as WEBP at every {label: longest edge} in
+    `sizes` (never upscaling) and store each next to the original.
+    Returns {label: {name, width, height}}.
+    """
+    with field_file.open('rb') as source:
+        image = Image.open(source)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if image.mode in ('LA', 'PA') or 'transparency' in image.info else 'RGB')
+
+    variants = {}
+    for label, edge in sizes.items():
+        resized = image.copy()
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        buffer = BytesIO()
+        resized.save(buffer, 'WEBP', quality=settings.THUMBNAIL_QUALITY, method=4)
+        name = field_file.storage.save(variant_name(field_file.name, label), ContentFile(buffer.getvalue()))
+        variants[label] = {'name': name, 'width': resized.width, 'height': resized.height}
+    metrics.incr('thumbnails.generated', len(variants))
+    return variants
+
+
+def variant(instance, label):
+    """{name, width, height} of a ready variant of a message attachment or avatar, else None."""
+    thumbnails = instance.thumbnails or {}
+    if isinstance(instance, Profile) and thumbnails.get('source') != instance.profile_picture.name:
+        # The picture changed since these were made
+        return None
+    found = thumbnails.get(label)
+    return found if isinstance(found, dict) else None
+
+
+def variant_urls(variants):
+    """{label: url} for a thumbnails dict, signed in one batch."""
+    labelled = {label: v['name'] for label, v in variants.items() if isinstance(v, dict)}
+    urls = file_urls(default_storage, labelled.values())
+    return {label: urls[name] for label, name in labelled.items()}
+
+
+def prefetch_variant_urls(instances, labels):
+    """Sign the given variants of a page's messages/profiles in one batch (see the thumbnail_url filter)."""
+    wanted = []
+    for instance in instances:
+        for label in labels:
+            found = variant(instance, label)
+            if found:
+                wanted.append((instance, label, found['name']))
+    urls = file_urls(default_storage, [name for _, _, name in wanted])
+    for instance, label, name in wanted:
+        if not hasattr(instance, '_variant_urls'):
+            instance._variant_urls = {}
+        instance._variant_urls[label] = urls.get(name)
+
+
+def save_variants(write):
+    """
+    Run `write` (the task's variant UPDATEs), retrying while SQLite reports
+    the database locked. A request's deferred read-then-write transaction
+    that overlaps ours fails at once instead of waiting out the busy
+    timeout; backing off here keeps the worker from losing its thumbnails
+    without making every request take the write lock at BEGIN.
+    """
+    delay = SAVE_RETRY_DELAY
+    for attempt in range(1, SAVE_ATTEMPTS + 1):
+        try:
+            return write()
+        except OperationalError as e:
+            if 'locked' not in str(e) or attempt == SAVE_ATTEMPTS:
+                raise
+            metrics.incr('thumbnails.save_retries')
+            time.sleep(delay)
+            delay *= 2
+
+
+def shared_thumbnails(blob_id):
+    """Variants already made for another message sharing the same stored file (chatapp/blobs.py)."""
+    if not blob_id:
+        return None
+    for model in ATTACHMENT_MODELS.values():
+        found = model.objects.filter(blob_id=blob_id).exclude(thumbnails={}).values_list('thumbnails', flat=True).first()
+        if found:
+            return found
+    return None
+
+
+def thumbnail_attachment(model_name, message_id, room_key=None):
+    """Background task: variants for one image attachment, then tell the room."""
+    model = ATTACHMENT_MODELS[model_name]
+    message = model.objects.filter(pk=message_id).defer('rendered_html').first()
+    if message is None or not message.file or message.thumbnails:
+        return
+    variants = shared_thumbnails(message.blob_id)
+    if variants is None:
+        try:
+            variants = render_variants(message.file, settings.THUMBNAIL_SIZES['attachment'])
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+            # Not an image we can read; mark it so the backlog command skips it
+            print(f"Could not thumbnail {model_name} {message_id}: {e}")
+            variants = {'failed': True}
+    save_variants(lambda: model.objects.filter(pk=message_id).update(thumbnails=variants))
+    if variants.get('failed'):
+        touch_conversation(room_key or message_room_key(message))
+        return
+    # The stored body gains its preview
+    message.thumbnails = variants
+    save_variants(lambda: store_body(message))
+    touch_conversation(room_key or message_room_key(message))
+
+    if room_key:
+        async_to_sync(get_channel_layer().group_send)(room_key, {
+            'type': 'attachment_thumbnails',
+            'message_id': message_id,
+            'thumbnails': {
+                label: dict(variants[label], url=url) for label, url in variant_urls(variants).items()
+            },
+        })
+
+
+def needs_avatar_variants(profile):
+    """An uploaded picture without variants; the field default is a placeholder served as is."""
+    picture = profile.profile_picture
+    if not picture or picture.name == Profile._meta.get_field('profile_picture').default:
+        return False
+    return (profile.thumbnails or {}).get('source') != picture.name
+
+
+def thumbnail_avatar(profile_id):
+    """Background task: avatar variants for one profile."""
+    profile = Profile.objects.filter(pk=profile_id).only('id', 'user_id', 'profile_picture', 'thumbnails').first()
+    if profile is None or not needs_avatar_variants(profile):
+        return
+    source = profile.profile_picture.name
+    try:
+        thumbnails = dict(render_variants(profile.profile_picture, settings.THUMBNAIL_SIZES['avatar']), source=source)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        print(f"Could not thumbnail avatar of profile {profile_id}: {e}")
+        thumbnails = {'source': source, 'failed': True}
+    # Only if the picture is still the one we rendered
+    save_variants(lambda: Profile.objects.filter(pk=profile_id, profile_picture=source).update(thumbnails=thumbnails))
+    invalidate_identity(profile.user_id)
+    touch_contact_sidebars(profile)
+
+
+def queue_attachment_thumbnails(message, room_key=None):
+    if message.file and (message.content_type or '').startswith('image/'):
+        submit_on_commit(thumbnail_attachment, message._meta.model_name, message.id, room_key)
+
+
+@receiver(post_save, sender=Profile)
+def queue_avatar_thumbnails(sender, instance, **kwargs):
+    if needs_avatar_variants(instance):
+        submit_on_commit(thumbnail_avatar, instance.pk)
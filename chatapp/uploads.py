@@ -0,0 +1,275 @@
+# chatapp/uploads.py
+
+import math
+import mimetypes
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils import timezone
+
+from .attachments import attachment_metadata
+from .blobs import adopt_blob, blob_name, store_blob
+from .models import UploadSession
+
+# S3 multipart limits: parts are at least 5 MB (except the last) and at most 10,000
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
+STREAM_BLOCK = 64 * 1024
+
+
+class UploadError(Exception):
+    """
+    Raised for an upload request that cannot be applied; carries an HTTP
+    status. `retryable` is False once the upload itself is spent (e.g. its
+    multipart upload was completed), so the session cannot be resumed.
+    """
+
+    def __init__(self, message, status=400, retryable=True):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+def _s3(storage=default_storage):
+    """(client, bucket name) when media goes to S3-compatible storage, else None."""
+    if not hasattr(storage, 'bucket_name') or not hasattr(storage, 'connection'):
+        return None
+    return storage.connection.meta.client, storage.bucket_name
+
+
+def _s3_key(name, storage=default_storage):
+    # Honours AWS_LOCATION the same way the storage itself does
+    return storage._normalize_name(name)
+
+
+def _partial_path(session):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{session.id}.part')
+
+
+def start_upload(user, chat_type, chat_id, file_name, total_size, content_type='', caption=''):
+    """
+    Create an UploadSession. Media on S3 gets a multipart upload the
+    browser fills directly; otherwise the file arrives in chunks.
+    """
+    if total_size <= 0:
+        raise UploadError("Empty file.")
+    if total_size > settings.ATTACHMENT_MAX_UPLOAD_SIZE:
+        raise UploadError("File is too large.", status=413)
+
+    file_name = os.path.basename(file_name.replace('\\', '/'))[:255] or 'attachment'
+    # A fresh directory per upload: no exists() round trip to pick a free name
+    storage_name = blob_name(file_name)
+    content_type = (content_type or mimetypes.guess_type(file_name)[0] or 'application/octet-stream')[:100]
+    session = UploadSession(
+        user=user, chat_type=chat_type, chat_id=chat_id, file_name=file_name,
+        content_type=content_type, caption=caption, total_size=total_size,
+        storage_name=storage_name,
+    )
+
+    s3 = _s3()
+    if s3:
+        client, bucket = s3
+        session.mode = UploadSession.Mode.MULTIPART
+        session.part_size = max(settings.ATTACHMENT_CHUNK_SIZE, MIN_PART_SIZE, math.ceil(total_size / MAX_PARTS))
+        session.multipart_upload_id = client.create_multipart_upload(
+            Bucket=bucket, Key=_s3_key(storage_name), ContentType=content_type,
+        )['UploadId']
+    else:
+        session.mode = UploadSession.Mode.CHUNKED
+        session.part_size = settings.ATTACHMENT_CHUNK_SIZE
+        os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+        open(_partial_path(session), 'wb').close()
+    session.save()
+    return session
+
+
+def part_count(session):
+    return math.ceil(session.total_size / session.part_size)
+
+
+def uploaded_parts(session):
+    """{part_number: etag} already stored for a multipart upload."""
+    client, bucket = _s3()
+    parts = {}
+    paginator = client.get_paginator('list_parts')
+    for page in paginator.paginate(Bucket=bucket, Key=_s3_key(session.storage_name), UploadId=session.multipart_upload_id):
+        for part in page.get('Parts', []):
+            parts[part['PartNumber']] = part['ETag']
+    return parts
+
+
+def presign_parts(session, part_numbers):
+    """[{part_number, url}] the browser PUTs each slice of the file to."""
+    client, bucket = _s3()
+    key = _s3_key(session.storage_name)
+    return [
+        {
+            'part_number': number,
+            'url': client.generate_presigned_url(
+                'upload_part',
+                Params={'Bucket': bucket, 'Key': key, 'UploadId': session.multipart_upload_id, 'PartNumber': number},
+                ExpiresIn=settings.AWS_QUERYSTRING_EXPIRE,
+            ),
+        }
+        for number in part_numbers
+    ]
+
+
+def upload_state(session):
+    """What a client needs to start or resume the upload."""
+    state = {
+        'upload_id': str(session.id),
+        'mode': session.mode,
+        'status': session.status,
+        'part_size': session.part_size,
+        'total_size': session.total_size,
+        'status_url': reverse('chatapp:attachment_upload', args=[session.id]),
+        'chunk_url': reverse('chatapp:attachment_upload_chunk', args=[session.id]),
+        'complete_url': reverse('chatapp:complete_attachment_upload', args=[session.id]),
+        'abort_url': reverse('chatapp:abort_attachment_upload', args=[session.id]),
+    }
+    if session.status != UploadSession.Status.PENDING:
+        return state
+    if session.mode == UploadSession.Mode.MULTIPART:
+        done = uploaded_parts(session)
+        state['completed_parts'] = [{'part_number': n, 'etag': etag} for n, etag in sorted(done.items())]
+        state['parts'] = presign_parts(session, [n for n in range(1, part_count(session) + 1) if n not in done])
+    else:
+        state['offset'] = session.received_bytes
+    return state
+
+
+def claim_upload(session, status, **fields):
+    """
+    Move `session` from the status it was read with to `status`, unless
+    another request already has. A single conditional UPDATE, so no row
+    lock is held across the storage and hashing work that follows; returns
+    False when the session had moved on.
+    """
+    claimed = UploadSession.objects.filter(pk=session.pk, status=session.status).update(
+        status=status, updated_at=timezone.now(), **fields
+    )
+    if claimed:
+        session.status = status
+        for name, value in fields.items():
+            setattr(session, name, value)
+    return bool(claimed)
+
+
+def append_chunk(session, offset, stream, length):
+    """
+    Write `length` bytes from `stream` at `offset` of a chunked upload,
+    streaming to disk. The offset must match what the server has; a
+    mismatch is a 409 telling the client where to resume.
+
+    The bytes are written without holding the session row: every chunk
+    lands at its own position, and only the compare-and-set on
+    received_bytes afterwards decides which of two requests racing for the
+    same offset gets acknowledged.
+    """
+    if offset != session.received_bytes:
+        raise UploadError(f"Expected offset {session.received_bytes}.", status=409)
+    if length <= 0 or length > settings.ATTACHMENT_CHUNK_SIZE * 2 or offset + length > session.total_size:
+        raise UploadError("Invalid chunk length.")
+
+    try:
+        with open(_partial_path(session), 'r+b') as partial:
+            # Anything past the acknowledged offset (an interrupted chunk) is
+            # simply overwritten; only acknowledged bytes are ever read back
+            partial.seek(offset)
+            remaining = length
+            while remaining:
+                block = stream.read(min(STREAM_BLOCK, remaining))
+                if not block:
+                    raise UploadError("Chunk ended early.", status=409)
+                partial.write(block)
+                remaining -= len(block)
+    except FileNotFoundError:
+        raise UploadError("Upload was aborted.", status=409)
+
+    acknowledged = UploadSession.objects.filter(
+        pk=session.pk, status=UploadSession.Status.PENDING, received_bytes=offset,
+    ).update(received_bytes=offset + length, updated_at=timezone.now())
+    if not acknowledged:
+        session.refresh_from_db(fields=['status', 'received_bytes'])
+        raise UploadError(f"Expected offset {session.received_bytes}.", status=409)
+    session.received_bytes = offset + length
+    return session.received_bytes
+
+
+class _PartialFile(File):
+    # FileSystemStorage moves files that expose temporary_file_path instead of copying them
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def complete_upload(session, parts=None):
+    """
+    Finalize the stored object. Returns (blob, attachment metadata);
+    content that is already stored is shared instead of kept twice.
+    """
+    if session.mode == UploadSession.Mode.MULTIPART:
+        client, bucket = _s3()
+        key = _s3_key(session.storage_name)
+        if not parts:
+            parts = [{'PartNumber': n, 'ETag': etag} for n, etag in sorted(uploaded_parts(session).items())]
+        client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=session.multipart_upload_id,
+            MultipartUpload={'Parts': sorted(parts, key=lambda part: part['PartNumber'])},
+        )
+        # The upload id is spent from here on: if the object can't be
+        # adopted, drop it; the client has to start a new upload
+        try:
+            size = client.head_object(Bucket=bucket, Key=key)['ContentLength']
+            if size != session.total_size:
+                raise UploadError("Uploaded size does not match.", status=409, retryable=False)
+            # The bytes never passed through us; hashing would mean downloading
+            # them, so multipart uploads are stored as they are, never shared
+            metadata = {'file_size': size, 'content_type': session.content_type, 'checksum': '',
+                        'image_width': None, 'image_height': None}
+            return adopt_blob(session.storage_name, metadata), metadata
+        except Exception as e:
+            try:
+                client.delete_object(Bucket=bucket, Key=key)
+            except Exception as cleanup_error:
+                print(f"Could not delete {key} of upload {session.id}: {cleanup_error}")
+            if isinstance(e, UploadError):
+                raise
+            print(f"Could not finish upload {session.id}: {e}")
+            raise UploadError("Could not finish the upload.", status=502, retryable=False) from e
+
+    if session.received_bytes != session.total_size:
+        raise UploadError(f"Upload incomplete at offset {session.received_bytes}.", status=409)
+    path = _partial_path(session)
+    with open(path, 'rb') as partial:
+        metadata = attachment_metadata(File(partial), name=session.file_name, content_type=session.content_type)
+    with open(path, 'rb') as partial:
+        blob = store_blob(_PartialFile(partial), session.file_name, metadata)
+    session.storage_name = blob.name
+    if os.path.exists(path):
+        os.remove(path)
+    return blob, metadata
+
+
+def abort_upload(session):
+    """
+    Abort a pending (or claimed) upload and free what it staged. Returns
+    False, touching nothing, if another request got to the session first.
+    """
+    if not claim_upload(session, UploadSession.Status.ABORTED):
+        return False
+    if session.mode == UploadSession.Mode.MULTIPART:
+        client, bucket = _s3()
+        client.abort_multipart_upload(
+            Bucket=bucket, Key=_s3_key(session.storage_name), UploadId=session.multipart_upload_id,
+        )
+    else:
+        try:
+            os.remove(_partial_path(session))
+        except FileNotFoundError:
+            pass
+    return True
@@ -16,6 +16,7 @@ urlpatterns = [
     path('dashboard/', views.dashboard_view, name='dashboard'),
     path('dashboard/<int:contact_id>/', views.dashboard_view, name='dashboard_chat'),
     path('dashboard/group/<int:group_id>/', views.dashboard_view, name='dashboard_group_chat'),
+    path('chat/<str:chat_type>/<int:chat_id>/', views.conversation_view, name='conversation'),
     
     # Group Management
     path('create-group/', views.create_group_view, name='create_group'),
@@ -32,4 +33,13 @@ urlpatterns = [
 
     # Attachments
     path('chat/<str:chat_type>/<int:chat_id>/attachment/', views.upload_attachment_view, name='upload_attachment'),
+    path('attachments/<str:chat_type>/<int:message_id>/', views.attachment_view, name='attachment'),
+    path('chat/<str:chat_type>/<int:chat_id>/attachment/uploads/', views.start_attachment_upload_view, name='start_attachment_upload'),
+    path('uploads/<uuid:upload_id>/', views.attachment_upload_view, name='attachment_upload'),
+    path('uploads/<uuid:upload_id>/chunk/', views.attachment_upload_chunk_view, name='attachment_upload_chunk'),
+    path('uploads/<uuid:upload_id>/complete/', views.complete_attachment_upload_view, name='complete_attachment_upload'),
+    path('uploads/<uuid:upload_id>/abort/', views.abort_attachment_upload_view, name='abort_attachment_upload'),
+
+    # Operations
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
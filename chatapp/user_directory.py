@@ -0,0 +1,246 @@
+# chatapp/user_directory.py
+
+import base64
+import hashlib
+import json
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router
+from django.db.models import Case, F, FloatField, Func, IntegerField, Q, Value, When
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from . import metrics
+from .identity import identity_cache, avatar_urls
+from .models import Profile, Group, UserDirectoryEntry
+
+CONTACT_BOOST = 40
+CO_MEMBER_BOOST = 20
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _entry_fields(user, profile):
+    username = user.username.lower()
+    display_name = ((profile.display_name if profile else None) or '').lower()
+    email = (user.email or '').lower()
+    return {
+        'username': username,
+        'display_name': display_name,
+        'email': email,
+        'search_text': ' '.join(part for part in (username, display_name, email) if part),
+    }
+
+
+# User saves always re-save the profile (models.save_user_profile), so
+# hooking Profile covers username/email changes as well.
+@receiver(post_save, sender=Profile)
+def sync_directory_entry(sender, instance, **kwargs):
+    UserDirectoryEntry.objects.update_or_create(
+        user_id=instance.user_id, defaults=_entry_fields(instance.user, instance)
+    )
+
+
+def _normalize(query):
+    return ' '.join((query or '').lower().split())
+
+
+# Shortest token the trigram index can look up; shorter ones are a LIKE scan
+TRIGRAM = 3
+
+
+def _sqlite_filter(query):
+    """
+    (WHERE clause, params) requiring every token of `query` somewhere in
+    search_text: "lic do" -> MATCH '"lic"' AND LIKE '%do%'.
+    """
+    tokens = TOKEN_RE.findall(query)
+    indexed = [token for token in tokens if len(token) >= TRIGRAM]
+    clauses, params = [], []
+    if indexed:
+        clauses.append("chatapp_userdirectory_fts MATCH %s")
+        params.append(' AND '.join(f'"{token}"' for token in indexed))
+    for token in tokens:
+        if len(token) < TRIGRAM:
+            clauses.append("f.search_text LIKE %s")
+            params.append(f'%{token}%')
+    return ' AND '.join(clauses), params
+
+
+def _fetch_candidates(query, limit):
+    """
+    (user_id, username, display_name, email) rows matching `query`, the
+    best `limit` matches first: exact username, then username, display
+    name and email prefixes, then text relevance (FTS5 bm25 / pg_trgm
+    similarity), so the cap never cuts a strong match.
+    """
+    db = router.db_for_read(UserDirectoryEntry)
+    connection = connections[db]
+    if connection.vendor == 'sqlite':
+        where, params = _sqlite_filter(query)
+        if not where:
+            return []
+        # bm25() only exists when the statement has a MATCH
+        relevance = "bm25(chatapp_userdirectory_fts), " if 'MATCH' in where else ""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT e.user_id, e.username, e.display_name, e.email "
+                "FROM chatapp_userdirectory_fts f "
+                "JOIN chatapp_userdirectoryentry e ON e.user_id = f.rowid "
+                f"WHERE {where} "
+                "ORDER BY CASE WHEN e.username = %s THEN 0 "
+                "WHEN substr(e.username, 1, length(%s)) = %s THEN 1 "
+                "WHEN substr(e.display_name, 1, length(%s)) = %s THEN 2 "
+                "WHEN substr(e.email, 1, length(%s)) = %s THEN 3 ELSE 4 END, "
+                f"{relevance}e.username LIMIT %s",
+                params + [query] * 7 + [limit],
+            )
+            return [tuple(row) for row in cursor.fetchall()]
+    # Postgres serves these from the text_pattern_ops and pg_trgm indexes
+    return list(
+        UserDirectoryEntry.objects.using(db).filter(
+            Q(username__startswith=query) | Q(display_name__startswith=query) |
+            Q(email__startswith=query) | Q(search_text__contains=query)
+        ).annotate(
+            prefix_rank=Case(
+                When(username=query, then=0),
+                When(username__startswith=query, then=1),
+                When(display_name__startswith=query, then=2),
+                When(email__startswith=query, then=3),
+                default=4,
+                output_field=IntegerField(),
+            ),
+            similarity=Func(F('search_text'), Value(query), function='similarity', output_field=FloatField()),
+        ).order_by('prefix_rank', '-similarity', 'username')
+        .values_list('user_id', 'username', 'display_name', 'email')[:limit]
+    )
+
+
+def _related_matches(viewer_id, query, limit):
+    """
+    Rows as _fetch_candidates() for the viewer's own contacts and group
+    co-members matching every token of `query`, so the people they know
+    are found even when strangers fill the shared candidate list.
+    """
+    related = (
+        Q(user_id__in=Profile.contacts.through.objects.filter(
+            from_profile__user_id=viewer_id).values('to_profile__user_id')) |
+        Q(user_id__in=Group.members.through.objects.filter(
+            group__members__id=viewer_id).values('user_id'))
+    )
+    matches = UserDirectoryEntry.objects.filter(related)
+    for token in TOKEN_RE.findall(query):
+        matches = matches.filter(search_text__contains=token)
+    return list(matches.values_list('user_id', 'username', 'display_name', 'email')[:limit])
+
+
+def _match_score(query, username, display_name, email):
+    if username == query:
+        return 100
+    if username.startswith(query):
+        return 80
+    if display_name.startswith(query):
+        return 60
+    if email.startswith(query):
+        return 50
+    words = TOKEN_RE.findall(f'{username} {display_name} {email}')
+    if any(word.startswith(query) for word in words):
+        return 30
+    if query in username or query in display_name or query in email:
+        return 15
+    # Every token matched somewhere, just not as one phrase
+    return 5
+
+
+def _candidates(query):
+    """Scored candidates for `query`, shared by all viewers for a few seconds."""
+    key = 'user_directory:' + hashlib.sha1(query.encode('utf-8')).hexdigest()
+    candidates = cache.get(key)
+    if candidates is not None:
+        metrics.incr('user_directory.cache_hits')
+        return candidates
+    metrics.incr('user_directory.cache_misses')
+    rows = _fetch_candidates(query, getattr(settings, 'USER_SEARCH_CANDIDATES', 200))
+    candidates = [(user_id, username, _match_score(query, username, display_name, email))
+                  for user_id, username, display_name, email in rows]
+    cache.set(key, candidates, getattr(settings, 'USER_SEARCH_CACHE_SECONDS', 30))
+    return candidates
+
+
+def _relationship_boosts(viewer_id, user_ids):
+    """{user_id: boost} for the viewer's contacts and group co-members, in one query."""
+    if not user_ids:
+        return {}
+    contacts = Profile.contacts.through.objects.filter(
+        from_profile__user_id=viewer_id, to_profile__user_id__in=user_ids
+    ).annotate(boost=Value(CONTACT_BOOST, output_field=IntegerField())).values_list('to_profile__user_id', 'boost')
+    co_members = Group.members.through.objects.filter(
+        group__members__id=viewer_id, user_id__in=user_ids
+    ).annotate(boost=Value(CO_MEMBER_BOOST, output_field=IntegerField())).values_list('user_id', 'boost')
+    boosts = {}
+    for user_id, boost in contacts.union(co_members):
+        boosts[user_id] = max(boosts.get(user_id, 0), boost)
+    return boosts
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        score, username, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return (int(score), str(username), int(user_id))
+    except (ValueError, TypeError, UnicodeError):
+        return None
+
+
+def search_directory(viewer_id, query, cursor=None, limit=None):
+    """
+    Ranked page of users matching `query` for `viewer_id`.
+
+    Returns (results, next_cursor); each result is an identity dict (see
+    chatapp/identity.py) plus `avatar_url` and `is_contact`. Contacts and group co-members
+    are always candidates and rank above strangers with an equally good match. Pages are keyset
+    paginated on (rank, username, id), so a page boundary does not shift
+    when the cached candidate list is refreshed.
+    """
+    query = _normalize(query)
+    limit = limit or getattr(settings, 'USER_SEARCH_PAGE_SIZE', 20)
+    if not query:
+        return [], None
+
+    candidates = _candidates(query)
+    seen = {user_id for user_id, _, _ in candidates}
+    cap = getattr(settings, 'USER_SEARCH_CANDIDATES', 200)
+    candidates = candidates + [
+        (user_id, username, _match_score(query, username, display_name, email))
+        for user_id, username, display_name, email in _related_matches(viewer_id, query, cap)
+        if user_id not in seen
+    ]
+    candidates = [c for c in candidates if c[0] != viewer_id]
+    boosts = _relationship_boosts(viewer_id, [user_id for user_id, _, _ in candidates])
+    ranked = sorted(
+        (-(score + boosts.get(user_id, 0)), username, user_id)
+        for user_id, username, score in candidates
+    )
+    after = decode_cursor(cursor) if cursor else None
+    if after is not None:
+        ranked = [key for key in ranked if key > after]
+
+    page = ranked[:limit]
+    identities = identity_cache.get_many([user_id for _, _, user_id in page])
+    urls = avatar_urls(identities.values())
+    results = []
+    for _, _, user_id in page:
+        identity = identities.get(user_id)
+        if identity is not None:
+            results.append(dict(
+                identity,
+                avatar_url=urls.get(identity['avatar_name'], ''),
+                is_contact=boosts.get(user_id) == CONTACT_BOOST,
+            ))
+    next_cursor = encode_cursor(list(page[-1])) if len(ranked) > limit else None
+    return results, next_cursor
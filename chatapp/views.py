@@ -1,34 +1,60 @@
 # chatapp/views.py
 
+import json
+from functools import partial
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Count, Q
 from django.contrib import messages
 from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseForbidden
 from django.utils import timezone
-from django.views.decorators.http import require_POST
+from django.utils.functional import SimpleLazyObject
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.urls import reverse
+from django.views.decorators.http import require_POST, require_http_methods
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
-from django.template.loader import render_to_string
 # --- UPDATED IMPORTS ---
 from .forms import (
     SignUpForm, ProfileUpdateForm, CreateGroupForm,
     ChangeGroupNameForm, AddGroupMemberForm, RemoveGroupMemberForm
 )
-from .models import ContactRequest, Profile, Message, Group, GroupMessage
+from .models import ContactRequest, Profile, Message, Group, GroupMessage, UploadSession
+from . import metrics
+from .rooms import direct_room_key, group_room_key
+from .db_routers import replica_view
+from .identity import get_identity
+from .room_access import can_access
+from .user_directory import search_directory
+from .attachments import attachment_metadata
+from .blobs import store_blob
+from .rendering import prepare_bodies
+from .conversations import (
+    conversation_version, conversation_page, page_people, conversation_etag, conversation_payload, message_room_key,
+)
+from .fragments import sidebar_version, sidebar_rooms, fragment_timeout
+from .activity import activity_version, sidebar_activity
+from .storage import file_urls, prefetch_file_urls
+from .thumbnails import prefetch_variant_urls, queue_attachment_thumbnails
+from .uploads import (
+    UploadError, start_upload, upload_state, append_chunk, claim_upload, complete_upload, abort_upload,
+)
 
 
 def _build_workspace_key(chat_type, current_user_id, chat_id):
     if not chat_type or not chat_id:
         return None
     if chat_type == '1on1':
-        ordered = sorted([current_user_id, int(chat_id)])
-        return f"chat_{ordered[0]}_{ordered[1]}"
+        return direct_room_key(current_user_id, chat_id)
     if chat_type == 'group':
-        return f"group_{chat_id}"
+        return group_room_key(chat_id)
     return None
 
 
@@ -75,111 +101,189 @@ def logout_view(request):
     return redirect('chatapp:home') 
 
 # --- REPLACED: Dashboard View (Handles 1-to-1 and Group) ---
+def _sidebar_contacts(user):
+    contacts = list(user.profile.contacts.select_related('user'))
+    prefetch_file_urls([contact.profile_picture for contact in contacts])
+    prefetch_variant_urls(contacts, ('sm',))
+    return contacts
+
+
+def _page_messages(queryset):
+    # The newest page, oldest first: the same messages conversation_page holds
+    page = list(reversed(queryset.order_by('-id')[:settings.CONVERSATION_PAGE_SIZE]))
+    return prepare_bodies(page)
+
+
 @login_required
+@replica_view
 def dashboard_view(request, contact_id=None, group_id=None):
-    # Optimize: Use select_related to avoid N+1 queries
-    profile = request.user.profile
-    contacts_profiles = profile.contacts.select_related('user').all()
-    user_groups = request.user.chat_groups.prefetch_related('members', 'creator').all()
-    incoming_requests = ContactRequest.objects.filter(
-        to_user=request.user
-    ).select_related('from_user', 'from_user__profile')
-    
+    """
+    The sidebar, its last-message previews and the message list are cached
+    template fragments (see fragments.py, activity.py and conversations.py
+    for their versions). Their data is
+    only loaded, lazily, when a fragment has to be rendered again.
+    """
+    user = request.user
+    version = sidebar_version(user.id)
+    rooms = sidebar_rooms(user.id, version)
     context = {
-        'contacts': contacts_profiles,
-        'groups': user_groups,
-        'incoming_requests': incoming_requests,
+        'contacts': SimpleLazyObject(lambda: _sidebar_contacts(user)),
+        # Annotated before filtering, so the count is not limited to the viewer's own row
+        'groups': SimpleLazyObject(
+            lambda: list(Group.objects.annotate(member_count=Count('members')).filter(members=user))
+        ),
+        'incoming_requests': SimpleLazyObject(
+            lambda: list(ContactRequest.objects.filter(to_user=user).select_related('from_user'))
+        ),
+        'sidebar_version': version,
+        # A callable, so the template only runs the query when the fragment is stale
+        'sidebar_activity': partial(sidebar_activity, user.id, rooms),
+        'activity_version': activity_version(rooms),
+        'fragment_timeout': fragment_timeout(),
         'selected_contact': None,
         'selected_group': None,
         'messages': [],
+        'messages_version': None,
         'chat_type': None,
         'chat_id': None,
         'workspace_key': None,
     }
 
     if contact_id:
-        try:
-            # Optimize: Use select_related to fetch user in same query
-            selected_contact_profile = Profile.objects.select_related('user').get(user__id=contact_id)
-            selected_contact_user = selected_contact_profile.user
-            
-            if selected_contact_profile in contacts_profiles:
-                context['selected_contact'] = selected_contact_profile
-                
-                # Optimize: Use select_related for sender/receiver, limit to last 100 messages
-                messages_query = Message.objects.filter(
-                    (Q(sender=request.user) & Q(receiver=selected_contact_user)) |
-                    (Q(sender=selected_contact_user) & Q(receiver=request.user))
-                ).select_related('sender', 'sender__profile', 'receiver', 'receiver__profile').order_by('-timestamp')[:100]
-                # Reverse to show oldest first
-                context['messages'] = list(reversed(messages_query))
-                context['chat_type'] = '1on1'
-                context['chat_id'] = selected_contact_profile.user.id
-            else:
-                messages.error(request, "This user is not in your contact list.")
-                return redirect('chatapp:dashboard')
-        except Profile.DoesNotExist:
+        selected_contact = Profile.objects.select_related('user').filter(user_id=contact_id).first()
+        if selected_contact is None:
             messages.error(request, "User profile not found.")
             return redirect('chatapp:dashboard')
-            
+        room_key = direct_room_key(user.id, contact_id)
+        if not can_access(user.id, room_key):
+            messages.error(request, "This user is not in your contact list.")
+            return redirect('chatapp:dashboard')
+        prefetch_file_urls([selected_contact.profile_picture])
+        prefetch_variant_urls([selected_contact], ('sm',))
+        context['selected_contact'] = selected_contact
+        context['messages'] = SimpleLazyObject(lambda: _page_messages(Message.objects.filter(
+            Q(sender=user, receiver_id=contact_id) | Q(sender_id=contact_id, receiver=user)
+        ).select_related('sender', 'sender__profile')))
+        context['chat_type'] = '1on1'
+        context['chat_id'] = contact_id
+
     elif group_id:
-        try:
-            # Optimize: Use select_related and prefetch_related
-            selected_group = Group.objects.prefetch_related('members', 'creator').get(id=group_id)
-            if selected_group in user_groups:
-                context['selected_group'] = selected_group
-                # Optimize: Use select_related for sender, limit to last 100 messages
-                # Force evaluation and ensure profile is loaded
-                group_messages = selected_group.messages.select_related(
-                    'sender', 'sender__profile'
-                ).order_by('-timestamp')[:100]
-                # Convert to list and ensure profile is accessed to trigger loading
-                messages_list = []
-                for msg in reversed(group_messages):
-                    # Force profile access to ensure it's loaded
-                    _ = msg.sender.profile.display_name if hasattr(msg.sender, 'profile') else None
-                    messages_list.append(msg)
-                context['messages'] = messages_list
-                context['chat_type'] = 'group'
-                context['chat_id'] = selected_group.id
-            else:
-                messages.error(request, "You are not a member of this group.")
-                return redirect('chatapp:dashboard')
-        except Group.DoesNotExist:
+        selected_group = Group.objects.annotate(member_count=Count('members')).filter(id=group_id).first()
+        if selected_group is None:
             messages.error(request, "Group not found.")
             return redirect('chatapp:dashboard')
+        room_key = group_room_key(group_id)
+        if not can_access(user.id, room_key):
+            messages.error(request, "You are not a member of this group.")
+            return redirect('chatapp:dashboard')
+        context['selected_group'] = selected_group
+        context['messages'] = SimpleLazyObject(lambda: _page_messages(
+            selected_group.messages.select_related('sender', 'sender__profile')
+        ))
+        context['chat_type'] = 'group'
+        context['chat_id'] = group_id
+
+    context['workspace_key'] = _build_workspace_key(context['chat_type'], user.id, context['chat_id'])
+    if context['workspace_key']:
+        # Keyed like the chat-switch ETag: room version, viewer, the identities
+        # shown and signed-URL freshness
+        room_key = context['workspace_key']
+        version = conversation_version(room_key)
+        page = conversation_page(room_key, version)
+        context['messages_version'] = conversation_etag(
+            room_key, user.id, version, page_people(room_key, user.id, page)
+        ).strip('"')
 
-    context['workspace_key'] = _build_workspace_key(
-        context.get('chat_type'),
-        request.user.id,
-        context.get('chat_id')
-    )
+    return render(request, 'chatapp/dashboard.html', context)
+# --- End of Replaced View ---
 
-    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        chat_html = render_to_string('chatapp/partials/chat_area.html', context, request=request)
-        workspace_html = render_to_string('chatapp/partials/workspace_panel.html', context, request=request)
-        return JsonResponse({
-            'chat_html': chat_html,
-            'workspace_html': workspace_html,
-            'chat_type': context.get('chat_type'),
-            'chat_id': context.get('chat_id'),
-            'workspace_key': context.get('workspace_key'),
+
+@login_required
+@replica_view
+def conversation_view(request, chat_type, chat_id):
+    """
+    Chat switch as JSON: header, people and a compact page of messages.
+    The ETag covers the room version, the identities shown and signed-URL
+    freshness, so switching back to an unchanged chat is a 304 without a
+    single message query. `?before=<message id>` pages back.
+    """
+    if chat_type not in ('1on1', 'group'):
+        return HttpResponseBadRequest("Invalid chat type.")
+    room_key = _chat_room_key(request, chat_type, chat_id)
+    if not room_key:
+        return HttpResponseForbidden("Not allowed to view this chat.")
+    try:
+        before = int(request.GET['before']) if request.GET.get('before') else None
+    except ValueError:
+        return HttpResponseBadRequest("Invalid cursor.")
+
+    version = conversation_version(room_key)
+    page = conversation_page(room_key, version, before)
+    people = page_people(room_key, request.user.id, page)
+    etag = conversation_etag(room_key, request.user.id, version, people, before)
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        data = conversation_payload(room_key, request.user.id, page, people)
+        data.update({
+            'chat_type': chat_type,
+            'chat_id': chat_id,
+            'workspace_key': room_key,
+            'upload_url': reverse('chatapp:upload_attachment', args=[chat_type, chat_id]),
+            'upload_start_url': reverse('chatapp:start_attachment_upload', args=[chat_type, chat_id]),
         })
+        if chat_type == 'group' and data['header'] and data['header'].get('creator_id') == request.user.id:
+            data['header']['manage_urls'] = {
+                'edit': reverse('chatapp:edit_group', args=[chat_id]),
+                'add_members': reverse('chatapp:add_group_members', args=[chat_id]),
+                'remove_members': reverse('chatapp:remove_group_members', args=[chat_id]),
+                'delete': reverse('chatapp:delete_group', args=[chat_id]),
+            }
+        response = JsonResponse(data)
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
 
-    return render(request, 'chatapp/dashboard.html', context)
-# --- End of Replaced View ---
+
+@login_required
+@replica_view
+def attachment_view(request, chat_type, message_id):
+    """
+    Stable link to a message attachment, or with `?variant=md|lg` to its
+    preview (the original until that exists). Redirects to a freshly signed
+    storage URL, so pre-rendered message bodies never hold one that expires.
+    """
+    model = {'1on1': Message, 'group': GroupMessage}.get(chat_type)
+    if model is None:
+        return HttpResponseBadRequest("Invalid chat type.")
+    message = get_object_or_404(
+        model.objects.defer('content', 'rendered_html').exclude(file=''), pk=message_id, is_deleted=False
+    )
+    if not can_access(request.user.id, message_room_key(message)):
+        return HttpResponseForbidden("Not allowed to view this attachment.")
+
+    name = message.file.name
+    found = (message.thumbnails or {}).get(request.GET.get('variant'))
+    if isinstance(found, dict) and found.get('name'):
+        name = found['name']
+    response = redirect(file_urls(default_storage, [name])[name])
+    # Presigned URLs are handed out with at least the refresh margin left
+    max_age = settings.SIGNED_URL_REFRESH_MARGIN // 2 if getattr(default_storage, 'querystring_auth', False) else 3600
+    patch_cache_control(response, private=True, max_age=max_age)
+    return response
 
 
 @login_required
+@replica_view
 def search_users_view(request):
     query = request.GET.get('q')
-    results = []
-    if query:
-        # Optimize: Use select_related to avoid N+1 queries when accessing profile
-        results = User.objects.filter(
-            Q(username__icontains=query)
-        ).select_related('profile').exclude(username=request.user.username)[:50]  # Limit results
-    context = {'results': results}
+    cursor = request.GET.get('cursor')
+    results, next_cursor = search_directory(request.user.id, query, cursor=cursor)
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        # Type-ahead: just the page and where the next one starts
+        return JsonResponse({'results': results, 'next_cursor': next_cursor})
+    context = {'results': results, 'next_cursor': next_cursor}
     return render(request, 'chatapp/search_results.html', context)
 
 @login_required
@@ -416,35 +520,29 @@ def delete_group_view(request, group_id):
     return redirect('chatapp:dashboard')
 
 
-@login_required
-@require_POST
-def upload_attachment_view(request, chat_type, chat_id):
-    if chat_type not in ('1on1', 'group'):
-        return HttpResponseBadRequest("Invalid chat type.")
-
-    uploaded_file = request.FILES.get('file')
-    caption = request.POST.get('caption', '').strip()
+def _chat_room_key(request, chat_type, chat_id):
+    """Room key of the chat if the user may read and post in it, else None."""
+    room_key = _build_workspace_key(chat_type, request.user.id, chat_id)
+    if room_key and can_access(request.user.id, room_key):
+        return room_key
+    return None
 
-    if not uploaded_file:
-        return HttpResponseBadRequest("No file provided.")
 
+def _post_attachment_message(request, chat_type, chat_id, room_key, caption, blob, file_name, metadata):
+    """Create the chat message for a stored attachment blob and broadcast it to the room."""
     channel_layer = get_channel_layer()
     timestamp = timezone.now().strftime("%I:%M %p")
 
     if chat_type == '1on1':
-        contact_profile = get_object_or_404(Profile, user__id=chat_id)
-        user_profile = request.user.profile
-        if not user_profile.contacts.filter(user=contact_profile.user).exists():
-            return HttpResponseForbidden("Not allowed to upload in this chat.")
-
         message = Message.objects.create(
             sender=request.user,
-            receiver=contact_profile.user,
+            receiver_id=chat_id,
             content=caption,
-            file=uploaded_file,
-            file_name=uploaded_file.name
+            file=blob.name,
+            blob=blob,
+            file_name=file_name,
+            **metadata
         )
-        room_key = _build_workspace_key('1on1', request.user.id, contact_profile.user.id)
         event_payload = {
             'type': 'chat_message',
             'message_id': message.id,
@@ -452,42 +550,195 @@ def upload_attachment_view(request, chat_type, chat_id):
             'sender_username': request.user.username,
             'timestamp': timestamp,
             'attachment_url': message.file.url if message.file else '',
-            'attachment_name': message.file_name or uploaded_file.name,
-            'sender_display_name': request.user.profile.display_name or request.user.username,
+            'attachment_name': message.file_name,
+            'attachment_content_type': message.content_type,
+            'sender_display_name': get_identity(request.user.id)['display_name'],
+            'html': message.rendered_html,
         }
     else:
-        group = get_object_or_404(Group, id=chat_id)
-        if not group.members.filter(id=request.user.id).exists():
-            return HttpResponseForbidden("Not allowed to upload in this group.")
-
         message = GroupMessage.objects.create(
-            group=group,
+            group_id=chat_id,
             sender=request.user,
             content=caption,
-            file=uploaded_file,
-            file_name=uploaded_file.name
+            file=blob.name,
+            blob=blob,
+            file_name=file_name,
+            **metadata
         )
-        room_key = _build_workspace_key('group', request.user.id, group.id)
         event_payload = {
             'type': 'group_chat_message',
             'message_id': message.id,
             'message': message.content,
             'sender_username': request.user.username,
-            'sender_display_name': request.user.profile.display_name or request.user.username,
+            'sender_display_name': get_identity(request.user.id)['display_name'],
             'timestamp': timestamp,
             'attachment_url': message.file.url if message.file else '',
-            'attachment_name': message.file_name or uploaded_file.name,
+            'attachment_name': message.file_name,
+            'attachment_content_type': message.content_type,
+            'html': message.rendered_html,
         }
 
     async_to_sync(channel_layer.group_send)(
         room_key,
         event_payload
     )
+    # Previews follow as an attachment_thumbnails event once they are rendered
+    queue_attachment_thumbnails(message, room_key)
 
     return JsonResponse({
         'success': True,
         'message_id': message.id,
-        'attachment_name': message.file_name or uploaded_file.name,
+        'attachment_name': message.file_name,
         'attachment_url': message.file.url if message.file else '',
+        'attachment_size': message.file_size,
         'timestamp': timestamp,
-    })
\ No newline at end of file
+    })
+
+
+@login_required
+@require_POST
+def upload_attachment_view(request, chat_type, chat_id):
+    if chat_type not in ('1on1', 'group'):
+        return HttpResponseBadRequest("Invalid chat type.")
+
+    uploaded_file = request.FILES.get('file')
+    caption = request.POST.get('caption', '').strip()
+
+    if not uploaded_file:
+        return HttpResponseBadRequest("No file provided.")
+
+    room_key = _chat_room_key(request, chat_type, chat_id)
+    if not room_key:
+        return HttpResponseForbidden("Not allowed to upload in this chat.")
+
+    # Read the upload once here instead of HEAD-ing storage on every render
+    metadata = attachment_metadata(uploaded_file)
+    # A file someone already shared is referenced, not stored again
+    blob = store_blob(uploaded_file, uploaded_file.name, metadata)
+    return _post_attachment_message(
+        request, chat_type, chat_id, room_key, caption, blob, uploaded_file.name, metadata
+    )
+
+
+# --- Resumable / direct-to-storage uploads (see chatapp/uploads.py) ---
+
+def _json_body(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+
+
+def _pending_upload(request, upload_id):
+    return get_object_or_404(
+        UploadSession, id=upload_id, user=request.user, status=UploadSession.Status.PENDING
+    )
+
+
+@login_required
+@require_POST
+def start_attachment_upload_view(request, chat_type, chat_id):
+    if chat_type not in ('1on1', 'group'):
+        return HttpResponseBadRequest("Invalid chat type.")
+    if not _chat_room_key(request, chat_type, chat_id):
+        return HttpResponseForbidden("Not allowed to upload in this chat.")
+    data = _json_body(request)
+    if not data or not data.get('file_name'):
+        return HttpResponseBadRequest("file_name and size are required.")
+    try:
+        session = start_upload(
+            request.user, chat_type, chat_id,
+            file_name=str(data['file_name']),
+            total_size=int(data.get('size') or 0),
+            content_type=str(data.get('content_type') or ''),
+            caption=str(data.get('caption') or '').strip(),
+        )
+    except (TypeError, ValueError):
+        return HttpResponseBadRequest("Invalid size.")
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    return JsonResponse(upload_state(session), status=201)
+
+
+@login_required
+def attachment_upload_view(request, upload_id):
+    """Current state of an upload, with fresh part URLs / the offset to resume from."""
+    session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+    return JsonResponse(upload_state(session))
+
+
+@login_required
+@require_http_methods(['PUT'])
+def attachment_upload_chunk_view(request, upload_id):
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return HttpResponseBadRequest("Upload-Offset and Content-Length are required.")
+    session = get_object_or_404(
+        UploadSession, id=upload_id, user=request.user, status=UploadSession.Status.PENDING,
+        mode=UploadSession.Mode.CHUNKED,
+    )
+    try:
+        received = append_chunk(session, offset, request, length)
+    except UploadError as e:
+        return JsonResponse({'error': str(e), 'offset': session.received_bytes}, status=e.status)
+    return JsonResponse({'offset': received})
+
+
+@login_required
+@require_POST
+def complete_attachment_upload_view(request, upload_id):
+    data = _json_body(request)
+    if data is None:
+        return HttpResponseBadRequest("Invalid JSON.")
+    try:
+        parts = [
+            {'PartNumber': int(part['part_number']), 'ETag': str(part['etag'])}
+            for part in data.get('parts') or []
+        ]
+    except (KeyError, TypeError, ValueError):
+        return HttpResponseBadRequest("Invalid parts.")
+    session = _pending_upload(request, upload_id)
+    # Claim it first; the storage calls and hashing below then run without
+    # a transaction or row lock held
+    if not claim_upload(session, UploadSession.Status.COMPLETING):
+        return JsonResponse({'error': "Upload is no longer pending."}, status=409)
+    # Membership may have changed while the upload was running
+    room_key = _chat_room_key(request, session.chat_type, session.chat_id)
+    if not room_key:
+        abort_upload(session)
+        return HttpResponseForbidden("Not allowed to upload in this chat.")
+    try:
+        blob, metadata = complete_upload(session, parts)
+    except Exception as e:
+        if isinstance(e, UploadError) and not e.retryable:
+            # Nothing left to resume (e.g. the multipart upload was completed)
+            claim_upload(session, UploadSession.Status.ABORTED)
+        else:
+            # Hand it back so the client can resume or retry
+            claim_upload(session, UploadSession.Status.PENDING)
+        if isinstance(e, UploadError):
+            return JsonResponse({'error': str(e)}, status=e.status)
+        raise
+    claim_upload(session, UploadSession.Status.COMPLETED, storage_name=session.storage_name)
+    # Only now does the room hear about it
+    return _post_attachment_message(
+        request, session.chat_type, session.chat_id, room_key, session.caption,
+        blob, session.file_name, metadata,
+    )
+
+
+@login_required
+@require_POST
+def abort_attachment_upload_view(request, upload_id):
+    session = _pending_upload(request, upload_id)
+    if not abort_upload(session):
+        return JsonResponse({'error': "Upload is no longer pending."}, status=409)
+    return JsonResponse({'status': session.status})
+
+
+@staff_member_required
+def metrics_view(request):
+    """Process-local counters and gauges (cache hit ratios, etc.) as JSON."""
+    return JsonResponse(metrics.snapshot())
@@ -4,6 +4,7 @@ import os
 from typing import Optional, Dict, Any
 
 from django.db import transaction
+from django.utils import timezone
 
 from django.contrib.auth import get_user_model
 from .models import WorkspaceNode
@@ -210,4 +211,203 @@ def extract_code_blocks(text: str) -> list[dict[str, str]]:
                 'content': text.strip()
             })
     
-    return blocks
\ No newline at end of file
+    return blocks
+
+LANGUAGE_ALIASES = {
+    'py': 'python',
+    'python3': 'python',
+    'js': 'javascript',
+    'md': 'markdown',
+    'txt': 'text',
+    'htm': 'html',
+}
+
+EXTENSION_BY_LANGUAGE: Dict[str, str] = {}
+for _extension, _language in LANGUAGE_BY_EXTENSION.items():
+    EXTENSION_BY_LANGUAGE.setdefault(_language, _extension)
+
+
+def _block_language(language: Optional[str]) -> Optional[str]:
+    language = LANGUAGE_ALIASES.get((language or '').lower(), (language or '').lower())
+    return language if language in EXTENSION_BY_LANGUAGE else None
+
+
+def _block_filename(block: dict[str, str]) -> str:
+    # A bare ```main.py fence is parsed as a language; treat it as the filename
+    filename = block['filename'] or (block['language'] if '.' in block['language'] else '')
+    return normalize_path(filename)
+
+
+def _is_safe_path(path: str) -> bool:
+    return bool(path) and not any(segment in ('.', '..') for segment in path.split('/'))
+
+
+def build_changeset(
+    target_type: str,
+    target_path: str,
+    blocks: list[dict[str, str]],
+    language: Optional[str] = None,
+) -> list[dict[str, str]]:
+    """
+    Turn the code blocks of a /Collab file|folder answer into a changeset:
+    a list of {path, language, content}, at most one entry per path.
+    """
+    base = normalize_path(target_path or '')
+    if not _is_safe_path(base) or not blocks:
+        return []
+
+    if target_type == 'file':
+        name = base.rsplit('/', 1)[-1]
+        block = next(
+            (b for b in blocks if _block_filename(b).endswith(name)),
+            blocks[0],
+        )
+        resolved = _block_language(language) or guess_language(name, fallback=_block_language(block['language']) or 'text')
+        return [{'path': base, 'language': resolved, 'content': block['content']}]
+
+    changes: Dict[str, Dict[str, str]] = {}
+    for index, block in enumerate(blocks, start=1):
+        block_language = _block_language(block['language'])
+        filename = _block_filename(block)
+        if filename.startswith(base + '/'):
+            filename = filename[len(base) + 1:]  # The model repeated the folder name
+        if not _is_safe_path(filename):
+            filename = f"file{index}{EXTENSION_BY_LANGUAGE.get(block_language or 'text', '.txt')}"
+        path = f"{base}/{filename}"
+        changes[path] = {
+            'path': path,
+            'language': guess_language(filename, fallback=block_language or 'text'),
+            'content': block['content'],
+        }
+    return list(changes.values())
+
+
+@transaction.atomic
+def apply_changeset(workspace_key: str, changes: list[dict[str, str]], *, user: User) -> Dict[str, Any]:
+    """
+    Apply a changeset in one transaction with a fixed number of queries:
+    the workspace tree is loaded once, missing folders are bulk-created one
+    depth level at a time, and files are bulk-created / bulk-updated.
+
+    Paths that collide with a node of the other type are skipped.
+    Returns {created, updated, skipped} (lists of paths) and changed_ids.
+    """
+    nodes = list(
+        WorkspaceNode.objects.filter(workspace_key=workspace_key)
+        .only('id', 'name', 'parent_id', 'node_type', 'position')
+    )
+    by_key = {(node.parent_id, node.name): node for node in nodes}
+    next_position: Dict[Optional[int], int] = {}
+    for node in nodes:
+        next_position[node.parent_id] = max(next_position.get(node.parent_id, 0), node.position + 1)
+
+    def take_position(parent_id):
+        position = next_position.get(parent_id, 0)
+        next_position[parent_id] = position + 1
+        return position
+
+    # Folders, shallowest first, so each level knows its parents' ids
+    folder_ids: Dict[str, Optional[int]] = {'': None}
+    blocked = set()
+    folder_paths = {
+        '/'.join(change['path'].split('/')[:depth])
+        for change in changes
+        for depth in range(1, change['path'].count('/') + 1)
+    }
+    for depth in sorted({path.count('/') for path in folder_paths}):
+        level = []
+        for path in sorted(p for p in folder_paths if p.count('/') == depth):
+            parent_path, _, name = path.rpartition('/')
+            if parent_path in blocked:
+                blocked.add(path)
+                continue
+            parent_id = folder_ids[parent_path]
+            existing = by_key.get((parent_id, name))
+            if existing is not None:
+                if existing.node_type == WorkspaceNode.NodeType.FOLDER:
+                    folder_ids[path] = existing.id
+                else:
+                    blocked.add(path)
+                continue
+            level.append((path, WorkspaceNode(
+                workspace_key=workspace_key,
+                name=name,
+                node_type=WorkspaceNode.NodeType.FOLDER,
+                parent_id=parent_id,
+                position=take_position(parent_id),
+                language=None,
+                content='',
+                created_by=user,
+            )))
+        WorkspaceNode.objects.bulk_create([node for _, node in level])
+        for path, node in level:
+            folder_ids[path] = node.id
+
+    created, updated, skipped = [], [], []
+    new_files, pending_updates = [], {}
+    for change in changes:
+        parent_path, _, name = change['path'].rpartition('/')
+        if parent_path in blocked:
+            skipped.append(change['path'])
+            continue
+        parent_id = folder_ids[parent_path]
+        existing = by_key.get((parent_id, name))
+        if existing is None:
+            new_files.append(WorkspaceNode(
+                workspace_key=workspace_key,
+                name=name,
+                node_type=WorkspaceNode.NodeType.FILE,
+                parent_id=parent_id,
+                position=take_position(parent_id),
+                language=change['language'],
+                content=change['content'],
+                created_by=user,
+            ))
+            created.append(change['path'])
+        elif existing.node_type != WorkspaceNode.NodeType.FILE:
+            skipped.append(change['path'])
+        else:
+            pending_updates[existing.id] = (existing, change)
+
+    to_update = []
+    if pending_updates:
+        # Only the touched files' contents are loaded, to skip no-op writes
+        current = dict(
+            WorkspaceNode.objects.filter(id__in=pending_updates).values_list('id', 'content')
+        )
+        now = timezone.now()
+        for node_id, (node, change) in pending_updates.items():
+            if current.get(node_id) == change['content']:
+                continue
+            node.content = change['content']
+            node.language = change['language']
+            node.updated_at = now  # bulk_update bypasses auto_now
+            to_update.append(node)
+            updated.append(change['path'])
+
+    WorkspaceNode.objects.bulk_create(new_files)
+    WorkspaceNode.objects.bulk_update(to_update, ['content', 'language', 'updated_at'])
+
+    return {
+        'created': created,
+        'updated': updated,
+        'skipped': skipped,
+        'changed_ids': [node.id for node in new_files] + [node.id for node in to_update],
+    }
+
+
+def workspace_file_list(workspace_key: str) -> list[Dict[str, Any]]:
+    """The tree payload sent to WorkspaceConsumer clients (one query)."""
+    nodes = WorkspaceNode.objects.filter(
+        workspace_key=workspace_key
+    ).only('id', 'name', 'node_type', 'parent_id', 'language').order_by('node_type', 'name')
+    return [
+        {
+            'id': node.id,
+            'name': node.name,
+            'type': node.node_type,
+            'parent_id': node.parent_id,
+            'language': node.language
+        }
+        for node in nodes
+    ]